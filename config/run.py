@@ -16,16 +16,43 @@ SLACK_TOKEN = assets.secret('slack_token')
 SLACK_BOT_ID = assets.secret('slack_bot_id')
 HASS_URI = assets.secret('hass_uri')
 HASS_TOKEN = assets.secret('hass_token')
+LEGO_WATCHLIST_CHANNEL = assets.secret('lego_watchlist_channel')
+SCHEDULE_CHANNEL = assets.secret('schedule_channel')
 
 # Template path
 TPL_LEGO_PRICING = assets.template_path('tpl_lego_pricing.json')
+TPL_LEGO_PRICE_ALERT = assets.template_path('tpl_lego_price_alert.json')
 TPL_HASS_STATE = assets.template_path('tpl_hass_state_change.mako')
 TPL_TRAFFIC_TRAIN = assets.template_path('tpl_traffic_train.mako')
 
+# Data path
+TRAFFIC_HISTORY_DIR = str(assets.assets_dir() / 'traffic_history')
+LEGO_PRICES_DB = str(assets.assets_dir() / 'lego_prices.db')
+SCHEDULE_STATE_FILE = str(assets.assets_dir() / 'schedule.json')
+
+# Lego set id -> price threshold to alert at
+LEGO_WATCHLIST = {
+    42093: 30.0,
+    10265: 120.0
+}
+
 slack_action = actions.slack.SendMessage(token=SLACK_TOKEN)
+traffic_history = services.traffic.TrafficHistory(TRAFFIC_HISTORY_DIR)
+lego_prices = services.lego.PriceHistory(LEGO_PRICES_DB)
+lego_pricing = processors.lego.Pricing(hedger=services.base.Hedger(), history=lego_prices)
+lego_watchlist = listener.lego.Watchlist(lego_pricing, LEGO_WATCHLIST, channel=LEGO_WATCHLIST_CHANNEL)
 help_processor = processors.Help()
 
-listener = listener.slack.DirectMention(token=SLACK_TOKEN, bot_id=SLACK_BOT_ID)
+listener = listener.Combined([
+    listener.slack.DirectMention(token=SLACK_TOKEN, bot_id=SLACK_BOT_ID),
+    lego_watchlist,
+    listener.schedule.Schedule([
+        listener.schedule.ScheduleRule(
+            'morning traffic', 'traffic frankfurt to mainz', SCHEDULE_CHANNEL,
+            cron='30 6 * * 1-5', missed='skip'
+        )
+    ], state_file=SCHEDULE_STATE_FILE)
+])
 flows = [
     Flow(
         processor=processors.Error(),
@@ -55,22 +82,100 @@ flows = [
         actions=[slack_action]
     ),
     Flow(
-        processor=processors.traffic.Traffic(services.traffic.DeutscheBahn()),
+        processor=processors.Circuits(),
+        formatters=[fmt.StringFormat(
+            "{chr(10).join(f'*{c.name}* is _{c.state}_ ({c.failure_rate:.0%} of {c.calls} calls failed)' "
+            "for c in payload) or 'No upstream services called yet'}"
+        )],
+        actions=[slack_action]
+    ),
+    Flow(
+        processor=processors.Flows(),
+        formatters=[fmt.StringFormat(
+            "{chr(10).join(f'{i + 1}. *{f.command or f.processor}* (priority {f.priority}): {f.matches} matches' "
+            "for i, f in enumerate(payload))}"
+        )],
+        actions=[slack_action]
+    ),
+    Flow(
+        processor=processors.Limits(),
+        formatters=[fmt.StringFormat(
+            "{chr(10).join(f'*{l.name}*: {l.in_flight} of {l.limit} calls in flight, {l.queued} queued' "
+            "for l in payload) or 'No upstream services called yet'}"
+        )],
+        actions=[slack_action]
+    ),
+    Flow(
+        processor=processors.traffic.Traffic(services.traffic.CachedTrafficService(
+            services.traffic.RecordingTrafficService(
+                services.traffic.DeutscheBahnAsync(hedger=services.base.Hedger()),
+                traffic_history
+            ),
+            peak_hours=[('06:30', '09:00'), ('16:00', '18:30')]
+        )),
         formatters=[fmt.slack.Template.from_file(TPL_TRAFFIC_TRAIN)],
+        actions=[slack_action],
+        placeholder_after=1.0
+    ),
+    Flow(
+        processor=processors.traffic.TrafficStats(traffic_history),
+        formatters=[fmt.StringFormat(
+            "*{payload.origin}* to *{payload.destination}*"
+            "{' at ' + payload.departure if payload.departure else ''} "
+            "({payload.count} connections): canceled _{payload.canceled_rate:.0%}_, "
+            "delayed _{payload.delayed_rate:.0%}_, departure delay median "
+            "_{payload.departure_delay.get(50, 0):.0f} min_, p90 _{payload.departure_delay.get(90, 0):.0f} min_"
+        )],
         actions=[slack_action]
     ),
     Flow(
-        processor=processors.lego.Pricing(),
+        processor=lego_pricing,
         formatters=[fmt.slack.Template.from_file(TPL_LEGO_PRICING)],
+        actions=[slack_action],
+        placeholder_after=1.0
+    ),
+    Flow(
+        processor=processors.Alert(lego_watchlist.KIND),
+        formatters=[fmt.slack.Template.from_file(TPL_LEGO_PRICE_ALERT)],
         actions=[slack_action]
     ),
     Flow(
         processor=processors.hass.OnOffSwitch(
             base_url=HASS_URI,
-            token=HASS_TOKEN
+            token=HASS_TOKEN,
+            optimistic=True
         ),
         formatters=[fmt.slack.Template.from_file(TPL_HASS_STATE)],
+        actions=[slack_action],
+        update_in_place=True
+    ),
+    Flow(
+        processor=processors.hass.State(
+            base_url=HASS_URI,
+            token=HASS_TOKEN
+        ),
+        formatters=[fmt.StringFormat(
+            "*{payload.entity_id}* (_{payload.friendly_name}_) is _{payload.state}_"
+        )],
         actions=[slack_action]
+    ),
+    Flow(
+        processor=processors.hass.History(
+            base_url=HASS_URI,
+            token=HASS_TOKEN
+        ),
+        formatters=[fmt.StringFormat(
+            "*{payload.entity_id}* ({payload.count} samples): "
+            "min _{payload.minimum:.2f}_, max _{payload.maximum:.2f}_, "
+            "mean _{payload.mean:.2f}_, median _{payload.percentiles[50]:.2f}_"
+        )],
+        actions=[slack_action],
+        placeholder_after=1.0
     )
 ]
-orchestra = Orchestrator(listener, flows)
+orchestra = Orchestrator(
+    listener, flows, split_commands=True,
+    offloader=services.base.Offloader('process', max_workers=2),
+    adaptive_order=True,
+    routing='first'
+)
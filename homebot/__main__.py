@@ -75,7 +75,13 @@ class Runner:
         # First try to compile...
         py_compile.compile(config)
         # ... then dummy load it
-        Runner._load_orchestrator_from_mobule(config)
+        orchestra = Runner._load_orchestrator_from_mobule(config)
+        # ... and look for commands that are ambiguous
+        for first, second, example in orchestra.overlapping_flows():
+            logging.warning(
+                "The processors %s and %s both match the message '%s'",
+                type(first.processor).__name__, type(second.processor).__name__, example.strip()
+            )
 
 
 if __name__ == '__main__':
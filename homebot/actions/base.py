@@ -13,6 +13,21 @@ class Action(AutoStrMixin, LogMixin, metaclass=TypeGuardMeta):
         """Performs the action."""
         raise NotImplementedError()  # pragma: no cover
 
+    async def placeholder(self, ctx: Context, text: str) -> None:
+        """Shows a placeholder until the action is called with the real payload for the same
+        context. Does nothing by default."""
+        _ = ctx, text  # Fake usage
+
+    async def provisional(self, ctx: Context, payload: Any) -> None:
+        """Performs the action with a payload that the next call for the same context may
+        replace. Actions that cannot replace anything simply perform the action."""
+        await self(ctx, payload)
+
+    async def finish(self, ctx: Context) -> None:
+        """Marks the last provisional payload for the context as final. Does nothing by
+        default."""
+        _ = ctx  # Fake usage
+
 
 class Console(Action):
     """Simply logs the payload to the console."""
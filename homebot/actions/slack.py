@@ -1,27 +1,44 @@
 """Slack related actions."""
-from typing import Any, Dict
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
 
 import slack  # type: ignore
 
 from homebot.actions.base import Action
-from homebot.models import SlackMessage, MessageIncoming, Context
+from homebot.models import SlackMessage, MessageIncoming, Context, CompositePayload
+from homebot.services.base import AdaptiveLimiter
 
 
 class SendMessage(Action):
-    """Posts the payload to slack."""
+    """Posts the payload to slack. Placeholders and provisional payloads are updated in
+    place via `chat.update` by the next payload for the same context."""
+
+    MAX_REPLACEABLE = 1000
+    INITIAL_LIMIT = 16
 
     def __init__(self, token: str):
         self._client = slack.WebClient(
             token=token,
             run_async=True
         )
+        self.limiter = AdaptiveLimiter.get('slack', initial_limit=self.INITIAL_LIMIT)
+        # Context ident -> (channel, ts) of messages to replace
+        self._replaceable: 'OrderedDict[str, Tuple[str, str]]' = OrderedDict()
 
-    async def __call__(self, ctx: Context, payload: Any) -> None:
-        """Performs the action. Sends the payload to a slack channel."""
+    @staticmethod
+    def _channel(ctx: Context) -> str:
         if not isinstance(ctx.incoming, MessageIncoming):
             raise RuntimeError("The source payload does not provide a destination channel.")
+        return ctx.incoming.origin
 
-        args: Dict[str, Any] = {'channel': ctx.incoming.origin}
+    async def _send(self, ctx: Context, payload: Any, replaceable: bool) -> None:
+        args: Dict[str, Any] = {'channel': self._channel(ctx)}
+
+        if isinstance(payload, CompositePayload):
+            payload = SlackMessage.combine([
+                part if isinstance(part, SlackMessage) else SlackMessage(text=str(part))
+                for part in payload.payloads
+            ])
 
         if isinstance(payload, SlackMessage):
             args = {
@@ -33,4 +50,35 @@ class SendMessage(Action):
         else:
             args = {'text': str(payload), **args}
 
-        await self._client.chat_postMessage(**args)
+        message = self._replaceable.pop(ctx.ident, None)
+        async with self.limiter.permit():
+            if message:
+                channel, ts = message
+                await self._client.chat_update(**{**args, 'channel': channel, 'ts': ts})
+            else:
+                resp = await self._client.chat_postMessage(**args)
+                if resp and resp.get('ts'):
+                    message = (str(resp.get('channel')), str(resp.get('ts')))
+
+        if replaceable and message:
+            self._replaceable[ctx.ident] = message
+            while len(self._replaceable) > self.MAX_REPLACEABLE:
+                self._replaceable.popitem(last=False)
+
+    async def placeholder(self, ctx: Context, text: str) -> None:
+        """Posts the placeholder text to slack. It will be replaced by the real payload
+        via `chat.update`."""
+        await self._send(ctx, text, replaceable=True)
+
+    async def provisional(self, ctx: Context, payload: Any) -> None:
+        """Sends the payload to a slack channel. It will be replaced by the next payload
+        for the same context via `chat.update`."""
+        await self._send(ctx, payload, replaceable=True)
+
+    async def finish(self, ctx: Context) -> None:
+        """The last provisional message for the context stays as it is."""
+        self._replaceable.pop(ctx.ident, None)
+
+    async def __call__(self, ctx: Context, payload: Any) -> None:
+        """Performs the action. Sends the payload to a slack channel."""
+        await self._send(ctx, payload, replaceable=False)
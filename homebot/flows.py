@@ -1,5 +1,5 @@
 """Contains base code for flow items and the orchestrator itself."""
-from typing import Iterable
+from typing import Iterable, Optional
 
 import attr
 
@@ -17,7 +17,21 @@ class Flow:
     """Single flow item. The building block of a flow are the following components:
     * processor: Processes the incoming message from the listener.
     * formatters: 0..n formatters to do some formatting to the output of the processor.
-    * actions: 1..n actions to perform."""
+    * actions: 1..n actions to perform.
+
+    Optionally a placeholder can be configured for slow processors: If the processor
+    did not finish after `placeholder_after` seconds, the actions are asked to show the
+    `placeholder_text` until the real result arrives.
+
+    Processors may stream their results by returning an async iterable. Each item is
+    passed through the formatters and actions as soon as it arrives - unless `batch` is
+    set: Then all items are collected into a list and passed on as one payload. If
+    `update_in_place` is set, every streamed item replaces the previous one (e.g. an
+    optimistic reply that is confirmed later) instead of being sent separately.
+
+    Flows with a higher `priority` are always probed before flows with a lower one. If
+    the orchestrator routes to the first match only, `broadcast` flows are still probed
+    (and processed) after a match."""
     processor: Processor = attr.ib(
         validator=attrs_assert_type(Processor)
     )
@@ -29,3 +43,27 @@ class Flow:
         converter=mklist,
         validator=attrs_assert_iterable(act.Action),
     )
+    placeholder_after: Optional[float] = attr.ib(
+        default=None,
+        validator=attrs_assert_type(Optional[float])
+    )
+    placeholder_text: str = attr.ib(
+        default="Working on it...",
+        converter=str
+    )
+    batch: bool = attr.ib(
+        default=False,
+        converter=bool
+    )
+    update_in_place: bool = attr.ib(
+        default=False,
+        converter=bool
+    )
+    priority: int = attr.ib(
+        default=0,
+        converter=int
+    )
+    broadcast: bool = attr.ib(
+        default=False,
+        converter=bool
+    )
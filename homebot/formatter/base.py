@@ -8,10 +8,21 @@ from homebot.validator import TypeGuardMeta
 
 
 class Formatter(AutoStrMixin, LogMixin, metaclass=TypeGuardMeta):
-    """Base class for all formatters. Introduces the interface to respect."""
+    """Base class for all formatters. Introduces the interface to respect.
+
+    Cpu-bound formatters set `CPU_BOUND` and implement the synchronous `format` instead
+    of `__call__`: The orchestrator runs them off the event loop."""
+
+    CPU_BOUND = False
 
     async def __call__(self, ctx: Context, payload: Any) -> Any:
         """Performs the formatting."""
+        if self.CPU_BOUND:
+            return self.format(ctx, payload)
+        raise NotImplementedError()  # pragma: no cover
+
+    def format(self, ctx: Context, payload: Any) -> Any:
+        """Performs the formatting of cpu-bound formatters."""
         raise NotImplementedError()  # pragma: no cover
 
 
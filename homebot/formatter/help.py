@@ -12,11 +12,13 @@ from homebot.models import HelpEntry, Context
 class TextTable(Formatter):
     """Transforms an iterable of help entries into a text table representation."""
 
+    CPU_BOUND = True
+
     def __init__(self, usage_width: int = 40, description_width: int = 80):
         self.usage_width = usage_width
         self.description_width = description_width
 
-    async def __call__(self, ctx: Context, payload: Iterable[HelpEntry]) -> str:
+    def format(self, ctx: Context, payload: Iterable[HelpEntry]) -> str:
         rows = [
             [
                 h.command,
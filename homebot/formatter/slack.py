@@ -29,6 +29,9 @@ class Codify(Formatter):
 
 class Template(Formatter):
     """Augments a slack block layout provided by the user."""
+
+    CPU_BOUND = True
+
     def __init__(self, template: SlackMessageTemplate):
         self.template = template
 
@@ -37,5 +40,5 @@ class Template(Formatter):
         """Loads the layout from a json file and instantiates an instance."""
         return cls(SlackMessageTemplate.from_file(file_path))
 
-    async def __call__(self, ctx: Context, payload: Any) -> SlackMessage:
+    def format(self, ctx: Context, payload: Any) -> SlackMessage:
         return self.template.render(ctx=ctx, payload=payload)
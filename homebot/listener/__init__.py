@@ -1,7 +1,7 @@
 """Listener package."""
 
-from homebot.listener.base import Listener
-from homebot.listener import slack
+from homebot.listener.base import Combined, Listener
+from homebot.listener import lego, schedule, slack
 
 
-__all__ = ['slack', 'Listener']
+__all__ = ['lego', 'schedule', 'slack', 'Combined', 'Listener']
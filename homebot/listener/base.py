@@ -1,6 +1,6 @@
 """Contains listener base classes. Listeners do produce messages to process."""
 import asyncio
-from typing import Optional
+from typing import List, Optional
 
 from typeguard import check_type
 
@@ -39,3 +39,35 @@ class Listener(AutoStrMixin, LogMixin, metaclass=TypeGuardMeta):
     async def start(self) -> None:
         """Run the listener."""
         raise NotImplementedError()  # pragma: no cover
+
+
+class Combined(Listener):
+    """Runs multiple listeners side by side. All of them send their incoming messages to
+    the same callback."""
+
+    def __init__(self, listeners: List[Listener]):
+        super().__init__()
+        self.listeners = list(listeners)
+
+    @property
+    def callback(self) -> Optional[ListenerCallback]:
+        """Return the callback."""
+        return self._callback
+
+    @callback.setter
+    def callback(self, value: ListenerCallback) -> None:
+        """Set the callback function of all listeners."""
+        check_type('value', value, ListenerCallback)  # type: ignore
+        self._callback = value
+        for listener in self.listeners:
+            listener.callback = value
+
+    async def start(self) -> None:
+        """Runs all listeners until they are done. If one of them fails, the others are
+        stopped."""
+        tasks = [asyncio.ensure_future(listener.start()) for listener in self.listeners]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,96 @@
+"""Lego related listener."""
+import asyncio
+from typing import Dict, List, Optional
+
+from homebot.listener.base import Listener
+from homebot.models import AlertIncoming
+from homebot.processors.lego import Pricing
+from homebot.services.lego import LegoPriceAlert
+
+
+class Watchlist(Listener):
+    """Polls the prices of the watched lego sets every `interval` seconds and raises an
+    alert to `channel` when the current price of a set drops to or below its threshold
+    (`watchlist` maps set ids to thresholds). A set alerts again after its price went back
+    above the threshold.
+
+    At most `max_concurrency` pages are fetched at a time, and the requests start at
+    least `politeness_delay` seconds apart. Pages that did not change since the last poll
+    are not transferred again (conditional requests)."""
+
+    KIND = 'lego price'
+    DEFAULT_INTERVAL = 6 * 60 * 60.0
+    DEFAULT_MAX_CONCURRENCY = 2
+    DEFAULT_POLITENESS_DELAY = 5.0
+
+    def __init__(
+            self, pricing: Pricing, watchlist: Dict[int, float], channel: str,
+            interval: float = DEFAULT_INTERVAL, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+            politeness_delay: float = DEFAULT_POLITENESS_DELAY
+    ):
+        super().__init__()
+        self.pricing = pricing
+        self.watchlist = {int(set_id): float(threshold) for set_id, threshold in watchlist.items()}
+        self.channel = str(channel)
+        self.interval = float(interval)
+        self.max_concurrency = int(max_concurrency)
+        self.politeness_delay = float(politeness_delay)
+        self._validators: Dict[int, Dict[str, str]] = {}
+        self._below: Dict[int, bool] = {}
+        self._next_request = 0.0
+
+    async def _polite(self) -> None:
+        """Waits for the next free request slot."""
+        now = asyncio.get_event_loop().time()
+        slot = max(now, self._next_request)
+        self._next_request = slot + self.politeness_delay
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _check(self, set_id: int, semaphore: asyncio.Semaphore) -> Optional[LegoPriceAlert]:
+        threshold = self.watchlist[set_id]
+        async with semaphore:
+            await self._polite()
+            try:
+                pricing = await self.pricing.fetch_if_modified(
+                    set_id, self._validators.setdefault(set_id, {})
+                )
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Polling the price of set '%s' failed", set_id)
+                return None
+        if pricing is None:
+            self.logger.debug("Price page of set '%s' is unchanged", set_id)
+            return None
+
+        was_below = self._below.get(set_id, False)
+        self._below[set_id] = pricing.current <= threshold
+        if self._below[set_id] and not was_below:
+            return LegoPriceAlert(pricing=pricing, threshold=threshold)
+        return None
+
+    async def poll(self) -> List[LegoPriceAlert]:
+        """Polls all watched sets once and raises the alerts."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            results = await asyncio.gather(*[
+                self._check(set_id, semaphore) for set_id in self.watchlist
+            ])
+        finally:
+            if self.pricing.history is not None:
+                self.pricing.history.flush()
+
+        alerts = [alert for alert in results if alert is not None]
+        for alert in alerts:
+            await self._fire_callback(AlertIncoming(
+                text='', origin=self.channel, origin_user='', kind=self.KIND, payload=alert
+            ))
+        return alerts
+
+    async def start(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception:  # pylint: disable=broad-except
+                # E.g. the price history is locked: Try again next time
+                self.logger.exception("Polling the watchlist failed")
+            await asyncio.sleep(self.interval)
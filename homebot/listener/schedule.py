@@ -0,0 +1,268 @@
+"""Time based listener."""
+import asyncio
+import heapq
+import json
+import os
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import attr
+
+from homebot.listener.base import Listener
+from homebot.models import MessageIncoming
+from homebot.validator import attrs_assert_type
+
+
+class Cron:
+    """Cron expression with the five fields minute, hour, day of month, month and day of
+    week (0 or 7 is sunday). Fields support `*`, lists (`1,15`), ranges (`1-5`) and steps
+    (`*/15`, `8-18/2`). As in cron a day matches if either the day of month or the day of
+    week matches when both are restricted.
+
+    Example:
+
+        >>> dut = Cron('30 6 * * 1-5')
+        >>> dut.next(datetime(2020, 1, 10, 7, 0))  # Friday
+        datetime.datetime(2020, 1, 13, 6, 30)
+        >>> Cron('*/20 * * * *').next(datetime(2020, 1, 10, 7, 40))
+        datetime.datetime(2020, 1, 10, 8, 0)
+    """
+
+    # (lowest, highest) value per field
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+    MAX_DAYS = 366 * 8  # February 29th on a given weekday might take years
+
+    def __init__(self, expression: str):
+        self.expression = str(expression)
+        fields = self.expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError(f"Cron expression '{expression}' needs {len(self.FIELDS)} fields")
+        minutes, hours, self._days, self._months, weekdays = [
+            self._parse(field, lowest, highest)
+            for field, (lowest, highest) in zip(fields, self.FIELDS)
+        ]
+        self._minutes = sorted(minutes)
+        self._hours = sorted(hours)
+        self._weekdays = frozenset(weekday % 7 for weekday in weekdays)
+        self._days_restricted = fields[2] != '*'
+        self._weekdays_restricted = fields[4] != '*'
+
+    def __repr__(self) -> str:
+        return f"Cron('{self.expression}')"
+
+    def _parse(self, field: str, lowest: int, highest: int) -> FrozenSet[int]:
+        values = set()
+        for item in field.split(','):
+            span, _, step = item.partition('/')
+            try:
+                if span == '*':
+                    start, end = lowest, highest
+                elif '-' in span:
+                    start, end = (int(value) for value in span.split('-', 1))
+                else:
+                    start = int(span)
+                    end = highest if step else start
+                values.update(range(start, end + 1, int(step or 1)))
+            except ValueError:
+                raise ValueError(f"Cron field '{field}' of '{self.expression}' is invalid")
+            if start < lowest or end > highest or start > end or int(step or 1) < 1:
+                raise ValueError(f"Cron field '{field}' of '{self.expression}' is out of range")
+        return frozenset(values)
+
+    def _matches_day(self, day: date) -> bool:
+        if day.month not in self._months:
+            return False
+        in_days = day.day in self._days
+        in_weekdays = (day.weekday() + 1) % 7 in self._weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next(self, after: datetime) -> datetime:
+        """Return the first matching minute after `after`."""
+        start = (after + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        day = start.date()
+        for _ in range(self.MAX_DAYS):
+            if self._matches_day(day):
+                for hour in self._hours:
+                    for minute in self._minutes:
+                        candidate = datetime.combine(day, dtime(hour, minute))
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+
+@attr.s
+class ScheduleRule:
+    """Sends `text` as a message from `channel` - either `every` n seconds or whenever
+    the `cron` expression matches. The `missed` policy decides what happens to runs that
+    were missed (e.g. while the bot was down): `skip` them, run them `once` or run `all`
+    of them."""
+    MISSED_POLICIES = ('skip', 'once', 'all')
+
+    name: str = attr.ib(validator=attrs_assert_type(str))
+    text: str = attr.ib(validator=attrs_assert_type(str))
+    channel: str = attr.ib(validator=attrs_assert_type(str))
+    every: Optional[float] = attr.ib(
+        default=None, converter=attr.converters.optional(float)  # type: ignore
+    )
+    cron: Optional[str] = attr.ib(default=None, validator=attrs_assert_type(Optional[str]))
+    missed: str = attr.ib(default='once', validator=attrs_assert_type(str))
+    _cron: Optional[Cron] = attr.ib(init=False, repr=False, default=None)
+
+    def __attrs_post_init__(self) -> None:
+        if (self.every is None) == (self.cron is None):
+            raise ValueError(f"Rule '{self.name}' needs either 'every' or 'cron'")
+        if self.every is not None and self.every <= 0:
+            raise ValueError(f"Rule '{self.name}' needs a positive interval")
+        if self.missed not in self.MISSED_POLICIES:
+            raise ValueError(f"Argument 'missed' must be one of {self.MISSED_POLICIES}")
+        if self.cron is not None:
+            self._cron = Cron(self.cron)
+
+    def next_due(self, previous: float) -> float:
+        """Return the unix timestamp of the run after the one at `previous`."""
+        if self._cron is None:
+            return previous + float(self.every or 0)
+        return self._cron.next(datetime.fromtimestamp(previous)).timestamp()
+
+
+class Schedule(Listener):
+    """Sends the messages of the schedule rules when they are due. All rules share a
+    single timer loop that sleeps until the earliest due rule (heap ordered).
+
+    Runs more than `grace` seconds late count as missed and are handled by the missed
+    policy of the rule (at most `MAX_CATCH_UP` runs). If a `state_file` is passed the
+    last run of every rule is remembered, so runs missed while the bot was down are
+    detected as well."""
+
+    DEFAULT_GRACE = 60.0
+    MAX_CATCH_UP = 100
+    ORIGIN_USER = 'schedule'
+
+    def __init__(
+            self, rules: List[ScheduleRule], state_file: Optional[str] = None,
+            grace: float = DEFAULT_GRACE
+    ):
+        super().__init__()
+        self.state_file = state_file
+        self.grace = float(grace)
+        self._rules: Dict[str, ScheduleRule] = {}
+        # (due, sequence, rule name); the sequence keeps equally due rules in order
+        self._heap: List[Tuple[float, int, str]] = []
+        self._sequence = 0
+        # Rule name -> sequence of its valid heap entry. Other entries are outdated
+        self._entries: Dict[str, int] = {}
+        self._last_run: Dict[str, float] = self._load()
+        self._wakeup: Optional[asyncio.Event] = None
+        for rule in rules:
+            self.add(rule)
+
+    def _load(self) -> Dict[str, float]:
+        if not self.state_file or not os.path.isfile(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r') as fp:
+                return {str(name): float(last) for name, last in json.load(fp).items()}
+        except (ValueError, AttributeError):
+            self.logger.warning("State file '%s' is broken. Starting over.", self.state_file)
+            return {}
+
+    def _save(self) -> None:
+        if not self.state_file:
+            return
+        tmp_path = f'{self.state_file}.tmp'
+        try:
+            with open(tmp_path, 'w') as fp:
+                json.dump(self._last_run, fp)
+            os.replace(tmp_path, self.state_file)
+        except OSError:
+            # E.g. the disk is full: Keep on running, the state is saved next time
+            self.logger.exception("Saving the state to '%s' failed", self.state_file)
+
+    def _push(self, due: float, name: str) -> None:
+        self._sequence += 1
+        self._entries[name] = self._sequence
+        heapq.heappush(self._heap, (due, self._sequence, name))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def add(self, rule: ScheduleRule, now: Optional[float] = None) -> None:
+        """Adds the rule (or replaces the one with the same name)."""
+        now = time.time() if now is None else now
+        self._rules[rule.name] = rule
+        last = self._last_run.get(rule.name)
+        if last is not None:
+            # The loop detects if it was missed
+            self._push(rule.next_due(last), rule.name)
+        elif rule.every is not None:
+            self._push(now + rule.every, rule.name)
+        else:
+            self._push(rule.next_due(now), rule.name)
+
+    def remove(self, name: str) -> None:
+        """Removes the rule. Its pending run is dropped by the loop."""
+        self._rules.pop(name, None)
+        self._entries.pop(name, None)
+
+    @property
+    def next_run(self) -> Optional[Tuple[float, str]]:
+        """Return the due time and the name of the next rule to run."""
+        while self._heap and self._entries.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        due, _, name = self._heap[0]
+        return due, name
+
+    def _due_runs(
+            self, rule: ScheduleRule, due: float, now: float
+    ) -> Tuple[List[float], float, float]:
+        """Return the runs to do now, the latest due time up to now and the next due
+        time."""
+        if now - due <= self.grace:
+            return [due], due, rule.next_due(due)
+
+        missed = [due]
+        last, upcoming = due, rule.next_due(due)
+        while upcoming <= now:
+            if len(missed) < self.MAX_CATCH_UP:
+                missed.append(upcoming)
+            last, upcoming = upcoming, rule.next_due(upcoming)
+        self.logger.info(
+            "Rule '%s' missed %s run(s). Policy is '%s'", rule.name, len(missed), rule.missed)
+        runs = {'skip': [], 'once': missed[-1:], 'all': missed}[rule.missed]
+        return runs, last, upcoming
+
+    async def run_pending(self, now: Optional[float] = None) -> int:
+        """Sends the messages of all due rules. Return the number of messages sent."""
+        now = time.time() if now is None else now
+        sent, handled = 0, 0
+        while self.next_run is not None and self.next_run[0] <= now:
+            due, _, name = heapq.heappop(self._heap)
+            rule = self._rules[name]
+            runs, self._last_run[name], upcoming = self._due_runs(rule, due, now)
+            for _ in runs:
+                await self._fire_callback(MessageIncoming(
+                    text=rule.text, origin=rule.channel, origin_user=self.ORIGIN_USER
+                ))
+            sent += len(runs)
+            handled += 1
+            self._push(upcoming, name)
+        if handled:
+            self._save()
+        return sent
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        while True:
+            await self.run_pending()
+            next_run = self.next_run
+            self._wakeup.clear()
+            timeout = None if next_run is None else max(0.0, next_run[0] - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,29 +1,135 @@
 """Slack related listener."""
 import asyncio
+import json
+import os
+import random
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional, List, Set, Tuple
 
 import slack  # type: ignore
 
 from homebot.listener.base import Listener
 from homebot.models import MessageIncoming
+from homebot.utils import AutoStrMixin, ExpiringSet, LogMixin
+
+
+def _ts_key(ts: str) -> Tuple[int, int]:
+    """Slack timestamps are strings like '1579000000.000200'. Floats are too imprecise to
+    compare them reliably."""
+    seconds, _, fraction = str(ts).partition('.')
+    return int(seconds or 0), int(fraction or 0)
+
+
+class ChannelState(AutoStrMixin, LogMixin):
+    """Remembers the timestamp of the last processed message per channel in a small json
+    file."""
+
+    def __init__(self, file_path: str):
+        self.file_path = str(file_path)
+        self._last_ts: Dict[str, str] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Loads the state from the file. A missing or broken file results in an empty
+        state."""
+        if not os.path.isfile(self.file_path):
+            return
+        try:
+            with open(self.file_path, 'r') as fp:
+                self._last_ts = {str(k): str(v) for k, v in json.load(fp).items()}
+        except (ValueError, AttributeError):
+            self.logger.warning("State file '%s' is broken. Starting over.", self.file_path)
+            self._last_ts = {}
+
+    def _save(self) -> None:
+        tmp_path = f'{self.file_path}.tmp'
+        try:
+            with open(tmp_path, 'w') as fp:
+                json.dump(self._last_ts, fp)
+            os.replace(tmp_path, self.file_path)
+        except OSError:
+            # E.g. the disk is full: Keep on running, the state is saved next time
+            self.logger.exception("Saving the state to '%s' failed", self.file_path)
+
+    @property
+    def channels(self) -> Dict[str, str]:
+        """Return the last processed timestamp per channel."""
+        return dict(self._last_ts)
+
+    def update(self, channel: str, ts: str) -> None:
+        """Records the timestamp for the channel if it is newer than the stored one."""
+        current = self._last_ts.get(channel)
+        if current is not None and _ts_key(current) >= _ts_key(ts):
+            return
+        self._last_ts[channel] = ts
+        self._save()
 
 
 class DirectMention(Listener):
     """Listens for direct mentions of the bot in slack channels."""
     DIRECT_MENTION_REGEX = r'^\<\@{id}\>'
 
-    def __init__(self, token: str, bot_id: str):
+    DEFAULT_DEDUP_TTL = 600.0
+    DEFAULT_DEDUP_SIZE = 1000
+    DEFAULT_RECONNECT_BASE = 1.0
+    DEFAULT_RECONNECT_MAX = 300.0
+    DEFAULT_BACKFILL_CONCURRENCY = 4
+    BACKFILL_PAGE_SIZE = 200
+
+    def __init__(
+            self, token: str, bot_id: str, dedup_ttl: float = DEFAULT_DEDUP_TTL,
+            dedup_size: int = DEFAULT_DEDUP_SIZE, reconnect_base: float = DEFAULT_RECONNECT_BASE,
+            reconnect_max: float = DEFAULT_RECONNECT_MAX, state_file: Optional[str] = None,
+            backfill_concurrency: int = DEFAULT_BACKFILL_CONCURRENCY,
+            base_url: str = slack.WebClient.BASE_URL
+    ):
         super().__init__()
         self._token = token
         self._bot_id = bot_id
         self._client = slack.RTMClient(
             token=self._token,
             run_async=True,
-            loop=asyncio.get_event_loop()
+            loop=asyncio.get_event_loop(),
+            base_url=base_url
+        )
+        self._web_client = slack.WebClient(
+            token=self._token,
+            run_async=True,
+            base_url=base_url
         )
+        self._state = ChannelState(state_file) if state_file else None
+        self._backfill_concurrency = int(backfill_concurrency)
         self._direct_mention_regex = re.compile(
             self.DIRECT_MENTION_REGEX.format(id=self._bot_id))
+        self._mention_prefix = f'<@{self._bot_id}>'
+        self._seen = ExpiringSet(ttl=dedup_ttl, maxsize=dedup_size)
+        self._reconnect_base = float(reconnect_base)
+        self._reconnect_max = float(reconnect_max)
+        self._reconnect_attempts = 0
+        # The event loop only keeps weak references to tasks
+        self._catch_up_tasks: Set['asyncio.Task[None]'] = set()
+
+    @staticmethod
+    def _event_key(data: Dict[str, Any]) -> Optional[str]:
+        """Returns the key to deduplicate the event by. Slack assigns a `client_msg_id` to
+        messages sent by clients; `ts` is unique per channel."""
+        client_msg_id = data.get('client_msg_id')
+        if client_msg_id:
+            return str(client_msg_id)
+        ts = data.get('ts')
+        if ts:
+            return f"{data.get('channel')}:{ts}"
+        return None
+
+    def _is_relevant(self, data: Dict[str, Any]) -> bool:
+        """Cheap checks to sort out events that can never be a direct mention from a user:
+        Edits, joins, bot messages, ..."""
+        if data.get('subtype') or data.get('bot_id'):
+            return False
+        if data.get('user') == self._bot_id:
+            return False
+        message_text = data.get('text')
+        return bool(message_text) and str(message_text).startswith(self._mention_prefix)
 
     async def _on_message(self, data: Dict[str, Any], **unused: Any) -> None:
         """Callback that is called on every message. The message text will be parsed
@@ -31,12 +137,21 @@ class DirectMention(Listener):
         delegated to the processing flow."""
         _ = unused  # Fake usage
 
+        # We receive events, so the connection is healthy
+        self._reconnect_attempts = 0
+
+        if not self._is_relevant(data):
+            return
+
+        key = self._event_key(data)
+        if key is not None and not self._seen.add(key):
+            self.logger.debug("Skipping duplicate event '%s'", key)
+            return
+
         message = None
-        message_text = data.get('text')
+        message_text = str(data.get('text'))
         channel = data.get('channel')
         user_id = data.get('user')
-        if not message_text:
-            return
 
         mention_match = self._direct_mention_regex.match(message_text)
         if mention_match:
@@ -50,10 +165,80 @@ class DirectMention(Listener):
 
         if message:
             await self._fire_callback(message)
+            if self._state and channel and data.get('ts'):
+                self._state.update(str(channel), str(data['ts']))
+
+    async def _fetch_missed(self, channel: str, oldest: str) -> List[Dict[str, Any]]:
+        """Pages through the channel history newer than `oldest`."""
+        messages: List[Dict[str, Any]] = []
+        cursor = None
+        while True:
+            args: Dict[str, Any] = {
+                'channel': channel, 'oldest': oldest, 'limit': self.BACKFILL_PAGE_SIZE
+            }
+            if cursor:
+                args['cursor'] = cursor
+            resp = await self._web_client.conversations_history(**args)
+            messages.extend({**msg, 'channel': channel} for msg in resp.get('messages', []))
+            cursor = (resp.get('response_metadata') or {}).get('next_cursor')
+            if not resp.get('has_more') or not cursor:
+                return messages
+
+    async def _catch_up(self) -> None:
+        """Backfills the direct mentions that were sent while the listener was down."""
+        if not self._state:
+            return
+
+        semaphore = asyncio.Semaphore(self._backfill_concurrency)
+
+        async def _fetch(channel: str, oldest: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    return await self._fetch_missed(channel, oldest)
+                except Exception:  # pylint: disable=broad-except
+                    self.logger.exception("Catching up on channel '%s' failed", channel)
+                    return []
+
+        results = await asyncio.gather(*[
+            _fetch(channel, oldest) for channel, oldest in self._state.channels.items()
+        ])
+        missed = sorted(
+            (msg for msgs in results for msg in msgs),
+            key=lambda msg: _ts_key(msg.get('ts', '0'))
+        )
+        if missed:
+            self.logger.info("Catching up on %s missed messages", len(missed))
+        for msg in missed:
+            await self._on_message(msg)
+
+    async def _on_open(self, **unused: Any) -> None:
+        """Callback that is called whenever the connection to slack is (re-)established."""
+        _ = unused  # Fake usage
+        task = asyncio.ensure_future(self._catch_up())
+        self._catch_up_tasks.add(task)
+        task.add_done_callback(self._catch_up_tasks.discard)
+
+    def _reconnect_delay(self) -> float:
+        """Exponential backoff with jitter to avoid synchronized reconnects."""
+        ceiling = min(self._reconnect_max, self._reconnect_base * 2 ** self._reconnect_attempts)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
 
     async def start(self) -> None:
         self._client.on(
             event='message',
             callback=self._on_message
         )
-        await self._client.start()
+        self._client.on(
+            event='open',
+            callback=self._on_open
+        )
+        while True:
+            try:
+                await self._client.start()
+                return
+            except Exception:  # pylint: disable=broad-except
+                delay = self._reconnect_delay()
+                self._reconnect_attempts += 1
+                self.logger.exception(
+                    "Slack connection failed. Reconnecting in %.1f seconds...", delay)
+                await asyncio.sleep(delay)
@@ -1,8 +1,10 @@
 """Application models (beans, containers, whatever you may call it)."""
 
 import copy
+import functools
 import json
 import os
+import uuid
 from pathlib import Path
 from typing import List, Callable, Awaitable, Dict, Any, Optional, Union
 
@@ -31,6 +33,15 @@ class MessageIncoming(Incoming):
     direct_mention: bool = attr.ib(converter=bool, default=False)
 
 
+@attr.s
+class AlertIncoming(MessageIncoming):
+    """A payload nobody asked for: Raised by a background component (like a watchlist)
+    to notify the `origin` channel. The `kind` tells the processors what the `payload`
+    is about."""
+    kind: str = attr.ib(converter=str, default='')
+    payload: Any = attr.ib(default=None)
+
+
 @attr.s
 class ErrorIncoming(Incoming):
     """A payload that contains an error message and a - optional - trace."""
@@ -48,6 +59,8 @@ class UnknownCommandIncoming(Incoming):
 class Context:
     """Context."""
     incoming: Incoming = attr.ib(validator=attrs_assert_type(Incoming))
+    # Survives cloning: Identifies all payloads that result from the same incoming
+    ident: str = attr.ib(converter=str, factory=lambda: uuid.uuid4().hex)
 
     def clone(self) -> 'Context':
         """Clones this instance."""
@@ -57,6 +70,22 @@ class Context:
 ListenerCallback = Callable[[Incoming], Awaitable[None]]
 
 
+@attr.s
+class FlowInfo:
+    """Probe position and match statistics of a flow."""
+    processor: str = attr.ib(validator=attrs_assert_type(str))
+    command: Optional[str] = attr.ib(validator=attrs_assert_type(Optional[str]))
+    priority: int = attr.ib(validator=attrs_assert_type(int))
+    matches: int = attr.ib(validator=attrs_assert_type(int))
+
+
+@attr.s
+class CompositePayload:
+    """Multiple payloads (in order) that stem from a single incoming and shall be delivered
+    at once."""
+    payloads: List[Any] = attr.ib(converter=list)
+
+
 @attr.s
 class HelpEntry:
     """A help entry from a message processor."""
@@ -98,13 +127,45 @@ class SlackMessage:
         blocks = dct.get('blocks', None)
         return cls(text=text, attachments=attachments, blocks=blocks)
 
+    @classmethod
+    def combine(cls, messages: List['SlackMessage']) -> 'SlackMessage':
+        """Combines multiple messages into one: The texts are separated by newlines,
+        attachments and blocks are concatenated."""
+        texts = [msg.text for msg in messages if msg.text is not None]
+        attachments = [att for msg in messages for att in msg.attachments or []]
+        blocks = [block for msg in messages for block in msg.blocks or []]
+        return cls(
+            text="\n".join(texts) if texts else None,
+            attachments=attachments or None,
+            blocks=blocks or None
+        )
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_mako(source: str) -> Template:
+    return Template(text=source)
+
 
 @attr.s
 class SlackMessageTemplate:
-    """Template to render a submittable slack message."""
+    """Template to render a submittable slack message.
+
+    Compiled mako templates cannot be pickled: When pickled (e.g. to render in another
+    process) the template source is transferred and compiled once per process."""
     template: Any = attr.ib()
     engine: str = attr.ib(default='json')
 
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        if self.engine == 'mako':
+            state['template'] = self.template.source
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        if state.get('engine') == 'mako':
+            state = {**state, 'template': _compile_mako(state['template'])}
+        self.__dict__.update(state)
+
     @classmethod
     def from_json(cls, json_file: str) -> 'SlackMessageTemplate':
         """Loads the template from a json file and instantiates an instance."""
@@ -1,6 +1,8 @@
 """Contains base code for flow items and the orchestrator itself."""
 import asyncio
-from typing import Iterable, Any, Optional
+import inspect
+import re
+from typing import Iterable, Any, Optional, AsyncIterable, List, Tuple, Dict
 
 import attr
 
@@ -8,17 +10,53 @@ from homebot import actions as act
 from homebot.flows import Flow
 from homebot.formatter import Formatter
 from homebot.listener import Listener
-from homebot.models import Incoming, Context, UnknownCommandIncoming, ErrorIncoming, MessageIncoming
-from homebot.utils import make_list, LogMixin
+from homebot.models import (
+    Incoming, Context, UnknownCommandIncoming, ErrorIncoming, MessageIncoming, CompositePayload,
+    FlowInfo
+)
+from homebot.processors import RegexProcessor
+from homebot.processors.grammar import CommandTrie
+from homebot.services.base import CircuitOpenError, Offloader
+from homebot.utils import make_list, regex_examples, LogMixin
 from homebot.validator import (
     attrs_assert_type,
     attrs_assert_iterable
 )
 
 
+# Collected (action, payload) pairs instead of calling the actions right away
+Replies = List[Tuple[act.Action, Any]]
+
+
 @attr.s
 class Orchestrator(LogMixin):
-    """Orchestrates multiple flows and one listener into a runnable application."""
+    """Orchestrates multiple flows and one listener into a runnable application.
+
+    If `split_commands` is set, a message may contain multiple commands separated by
+    newlines or `;`. They are processed concurrently and each action is called once with
+    the ordered replies bundled into a `CompositePayload`.
+
+    Cpu-bound formatters (and the cpu-bound parts of processors) are run by the
+    `offloader` off the event loop.
+
+    Flows are probed by descending priority and then in the configured order. If
+    `adaptive_order` is set, flows of the same priority that matched more often are
+    probed first instead. Matches are counted with a decay (see `MATCH_DECAY_AFTER`) to
+    follow changing traffic.
+
+    The `routing` decides which of the matching flows are processed: `all` of them or
+    only the `first` one (and the broadcast flows). To route a message always to the
+    same flow, flows that overlap (see `overlapping_flows`) keep their configured order
+    relative to each other when routing to the `first` one adaptively. Overlaps of
+    processors that are not regex processors are not detected.
+
+    The command grammars of all processors are merged into one command trie, so a
+    message is tokenized and parsed once no matter how many flows are probed."""
+
+    COMMAND_SEPARATOR_REGEX = r'[;\n]'
+    # Once this many matches were counted, all counts are halved
+    MATCH_DECAY_AFTER = 10000
+    ROUTINGS = ('all', 'first')
 
     listener: Listener = attr.ib(
         validator=attrs_assert_type(Listener)
@@ -27,25 +65,238 @@ class Orchestrator(LogMixin):
         converter=make_list,
         validator=attrs_assert_iterable(Flow),
     )
+    split_commands: bool = attr.ib(
+        default=False,
+        converter=bool
+    )
+    offloader: Offloader = attr.ib(
+        factory=Offloader,
+        validator=attrs_assert_type(Offloader)
+    )
+    adaptive_order: bool = attr.ib(
+        default=False,
+        converter=bool
+    )
+    routing: str = attr.ib(
+        default='all',
+        validator=attr.validators.in_(ROUTINGS)
+    )
+    _matches: List[int] = attr.ib(init=False, repr=False, factory=list)
+    _order: List[int] = attr.ib(init=False, repr=False, factory=list)
+    _commands: CommandTrie = attr.ib(init=False, repr=False, factory=CommandTrie)
+    # (earlier, later) flow indices of overlapping flows whose order is fixed
+    _pinned: List[Tuple[int, int]] = attr.ib(init=False, repr=False, factory=list)
 
     def __attrs_post_init__(self) -> None:
         for flw in self.flows:
             flw.processor.orchestrator = self
+            if isinstance(flw.processor, RegexProcessor) and flw.processor.grammar is not None:
+                self._commands.add(flw.processor.grammar)
+                flw.processor.commands = self._commands
+        self._matches = [0] * len(self.flows)  # type: ignore
+        self._reorder()
+        if self.adaptive_order and self.routing == 'first':
+            indices = {id(flow): index for index, flow in enumerate(self.flows)}
+            self._pinned = [
+                (indices[id(first)], indices[id(second)])
+                for first, second, _ in self.overlapping_flows()
+            ]
+
+    def _reorder(self) -> None:
+        flows = list(self.flows)
+
+        def _key(index: int) -> Tuple[int, int, int]:
+            matches = self._matches[index] if self.adaptive_order else 0
+            return -flows[index].priority, -matches, index
+
+        if not self._pinned:
+            self._order = sorted(range(len(flows)), key=_key)
+            return
+
+        # Best flow first whose pinned predecessors are probed already
+        order: List[int] = []
+        remaining = set(range(len(flows)))
+        while remaining:
+            ready = [
+                index for index in remaining
+                if not any(later == index and earlier in remaining for earlier, later in self._pinned)
+            ]
+            best = min(ready, key=_key)
+            order.append(best)
+            remaining.remove(best)
+        self._order = order
+
+    def _record_match(self, flow_index: int) -> None:
+        self._matches[flow_index] += 1
+        if sum(self._matches) >= self.MATCH_DECAY_AFTER:
+            self._matches = [matches // 2 for matches in self._matches]
+        if self.adaptive_order:
+            self._reorder()
+
+    @property
+    def probe_order(self) -> List[Flow]:
+        """Return the flows in the order they are probed."""
+        flows = list(self.flows)
+        return [flows[index] for index in self._order]
+
+    def overlapping_flows(self, samples: int = 50) -> List[Tuple[Flow, Flow, str]]:
+        """Return the pairs of flows whose regex processors both accept an example message
+        (and the example). The examples are generated from the regexes: Every reported
+        pair does overlap, but not every overlap is found."""
+        regex_flows = [
+            flow for flow in self.probe_order if isinstance(flow.processor, RegexProcessor)
+        ]
+        examples = {
+            id(flow): [
+                example for example in regex_examples(flow.processor.regex.pattern, samples)
+                if flow.processor.parse(example) is not None
+            ]
+            for flow in regex_flows
+        }
+
+        overlaps = []
+        for i, first in enumerate(regex_flows):
+            for second in regex_flows[i + 1:]:
+                both = (
+                    example for example in examples[id(first)] + examples[id(second)]
+                    if first.processor.parse(example) is not None
+                    and second.processor.parse(example) is not None
+                )
+                example = next(both, None)
+                if example is not None:
+                    overlaps.append((first, second, example))
+        return overlaps
+
+    def flow_infos(self) -> List[FlowInfo]:
+        """Return the probe position and the match statistics of the flows in probe
+        order."""
+        flows = list(self.flows)
+        return [
+            FlowInfo(
+                processor=type(flows[index].processor).__name__,
+                command=getattr(flows[index].processor, 'command', None),
+                priority=flows[index].priority,
+                matches=self._matches[index]
+            )
+            for index in self._order
+        ]
+
+    async def _call_processor(
+            self, flow: Flow, ctx: Context, incoming: Incoming, placeholder: bool = True
+    ) -> Any:
+        result = flow.processor(ctx.clone(), incoming)
+        if not inspect.isawaitable(result):
+            # Streaming processor: Returns an async iterable
+            return result
+
+        if flow.placeholder_after is None or not placeholder:
+            return await result
+
+        task = asyncio.ensure_future(result)
+        done, _ = await asyncio.wait([task], timeout=flow.placeholder_after)
+        if not done:
+            # A failing placeholder is no reason to abort the flow
+            results = await asyncio.gather(*[
+                action.placeholder(ctx.clone(), flow.placeholder_text) for action in flow.actions
+            ], return_exceptions=True)
+            for res in results:
+                if isinstance(res, Exception):
+                    self.logger.warning("Posting the placeholder failed: %s", str(res))
+        return await task
 
     async def _call_formatters(
             self, formatters: Iterable[Formatter], ctx: Context, payload: Any
     ) -> Any:
         for formatter in formatters:
-            payload = await formatter(ctx.clone(), payload)
+            if formatter.CPU_BOUND:
+                payload = await self.offloader.run(formatter.format, ctx.clone(), payload)
+            else:
+                payload = await formatter(ctx.clone(), payload)
         return payload
 
     async def _call_actions(
-            self, actions: Iterable[act.Action], ctx: Context, payload: Any
+            self, actions: Iterable[act.Action], ctx: Context, payload: Any,
+            replies: Optional[Replies] = None
     ) -> None:
+        if replies is not None:
+            replies.extend((action, payload) for action in actions)
+            return
         coros = [action(ctx.clone(), payload) for action in actions]
         await asyncio.gather(*coros)
 
-    async def _handle_error(self, ctx: Context, error_message: Optional[str] = None) -> None:
+    async def _dispatch(
+            self, flow: Flow, ctx: Context, payload: Any, replies: Optional[Replies] = None
+    ) -> None:
+        payload = await self._call_formatters(flow.formatters, ctx, payload)
+        await self._call_actions(flow.actions, ctx, payload, replies)
+
+    async def _dispatch_provisional(self, flow: Flow, ctx: Context, payload: Any) -> None:
+        payload = await self._call_formatters(flow.formatters, ctx, payload)
+        await asyncio.gather(*[
+            action.provisional(ctx.clone(), payload) for action in flow.actions
+        ])
+
+    async def _dispatch_stream(
+            self, flow: Flow, ctx: Context, payloads: AsyncIterable[Any],
+            replies: Optional[Replies] = None
+    ) -> None:
+        if flow.batch:
+            await self._dispatch(flow, ctx, [payload async for payload in payloads], replies)
+            return
+
+        if not flow.update_in_place:
+            async for payload in payloads:
+                await self._dispatch(flow, ctx, payload, replies)
+            return
+
+        if replies is not None:
+            # Collected replies are sent once: Only the final payload is left to show
+            final: List[Any] = []
+            async for payload in payloads:
+                final[:] = [payload]
+            for payload in final:
+                await self._dispatch(flow, ctx, payload, replies)
+            return
+
+        # Every payload replaces the previous one as soon as it arrives. On errors the last
+        # one stays replaceable: The error reply takes its place.
+        async for payload in payloads:
+            await self._dispatch_provisional(flow, ctx, payload)
+        await asyncio.gather(*[action.finish(ctx.clone()) for action in flow.actions])
+
+    def _split_commands(self, incoming: Incoming) -> List[MessageIncoming]:
+        if not self.split_commands or not isinstance(incoming, MessageIncoming):
+            return []
+        commands = [
+            cmd.strip() for cmd in re.split(self.COMMAND_SEPARATOR_REGEX, incoming.text)
+            if cmd.strip()
+        ]
+        if len(commands) < 2:
+            return []
+        return [attr.evolve(incoming, text=cmd) for cmd in commands]
+
+    async def _handle_commands(self, commands: List[MessageIncoming], ctx: Context) -> None:
+        """Processes the commands concurrently and hands the ordered replies per action over
+        at once."""
+        all_replies: List[Replies] = [[] for _ in commands]
+        await asyncio.gather(*[
+            self._handle_incoming(command, replies=replies)
+            for command, replies in zip(commands, all_replies)
+        ])
+
+        by_action: Dict[int, Tuple[act.Action, List[Any]]] = {}
+        for action, payload in (reply for replies in all_replies for reply in replies):
+            by_action.setdefault(id(action), (action, []))[1].append(payload)
+
+        await asyncio.gather(*[
+            action(ctx.clone(), CompositePayload(payloads))
+            for action, payloads in by_action.values()
+        ])
+
+    async def _handle_error(
+            self, ctx: Context, error_message: Optional[str] = None,
+            replies: Optional[Replies] = None
+    ) -> None:
         if not error_message:
             import sys
             import traceback
@@ -55,41 +306,65 @@ class Orchestrator(LogMixin):
         else:
             trace = "No trace"
 
-        await self._handle_incoming(ErrorIncoming(error_message, trace), ctx)
+        await self._handle_incoming(ErrorIncoming(error_message, trace), ctx, replies)
 
-    async def _handle_unhandled(self, ctx: Context) -> None:
+    async def _handle_unhandled(self, ctx: Context, replies: Optional[Replies] = None) -> None:
         command = "unknown"
         if isinstance(ctx.incoming, MessageIncoming):
             command = str(ctx.incoming.text)
-        await self._handle_incoming(UnknownCommandIncoming(command), ctx)
+        await self._handle_incoming(UnknownCommandIncoming(command), ctx, replies)
 
-    async def _handle_incoming(self, incoming: Incoming, ctx: Optional[Context] = None) -> None:
-        """Kicks of the flow for one message. This is the callback for the listener."""
+    async def _handle_incoming(
+            self, incoming: Incoming, ctx: Optional[Context] = None,
+            replies: Optional[Replies] = None
+    ) -> None:
+        """Kicks of the flow for one message. This is the callback for the listener.
+        If `replies` is passed the actions are not called but collected instead."""
         # Context might be set in case of an error or an unknown message that needs to be
         # handled
         if not ctx:
             ctx = Context(incoming=incoming)
+            commands = self._split_commands(incoming)
+            if commands:
+                await self._handle_commands(commands, ctx)
+                return
 
         handled = False
-        for flow in self.flows:
+        routed = False
+        flows = list(self.flows)
+        for index in list(self._order):
+            flow = flows[index]
+            if routed and not flow.broadcast:
+                continue
             try:
                 if await flow.processor.can_process(incoming.clone()):
                     handled = True
-                    current = incoming.clone()
-                    current = await flow.processor(ctx.clone(), current)
-                    current = await self._call_formatters(flow.formatters, ctx, current)
-                    await self._call_actions(flow.actions, ctx, current)
+                    routed = self.routing == 'first' and not flow.broadcast
+                    self._record_match(index)
+                    current = await self._call_processor(
+                        flow, ctx, incoming.clone(), placeholder=replies is None
+                    )
+                    if hasattr(current, '__aiter__'):
+                        await self._dispatch_stream(flow, ctx, current, replies)
+                    else:
+                        await self._dispatch(flow, ctx, current, replies)
+            except CircuitOpenError as exc:
+                # Upstream is known to be down: A short message is enough
+                self.logger.warning("Failing fast: %s", str(exc))
+                handled = True
+                if not isinstance(incoming, ErrorIncoming):
+                    await self._handle_error(ctx, str(exc), replies)
             except:  # pylint: disable=bare-except
                 self.logger.exception("Error caught while processing the payload:\n%s", str(incoming))
                 handled = True
                 if not isinstance(incoming, ErrorIncoming):
-                    await self._handle_error(ctx)
+                    await self._handle_error(ctx, replies=replies)
                 else:
                     self.logger.warning("While handling the error a new error was caught. Aborting... ")
 
         if not handled:
             if not isinstance(incoming, UnknownCommandIncoming):
-                await self._handle_unhandled(ctx)
+                await self._handle_unhandled(ctx, replies)
             else:
                 self.logger.warning(
                     "Incoming '%s' cannot be handled and no "
@@ -101,4 +376,7 @@ class Orchestrator(LogMixin):
         """Run the application. Will start the listener and kick of the flow on incoming
         messages."""
         self.listener.callback = self._handle_incoming
-        await self.listener.start()
+        try:
+            await self.listener.start()
+        finally:
+            self.offloader.shutdown()
@@ -1,9 +1,10 @@
 """Processor package."""
 
-from homebot.processors import hass, lego, traffic
+from homebot.processors import grammar, hass, lego, traffic
 from homebot.processors.base import (
-    Error, Help, Processor, RegexProcessor, UnknownCommand, Version
+    Alert, Circuits, Error, Flows, Help, Limits, Processor, RegexProcessor, UnknownCommand,
+    Version
 )
 
-__all__ = ['hass', 'lego', 'traffic', 'Error', 'Help', 'Processor',
-           'RegexProcessor', 'UnknownCommand', 'Version']
+__all__ = ['grammar', 'hass', 'lego', 'traffic', 'Alert', 'Circuits', 'Error', 'Flows', 'Help', 'Limits',
+           'Processor', 'RegexProcessor', 'UnknownCommand', 'Version']
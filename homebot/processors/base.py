@@ -1,13 +1,17 @@
 """Contains message processor base classes. Processors do process messages produced by
 listeners."""
 import re
-from typing import Any, Optional, Iterable, Match
+from typing import Any, Callable, Dict, Optional, Iterable, Match, Pattern, Sequence, TypeVar, Union
 
-from homebot.models import HelpEntry, Incoming, MessageIncoming, Context, ErrorIncoming, \
-    UnknownCommandIncoming
+from homebot.models import AlertIncoming, HelpEntry, Incoming, MessageIncoming, Context, \
+    ErrorIncoming, FlowInfo, UnknownCommandIncoming
+from homebot.processors.grammar import CommandTrie, Element, Grammar
+from homebot.services.base import AdaptiveLimiter, CircuitBreaker, CircuitInfo, LimiterInfo
 from homebot.utils import AutoStrMixin, LogMixin
 from homebot.validator import TypeGuardMeta
 
+T = TypeVar('T')
+
 
 class Processor(AutoStrMixin, LogMixin, metaclass=TypeGuardMeta):
     """Base class for message processors."""
@@ -25,9 +29,17 @@ class Processor(AutoStrMixin, LogMixin, metaclass=TypeGuardMeta):
 
     # We need to type payload with Any. Otherwise the typing of the childs will be invalid
     async def __call__(self, ctx: Context, payload: Any) -> Any:
-        """Process the given message."""
+        """Process the given message. Implement it as an async generator to stream
+        multiple results."""
         raise NotImplementedError()  # pragma: no cover
 
+    async def offload(self, func: Callable[..., T], *args: Any) -> T:
+        """Runs the cpu-bound `func(*args)` off the event loop by using the offloader of
+        the orchestrator. Without an orchestrator it is called directly."""
+        if self.orchestrator is None:
+            return func(*args)
+        return await self.orchestrator.offloader.run(func, *args)  # type: ignore
+
 
 class Error(Processor):
     """Processor to handle the ErrorPayload."""
@@ -55,13 +67,38 @@ class UnknownCommand(Processor):
         return payload
 
 
+class Alert(Processor):
+    """Processor to pass on the payload of alerts of the given kind."""
+
+    def __init__(self, kind: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.kind = str(kind)
+
+    async def help(self) -> Optional[HelpEntry]:
+        return None
+
+    async def can_process(self, incoming: Incoming) -> bool:
+        return isinstance(incoming, AlertIncoming) and incoming.kind == self.kind
+
+    async def __call__(self, ctx: Context, payload: AlertIncoming) -> Any:
+        return payload.payload
+
+
 class RegexProcessor(Processor):
-    """Regex-powered processor to parse messages.
-    You have to implement the `MESSAGE_REGEX` and the method `_matched` in subclasses."""
+    """Command processor to parse messages. The arguments following the command are
+    declared by the `GRAMMAR` (see `homebot.processors.grammar`) and are returned by
+    `__call__` - access them by name. The grammars of all processors of an orchestrator
+    share a single command trie, so every message is tokenized and parsed once.
+
+    Subclasses may set a `MESSAGE_REGEX` (with a `{command}` placeholder) instead; the
+    named groups of the match are returned then."""
+
+    __ignore_fields__ = ['commands']
 
     DEFAULT_COMMAND: Optional[str] = None  # Default command when not passed via initializer
     VALID_COMMAND_PATTERN = r'^\w[\w \d]+$'
-    MESSAGE_REGEX = r'^\s*{command}\s*$'
+    GRAMMAR: Sequence[Element] = ()  # The elements following the command words
+    MESSAGE_REGEX: Optional[str] = None
 
     def __init__(self, command: Optional[str] = None, **kwargs: Any):
         super().__init__(**kwargs)
@@ -74,23 +111,48 @@ class RegexProcessor(Processor):
         if not valid_cmd:
             raise ValueError(f"Argument 'command' ('{self.command}') is not a valid command.")
 
-        # Condense multiple spaces into regex pattern
-        command_regex = re.sub(r'\s+', ' ', self.command).strip().replace(' ', r'\s+')
-        self._regex = re.compile(
-            self.MESSAGE_REGEX.format(command=command_regex),
-            re.IGNORECASE
-        )
+        self.grammar: Optional[Grammar] = None
+        # Replaced by the shared trie of the orchestrator
+        self.commands: Optional[CommandTrie] = None
+        if self.MESSAGE_REGEX is None:
+            self.grammar = Grammar(self.command, self.GRAMMAR)
+            self.commands = CommandTrie([self.grammar])
+            self._regex = self.grammar.regex
+        else:
+            # Condense multiple spaces into regex pattern
+            command_regex = re.sub(r'\s+', ' ', self.command).strip().replace(' ', r'\s+')
+            self._regex = re.compile(
+                self.MESSAGE_REGEX.format(command=command_regex),
+                re.IGNORECASE
+            )
 
     async def help(self) -> Optional[HelpEntry]:
         """Return the help entry for this processor."""
         return HelpEntry(
             command=str(self.command),
-            usage=str(self.command),
+            usage=self.usage,
             description=""
         )
 
-    async def _try_match(self, message: MessageIncoming) -> Optional[Match[str]]:
-        return self._regex.match(message.text)
+    @property
+    def usage(self) -> str:
+        """Return the usage of the command (rendered from the grammar)."""
+        return self.grammar.usage if self.grammar else str(self.command)
+
+    @property
+    def regex(self) -> Pattern[str]:
+        """Return the compiled message regex. For grammars it accepts (roughly) the same
+        messages as the grammar."""
+        return self._regex
+
+    def parse(self, text: str) -> Optional[Union[Match[str], Dict[str, Any]]]:
+        """Parses the message text. Return None if the processor does not accept it."""
+        if self.grammar is None or self.commands is None:
+            return self._regex.match(text)
+        return self.commands.route(text).get(self.grammar)
+
+    async def _try_match(self, message: MessageIncoming) -> Optional[Union[Match[str], Dict[str, Any]]]:
+        return self.parse(message.text)
 
     async def can_process(self, incoming: Incoming) -> bool:
         if not isinstance(incoming, MessageIncoming):
@@ -99,7 +161,7 @@ class RegexProcessor(Processor):
 
     async def __call__(self, ctx: Context, payload: MessageIncoming) -> Any:
         match = await self._try_match(payload)
-        if not match:
+        if match is None:
             raise RuntimeError(
                 "Processor is called with a message that is not supported. "
                 "Call `can_process(...)` first to make sure the incoming is supported."
@@ -116,7 +178,7 @@ class Help(RegexProcessor):
     async def help(self) -> Optional[HelpEntry]:
         return HelpEntry(
             command=str(self.command),
-            usage=str(self.command),
+            usage=self.usage,
             description="Shows this help page."
         )
 
@@ -143,7 +205,7 @@ class Version(RegexProcessor):
     async def help(self) -> Optional[HelpEntry]:
         return HelpEntry(
             command=str(self.command),
-            usage=str(self.command),
+            usage=self.usage,
             description="Shows the version of homebot."
         )
 
@@ -151,3 +213,59 @@ class Version(RegexProcessor):
         await super().__call__(ctx, payload)
         from homebot import __VERSION__
         return __VERSION__
+
+
+class Circuits(RegexProcessor):
+    """Provides a command (!circuits) to show the state of the circuit breakers guarding
+    the upstream services."""
+
+    DEFAULT_COMMAND = 'circuits'
+
+    async def help(self) -> Optional[HelpEntry]:
+        return HelpEntry(
+            command=str(self.command),
+            usage=self.usage,
+            description="Shows the state of the upstream services."
+        )
+
+    async def __call__(self, ctx: Context, payload: MessageIncoming) -> Iterable[CircuitInfo]:
+        await super().__call__(ctx, payload)
+        return [breaker.info() for breaker in CircuitBreaker.all()]
+
+
+class Limits(RegexProcessor):
+    """Provides a command (!limits) to show the current concurrency limits and queue depths
+    of the upstream services."""
+
+    DEFAULT_COMMAND = 'limits'
+
+    async def help(self) -> Optional[HelpEntry]:
+        return HelpEntry(
+            command=str(self.command),
+            usage=self.usage,
+            description="Shows the concurrency limits of the upstream services."
+        )
+
+    async def __call__(self, ctx: Context, payload: MessageIncoming) -> Iterable[LimiterInfo]:
+        await super().__call__(ctx, payload)
+        return [limiter.info() for limiter in AdaptiveLimiter.all()]
+
+
+class Flows(RegexProcessor):
+    """Provides a command (!flows) to show the order the flows of the orchestrator are
+    probed in and how often they matched."""
+
+    DEFAULT_COMMAND = 'flows'
+
+    async def help(self) -> Optional[HelpEntry]:
+        return HelpEntry(
+            command=str(self.command),
+            usage=self.usage,
+            description="Shows the order the commands are probed in and how often they matched."
+        )
+
+    async def __call__(self, ctx: Context, payload: MessageIncoming) -> Iterable[FlowInfo]:
+        await super().__call__(ctx, payload)
+        if not self.orchestrator:
+            return []
+        return list(self.orchestrator.flow_infos())
@@ -0,0 +1,383 @@
+"""Declarative command grammar for message processors.
+
+A grammar is made of the command words (like `traffic stats`) and a sequence of argument
+elements (literal words, typed arguments and optional parts). Messages are split into
+tokens once; the `CommandTrie` routes the tokens to the grammars whose command words
+they start with and parses the arguments in the same pass. The usage of the help entries
+is rendered from the same elements."""
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Pattern, Sequence, Tuple
+
+import attr
+
+from homebot.utils import AutoStrMixin, LogMixin
+
+# Commas are tokens of their own, a leading plus (like in `+15`) starts a new token
+TOKEN_REGEX = re.compile(r',|\+?[^\s,+]+|\+')
+
+Values = Dict[str, Any]
+# (token position after the element, values parsed by the element)
+Parses = Iterator[Tuple[int, Values]]
+
+
+@attr.s(frozen=True)
+class Token:
+    """A single token of a message and its position in the message text."""
+    text: str = attr.ib()
+    start: int = attr.ib()
+    end: int = attr.ib()
+
+
+def tokenize(text: str) -> List[Token]:
+    """
+    Splits the message text into tokens.
+
+    Example:
+
+        >>> [token.text for token in tokenize('traffic Mainz to Frankfurt,Wiesbaden +15')]
+        ['traffic', 'Mainz', 'to', 'Frankfurt', ',', 'Wiesbaden', '+15']
+    """
+    return [Token(match.group(), match.start(), match.end()) for match in TOKEN_REGEX.finditer(text)]
+
+
+@attr.s(frozen=True)
+class ArgType:
+    """The type of an argument. Every token of the argument has to fully match the
+    `pattern`; multi token arguments span one or more tokens and are passed on as the
+    original text. The `usage` is a template for the help entry (`{label}` is replaced by
+    the label of the argument)."""
+    pattern: str = attr.ib()
+    convert: Callable[[str], Any] = attr.ib(default=str)
+    multi_token: bool = attr.ib(default=False)
+    usage: str = attr.ib(default='<{label}>')
+    _regex: Pattern[str] = attr.ib(init=False, repr=False, eq=False)
+
+    def __attrs_post_init__(self) -> None:
+        object.__setattr__(self, '_regex', re.compile(self.pattern, re.IGNORECASE))
+
+    def matches(self, token: Token) -> bool:
+        """Checks if the token can be (a part of) the argument."""
+        return self._regex.fullmatch(token.text) is not None
+
+
+def _offset(token: str) -> int:
+    return int(re.match(r'\+(\d+)', token).group(1))  # type: ignore
+
+
+def choice(*words: str) -> ArgType:
+    """Return an argument type that accepts one of the `words` (case-insensitive)."""
+    return ArgType(
+        pattern='|'.join(re.escape(word) for word in words), convert=str.lower, usage='|'.join(words)
+    )
+
+
+WORD = ArgType(r'\w+')
+INT = ArgType(r'\d+', convert=int)
+PHRASE = ArgType(r'\w+', multi_token=True)  # Words like `Frankfurt Hbf`
+TEXT = ArgType(r'\S+', multi_token=True, usage='<{label}> [<{label}> ...]')  # Anything
+CLOCK = ArgType(r'\d{1,2}:\d{2}', usage='HH:MM')
+DURATION = ArgType(r'\d+[mhdw]', convert=str.lower)  # Like `30m`, `12h`, `7d` or `1w`
+OFFSET = ArgType(r'\+\d+\w*', convert=_offset, usage='+{label}')  # Like `+15` or `+15min`
+ENTITY = ArgType(r'\w+\.\w+', usage='<domain>.<entity>')
+
+
+class Element:
+    """Base class of the grammar elements that follow the command words."""
+
+    def parse(self, text: str, tokens: Sequence[Token], pos: int) -> Parses:
+        """Yields every way the element can be parsed from the tokens starting at `pos`
+        (preferred ones first)."""
+        raise NotImplementedError()  # pragma: no cover
+
+    def names(self) -> List[str]:
+        """Return the names of the arguments of the element."""
+        return []
+
+    def usage(self) -> str:
+        """Return the usage of the element for the help entry."""
+        raise NotImplementedError()  # pragma: no cover
+
+    def regex(self) -> str:
+        """Return a regex (including the leading whitespace) of the element."""
+        raise NotImplementedError()  # pragma: no cover
+
+
+def _parse_sequence(elements: Sequence[Element], text: str, tokens: Sequence[Token], pos: int) -> Parses:
+    if not elements:
+        yield pos, {}
+        return
+    for end, values in elements[0].parse(text, tokens, pos):
+        for rest_end, rest_values in _parse_sequence(elements[1:], text, tokens, end):
+            yield rest_end, {**values, **rest_values}
+
+
+@attr.s(frozen=True)
+class Word(Element):
+    """A literal word (case-insensitive)."""
+    text: str = attr.ib(converter=lambda text: str(text).lower())
+
+    def parse(self, text: str, tokens: Sequence[Token], pos: int) -> Parses:
+        if pos < len(tokens) and tokens[pos].text.lower() == self.text:
+            yield pos + 1, {}
+
+    def usage(self) -> str:
+        return self.text
+
+    def regex(self) -> str:
+        return r'\s+' + re.escape(self.text)
+
+
+@attr.s(frozen=True)
+class Unless(Element):
+    """Does not consume anything, but rejects the message if the next token is the
+    literal word."""
+    text: str = attr.ib(converter=lambda text: str(text).lower())
+
+    def parse(self, text: str, tokens: Sequence[Token], pos: int) -> Parses:
+        if pos >= len(tokens) or tokens[pos].text.lower() != self.text:
+            yield pos, {}
+
+    def usage(self) -> str:
+        return ''
+
+    def regex(self) -> str:
+        return r'(?!\s+{}(?:\s|$))'.format(re.escape(self.text))
+
+
+@attr.s(frozen=True)
+class Arg(Element):
+    """A typed argument. If `many` is set it is a list of one or more values that are
+    separated by commas (or by whitespace for single token types)."""
+    name: str = attr.ib()
+    type: ArgType = attr.ib(default=WORD)
+    many: bool = attr.ib(default=False)
+    label: Optional[str] = attr.ib(default=None)
+
+    def _item(self, text: str, tokens: Sequence[Token], pos: int) -> Iterator[Tuple[int, Any]]:
+        if not self.type.multi_token:
+            if pos < len(tokens) and self.type.matches(tokens[pos]):
+                yield pos + 1, self.type.convert(tokens[pos].text)
+            return
+        end = pos
+        while end < len(tokens) and self.type.matches(tokens[end]):
+            end += 1
+            yield end, self.type.convert(text[tokens[pos].start:tokens[end - 1].end])
+
+    def _items(self, text: str, tokens: Sequence[Token], pos: int) -> Iterator[Tuple[int, List[Any]]]:
+        """Yields the lists of items starting at `pos`, longest first. Iterative: Long lists
+        must not hit the recursion limit."""
+        alternatives: List[List[Tuple[int, Any]]] = []  # The ways to parse each item
+        values: List[Any] = []  # The values of the items the list goes on after
+        start: Optional[int] = pos
+        while start is not None:
+            item = list(self._item(text, tokens, start))
+            if not item:
+                break
+            alternatives.append(item)
+            start = None
+            for end, value in reversed(item):
+                if end < len(tokens) and tokens[end].text == ',':
+                    start = end + 1
+                elif not self.type.multi_token:
+                    start = end
+                else:
+                    continue
+                values.append(value)
+                break
+
+        for index in reversed(range(len(alternatives))):
+            for end, value in reversed(alternatives[index]):
+                yield end, values[:index] + [value]
+
+    def parse(self, text: str, tokens: Sequence[Token], pos: int) -> Parses:
+        items = self._items(text, tokens, pos) if self.many else self._item(text, tokens, pos)
+        for end, value in items:
+            yield end, {self.name: value}
+
+    def names(self) -> List[str]:
+        return [self.name]
+
+    def usage(self) -> str:
+        usage = self.type.usage.format(label=self.label or self.name)
+        return f'{usage}[, {usage} ...]' if self.many else usage
+
+    def regex(self) -> str:
+        item = self.type.pattern
+        if self.type.multi_token:
+            item = r'{0}(?:\s+{0})*'.format(item)
+        if self.many:
+            separator = r'\s*,\s*' if self.type.multi_token else r'(?:\s*,\s*|\s+)'
+            item = r'{0}(?:{1}{0})*'.format(item, separator)
+        return r'\s+(?:{})'.format(item)
+
+
+class Opt(Element):
+    """Optional sequence of elements. The arguments of skipped elements are None."""
+
+    def __init__(self, *elements: Element):
+        self.elements = tuple(elements)
+
+    def __repr__(self) -> str:
+        return 'Opt({})'.format(', '.join(repr(element) for element in self.elements))
+
+    def parse(self, text: str, tokens: Sequence[Token], pos: int) -> Parses:
+        yield from _parse_sequence(self.elements, text, tokens, pos)
+        yield pos, {}
+
+    def names(self) -> List[str]:
+        return [name for element in self.elements for name in element.names()]
+
+    def usage(self) -> str:
+        return '[{}]'.format(' '.join(filter(None, (element.usage() for element in self.elements))))
+
+    def regex(self) -> str:
+        return '(?:{})?'.format(''.join(element.regex() for element in self.elements))
+
+
+class Grammar(AutoStrMixin):
+    """The grammar of a command: The command words followed by the argument elements.
+
+    Example:
+
+        >>> dut = Grammar('traffic stats', [
+        ...     Arg('source', PHRASE, label='origin'), Word('to'), Arg('target', PHRASE),
+        ...     Opt(Word('at'), Arg('departure', CLOCK))
+        ... ])
+        >>> dut.usage
+        'traffic stats <origin> to <target> [at HH:MM]'
+        >>> dut.parse('Traffic stats Frankfurt Hbf to Mainz')
+        {'source': 'Frankfurt Hbf', 'target': 'Mainz', 'departure': None}
+        >>> dut.parse('traffic stats Frankfurt to Mainz at 7:42')['departure']
+        '7:42'
+        >>> dut.parse('traffic stats Frankfurt') is None
+        True
+    """
+
+    def __init__(self, command: str, elements: Iterable[Element] = ()):
+        self.words = tuple(str(command).lower().split())
+        if not self.words:
+            raise ValueError("Argument 'command' needs at least one word.")
+        self.elements = tuple(elements)
+        self._defaults = {name: None for element in self.elements for name in element.names()}
+
+    @property
+    def command(self) -> str:
+        """Return the command words."""
+        return ' '.join(self.words)
+
+    @property
+    def usage(self) -> str:
+        """Return the usage of the command for the help entry."""
+        return ' '.join(filter(None, [self.command] + [element.usage() for element in self.elements]))
+
+    @property
+    def regex(self) -> Pattern[str]:
+        """Return a regex accepting (roughly) the same messages as the grammar."""
+        return re.compile(
+            r'^\s*' + r'\s+'.join(re.escape(word) for word in self.words)
+            + ''.join(element.regex() for element in self.elements) + r'\s*$',
+            re.IGNORECASE
+        )
+
+    def parse_arguments(self, text: str, tokens: Sequence[Token], pos: int) -> Optional[Values]:
+        """Parses the arguments from the tokens following the command words. Return None if
+        the tokens are not valid."""
+        for end, values in _parse_sequence(self.elements, text, tokens, pos):
+            if end == len(tokens):
+                return {**self._defaults, **values}
+        return None
+
+    def parse(self, text: str) -> Optional[Values]:
+        """Parses the message text. Return None if the text is not valid."""
+        tokens = tokenize(text)
+        words = tuple(token.text.lower() for token in tokens[:len(self.words)])
+        if words != self.words:
+            return None
+        return self.parse_arguments(text, tokens, len(self.words))
+
+
+class _Node:
+    __slots__ = ['children', 'grammars']
+
+    def __init__(self) -> None:
+        self.children: Dict[str, '_Node'] = {}
+        self.grammars: List[Grammar] = []
+
+
+class CommandTrie(LogMixin):
+    """Routes messages to the grammars by their command words. The message is tokenized
+    once and walked down the trie; the grammars with the longest matching command words
+    are parsed first (so `traffic stats ...` is not taken as `traffic` with arguments).
+    The results of the recently routed messages are cached, because all processors of an
+    orchestrator ask for the same message.
+
+    Example:
+
+        >>> stats = Grammar('traffic stats', [Arg('source', PHRASE)])
+        >>> traffic = Grammar('traffic', [Arg('source', PHRASE)])
+        >>> dut = CommandTrie([stats, traffic])
+        >>> dut.route('traffic stats Frankfurt') == {stats: {'source': 'Frankfurt'}}
+        True
+        >>> dut.route('traffic Frankfurt') == {traffic: {'source': 'Frankfurt'}}
+        True
+        >>> dut.route('help')
+        {}
+    """
+
+    CACHE_SIZE = 32
+
+    def __init__(self, grammars: Iterable[Grammar] = ()):
+        self._root = _Node()
+        self._cache: 'OrderedDict[str, Dict[Grammar, Values]]' = OrderedDict()
+        for grammar in grammars:
+            self.add(grammar)
+
+    def _node(self, grammar: Grammar) -> _Node:
+        node = self._root
+        for word in grammar.words:
+            node = node.children.setdefault(word, _Node())
+        return node
+
+    def __contains__(self, grammar: Grammar) -> bool:
+        return grammar in self._node(grammar).grammars
+
+    def add(self, grammar: Grammar) -> None:
+        """Adds the grammar to the trie."""
+        node = self._node(grammar)
+        if grammar not in node.grammars:
+            node.grammars.append(grammar)
+        self._cache.clear()
+
+    def _route(self, text: str) -> Dict[Grammar, Values]:
+        tokens = tokenize(text)
+        node, candidates = self._root, []
+        for depth, token in enumerate(tokens):
+            node = node.children.get(token.text.lower())  # type: ignore
+            if node is None:
+                break
+            if node.grammars:
+                candidates.append((depth + 1, node.grammars))
+
+        for depth, grammars in reversed(candidates):
+            parsed = {grammar: grammar.parse_arguments(text, tokens, depth) for grammar in grammars}
+            routed = {grammar: values for grammar, values in parsed.items() if values is not None}
+            if routed:
+                return routed
+        return {}
+
+    def route(self, text: str) -> Dict[Grammar, Values]:
+        """Return the grammars that accept the message and the parsed arguments. Messages
+        the parser fails on are not accepted by any grammar."""
+        if text in self._cache:
+            self._cache.move_to_end(text)
+            return self._cache[text]
+        try:
+            routed = self._route(text)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Parsing the message failed: %s", text[:100])
+            routed = {}
+        self._cache[text] = routed
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return routed
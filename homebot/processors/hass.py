@@ -1,11 +1,18 @@
 """Home assistant related processors."""
-from typing import Any, Iterable, Optional
+import asyncio
+import fnmatch
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Iterable, Optional, List, Tuple, Dict, Union
 
 import attr
+import numpy as np  # type: ignore
 
 from homebot.models import HelpEntry, MessageIncoming, Context
 from homebot.processors.base import RegexProcessor
-from homebot.services.hass import HassApi
+from homebot.processors.grammar import Arg, DURATION, ENTITY, Opt, TEXT, Word, choice
+from homebot.services.hass import HassApi, HassStateMirror, HassEntityIndex, HassHistory
 from homebot.validator import attrs_assert_type
 
 
@@ -29,34 +36,324 @@ class HassStateChange:
         ]
 
 
+@attr.s
+class _PendingCall:
+    """Service call that collects entities until the debounce window is over."""
+    entity_ids: List[str] = attr.ib(factory=list)
+    result: 'asyncio.Future[Any]' = attr.ib(factory=lambda: asyncio.get_event_loop().create_future())
+
+
 class OnOffSwitch(RegexProcessor):
-    """Home assistant on/off switching component for entities."""
+    """Home assistant on/off switching component for entities. Accepts multiple entities
+    and glob patterns (like `light.kitchen_*`), which are resolved against a cached list of
+    all entities. Comma separated friendly names (like `kitchen light`) are resolved by a
+    fuzzy index over that list; entity ids next to a name in the same chunk are kept as
+    they are. All entities are switched by a single service call.
+
+    If `debounce` is set, the entities of all switch commands that arrive within the
+    debounce window (in seconds) are merged into one service call per mode.
+
+    If `optimistic` is set, the processor streams the expected states right away and the
+    states confirmed by home assistant afterwards. States that are not confirmed within
+    `optimistic_timeout` seconds (default: half of the api `timeout`) are reported as
+    unconfirmed; the service call itself goes on. Combine it with a flow that updates in
+    place to replace the optimistic reply."""
     DEFAULT_COMMAND = 'switch'
-    MESSAGE_REGEX = r'^\s*{command}\s+(?P<mode>on|off)\s+(?P<domain>\w+)\.(?P<entity>\w+)\s*$'
+    ENTITY_PATTERN = r'[\w*?]+\.[\w*?]+'
+    GRAMMAR = (Arg('mode', choice('on', 'off')), Arg('entities', TEXT, label='entity'))
+    GLOB_CHARS = '*?'
 
-    def __init__(self, base_url: str, token: str, timeout: float = 5.0, **kwargs: Any):
+    def __init__(
+            self, base_url: str, token: str, timeout: float = 5.0, debounce: float = 0.0,
+            entity_cache_ttl: float = 60.0, optimistic: bool = False,
+            optimistic_timeout: Optional[float] = None, **kwargs: Any
+    ):
         super().__init__(**kwargs)
         self.api = HassApi(base_url, token, timeout)
+        self.debounce = float(debounce)
+        self.entity_cache_ttl = float(entity_cache_ttl)
+        self.optimistic = bool(optimistic)
+        # Must be shorter than the api timeout, otherwise the call fails before
+        self.optimistic_timeout = float(
+            self.api.timeout / 2 if optimistic_timeout is None else optimistic_timeout
+        )
+        self._entity_cache: Optional[Tuple[float, List[str]]] = None
+        self._friendly_names: Dict[str, str] = {}
+        self.index = HassEntityIndex()
+        self._pending: Dict[str, _PendingCall] = {}
 
     async def help(self) -> Optional[HelpEntry]:
         return HelpEntry(
             command=str(self.command),
-            usage=f"{self.command} on|off <domain>.<entity>",
-            description="Calls home assistant to turn on resp. off the passed entity."
+            usage=self.usage,
+            description="Calls home assistant to turn on resp. off the passed entities. "
+                        "Glob patterns like light.kitchen_* and comma separated names "
+                        "like kitchen light are supported."
         )
 
-    async def __call__(self, ctx: Context, payload: MessageIncoming) -> Iterable[HassStateChange]:
-        match = await super().__call__(ctx, payload)
-        mode = str(match.group('mode')).strip()
-        domain = str(match.group('domain')).strip()
-        entity = str(match.group('entity')).strip()
+    async def _entity_ids(self) -> List[str]:
+        now = time.monotonic()
+        if self._entity_cache is None or self._entity_cache[0] < now:
+            states = await self.api.call('states')
+            self.index.sync(states)
+            self._friendly_names = {
+                str(item.get('entity_id')): str((item.get('attributes') or {}).get('friendly_name', ''))
+                for item in states
+            }
+            entity_ids = sorted(str(item.get('entity_id')) for item in states)
+            self._entity_cache = (now + self.entity_cache_ttl, entity_ids)
+        return self._entity_cache[1]
+
+    async def _resolve_name(self, name: str) -> str:
+        await self._entity_ids()  # Refreshes the index if necessary
+        entity_id = self.index.best(name)
+        if not entity_id:
+            raise RuntimeError(f"No entity matches '{name}'")
+        return entity_id
 
-        if mode.lower() == 'on':
+    async def _resolve(self, entities: str) -> List[str]:
+        patterns: List[str] = []
+        for chunk in entities.split(','):
+            # Entity ids (and globs) are taken as they are, the other words form a name
+            chunk_patterns: List[Optional[str]] = []
+            words: List[str] = []
+            for token in chunk.split():
+                if re.fullmatch(self.ENTITY_PATTERN, token):
+                    chunk_patterns.append(token)
+                else:
+                    if not words:
+                        chunk_patterns.append(None)  # Placeholder for the name
+                    words.append(token)
+            for pattern in chunk_patterns:
+                patterns.append(pattern or await self._resolve_name(' '.join(words)))
+
+        resolved: List[str] = []
+        for pattern in patterns:
+            if any(char in pattern for char in self.GLOB_CHARS):
+                matches = fnmatch.filter(await self._entity_ids(), pattern)
+                if not matches:
+                    raise RuntimeError(f"No entity matches '{pattern}'")
+            else:
+                matches = [pattern]
+            resolved.extend(match for match in matches if match not in resolved)
+        return resolved
+
+    async def _call_service(self, mode: str, entity_ids: List[str]) -> Any:
+        if mode == 'on':
             endpoint = 'services/homeassistant/turn_on'
         else:
             endpoint = 'services/homeassistant/turn_off'
 
-        data = {'entity_id': f'{domain}.{entity}'}
-        res = await self.api.call(endpoint, method=HassApi.METHOD_POST, data=data)
+        data = {'entity_id': entity_ids[0] if len(entity_ids) == 1 else entity_ids}
+        return await self.api.call(endpoint, method=HassApi.METHOD_POST, data=data)
+
+    async def _flush(self, mode: str, pending: _PendingCall) -> None:
+        await asyncio.sleep(self.debounce)
+        del self._pending[mode]
+        try:
+            pending.result.set_result(await self._call_service(mode, pending.entity_ids))
+        except Exception as exc:  # pylint: disable=broad-except
+            pending.result.set_exception(exc)
+
+    async def _switch(self, mode: str, entity_ids: List[str]) -> Tuple[Any, List[str]]:
+        """Switches the entities. Returns the api response and the entities that were
+        actually switched by the service call (might be more due to debouncing)."""
+        if self.debounce <= 0:
+            return await self._call_service(mode, entity_ids), entity_ids
+
+        pending = self._pending.get(mode)
+        if pending is None:
+            pending = self._pending[mode] = _PendingCall()
+            asyncio.ensure_future(self._flush(mode, pending))
+        pending.entity_ids.extend(eid for eid in entity_ids if eid not in pending.entity_ids)
+        return await asyncio.shield(pending.result), pending.entity_ids
+
+    async def _confirmed(self, mode: str, entity_ids: List[str]) -> List[HassStateChange]:
+        res, switched = await self._switch(mode, entity_ids)
+        changes = HassStateChange.from_api_response(res)
+
+        if switched != entity_ids:
+            # Merged with other commands: Only report the own entities
+            changes = [change for change in changes if change.entity_id in entity_ids]
+        return list(changes)
 
-        return HassStateChange.from_api_response(res)
+    def _expected(self, entity_ids: List[str], state: str) -> List[HassStateChange]:
+        return [
+            HassStateChange(
+                friendly_name=self._friendly_names.get(entity_id, ''),
+                entity_id=entity_id,
+                state=state
+            )
+            for entity_id in entity_ids
+        ]
+
+    def _log_failed_confirmation(self, confirmation: 'asyncio.Future[Any]') -> None:
+        if not confirmation.cancelled() and confirmation.exception() is not None:
+            self.logger.warning("Switching failed: %s", str(confirmation.exception()))
+
+    async def _optimistic(
+            self, mode: str, entity_ids: List[str]
+    ) -> AsyncIterator[Iterable[HassStateChange]]:
+        yield self._expected(entity_ids, mode)
+        confirmation = asyncio.ensure_future(self._confirmed(mode, entity_ids))
+        confirmation.add_done_callback(self._log_failed_confirmation)
+        try:
+            # Shielded: Timing out must not cancel the service call
+            yield await asyncio.wait_for(asyncio.shield(confirmation), timeout=self.optimistic_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning("Switching %s was not confirmed in time", ', '.join(entity_ids))
+            yield self._expected(entity_ids, f"{mode} (unconfirmed)")
+
+    async def __call__(
+            self, ctx: Context, payload: MessageIncoming
+    ) -> Union[Iterable[HassStateChange], AsyncIterator[Iterable[HassStateChange]]]:
+        args = await super().__call__(ctx, payload)
+        mode = args['mode']
+        entity_ids = await self._resolve(args['entities'])
+        if self.optimistic:
+            return self._optimistic(mode, entity_ids)
+        return await self._confirmed(mode, entity_ids)
+
+
+class State(RegexProcessor):
+    """Answers the current state of an entity from an in-memory mirror of all home
+    assistant states. The mirror is started on first use."""
+    DEFAULT_COMMAND = 'state'
+    GRAMMAR = (Arg('entity_id', ENTITY),)
+
+    def __init__(self, base_url: str, token: str, timeout: float = 5.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.timeout = float(timeout)
+        self.mirror = HassStateMirror(base_url, token)
+
+    async def help(self) -> Optional[HelpEntry]:
+        return HelpEntry(
+            command=str(self.command),
+            usage=self.usage,
+            description="Shows the current state of the passed entity."
+        )
+
+    async def __call__(self, ctx: Context, payload: MessageIncoming) -> HassStateChange:
+        entity_id = (await super().__call__(ctx, payload))['entity_id']
+
+        await self.mirror.start()
+        await self.mirror.wait_ready(self.timeout)
+        state = self.mirror.state(entity_id)
+        if state is None:
+            raise RuntimeError(f"Entity '{entity_id}' is unknown to home assistant")
+
+        return list(HassStateChange.from_api_response([state]))[0]
+
+
+@attr.s
+class HassHistoryBucket:
+    """Aggregated sensor values of a single time bucket."""
+    start: datetime = attr.ib(validator=attrs_assert_type(datetime))
+    count: int = attr.ib(validator=attrs_assert_type(int))
+    minimum: float = attr.ib(validator=attrs_assert_type(float))
+    maximum: float = attr.ib(validator=attrs_assert_type(float))
+    mean: float = attr.ib(validator=attrs_assert_type(float))
+
+
+@attr.s
+class HassHistoryStats:
+    """Statistics of a sensor over a period of time."""
+    entity_id: str = attr.ib(validator=attrs_assert_type(str))
+    start: datetime = attr.ib(validator=attrs_assert_type(datetime))
+    end: datetime = attr.ib(validator=attrs_assert_type(datetime))
+    count: int = attr.ib(validator=attrs_assert_type(int))
+    minimum: float = attr.ib(validator=attrs_assert_type(float))
+    maximum: float = attr.ib(validator=attrs_assert_type(float))
+    mean: float = attr.ib(validator=attrs_assert_type(float))
+    percentiles: Dict[int, float] = attr.ib(validator=attrs_assert_type(Dict[int, float]))
+    buckets: List[HassHistoryBucket] = attr.ib(
+        validator=attrs_assert_type(List[HassHistoryBucket]), factory=list
+    )
+
+    @classmethod
+    def from_samples(
+            cls, entity_id: str, start: datetime, end: datetime, timestamps: np.ndarray,
+            values: np.ndarray, percentiles: Iterable[int], bucket_size: Optional[float] = None
+    ) -> 'HassHistoryStats':
+        """Computes the statistics of the samples. If a bucket size (seconds) is passed
+        the samples are aggregated per bucket as well."""
+        if not len(values):  # pylint: disable=len-as-condition
+            raise RuntimeError(f"There are no numeric samples of '{entity_id}' in the period")
+        percentiles = list(percentiles)
+        buckets = []
+        if bucket_size:
+            # Samples are sorted by time, so the bucket indices are sorted as well
+            indices = ((timestamps - start.timestamp()) // bucket_size).astype(np.int64)
+            bucket_ids, offsets, counts = np.unique(indices, return_index=True, return_counts=True)
+            minimums = np.minimum.reduceat(values, offsets)
+            maximums = np.maximum.reduceat(values, offsets)
+            means = np.add.reduceat(values, offsets) / counts
+            buckets = [
+                HassHistoryBucket(
+                    start=start + timedelta(seconds=float(bucket_id * bucket_size)),
+                    count=int(count), minimum=float(minimum), maximum=float(maximum),
+                    mean=float(mean)
+                )
+                for bucket_id, count, minimum, maximum, mean
+                in zip(bucket_ids, counts, minimums, maximums, means)
+            ]
+        return cls(
+            entity_id=entity_id,
+            start=start,
+            end=end,
+            count=int(len(values)),
+            minimum=float(np.min(values)),
+            maximum=float(np.max(values)),
+            mean=float(np.mean(values)),
+            percentiles=dict(zip(percentiles, (float(v) for v in np.percentile(values, percentiles)))),
+            buckets=buckets
+        )
+
+
+class History(RegexProcessor):
+    """Computes statistics (min, max, mean, percentiles) of a sensor over a period of time
+    using the home assistant history. Optionally the values are aggregated into time
+    buckets."""
+    DEFAULT_COMMAND = 'history'
+    GRAMMAR = (
+        Arg('entity_id', ENTITY), Opt(Arg('period', DURATION)), Opt(Word('by'), Arg('bucket', DURATION))
+    )
+
+    DEFAULT_PERIOD = '24h'
+    DEFAULT_PERCENTILES = (5, 50, 95)
+    UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+    def __init__(
+            self, base_url: str, token: str, timeout: float = 30.0,
+            percentiles: Iterable[int] = DEFAULT_PERCENTILES, **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        self.history = HassHistory(HassApi(base_url, token, timeout))
+        self.percentiles = list(percentiles)
+
+    async def help(self) -> Optional[HelpEntry]:
+        return HelpEntry(
+            command=str(self.command),
+            usage=self.usage,
+            description="Shows min, max, mean and percentiles of a sensor over the period "
+                        f"(default {self.DEFAULT_PERIOD}). Periods and buckets are passed "
+                        "like 30m, 12h, 7d or 1w."
+        )
+
+    @classmethod
+    def _seconds(cls, duration: str) -> float:
+        return float(int(duration[:-1]) * cls.UNITS[duration[-1]])
+
+    async def __call__(self, ctx: Context, payload: MessageIncoming) -> HassHistoryStats:
+        args = await super().__call__(ctx, payload)
+        entity_id = args['entity_id']
+        period = self._seconds(args['period'] or self.DEFAULT_PERIOD)
+        bucket = args['bucket']
+
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(seconds=period)
+        timestamps, values = await self.history.samples(entity_id, start, end)
+        return HassHistoryStats.from_samples(
+            entity_id, start, end, timestamps, values, self.percentiles,
+            bucket_size=self._seconds(bucket) if bucket else None
+        )
@@ -1,33 +1,35 @@
 """Lego related processors."""
+import asyncio
 import re
-from typing import Tuple, Optional
+from typing import Any, AsyncIterator, Dict, List, Tuple, Optional, Union
 
 import attr
 import httpx
-import pandas as pd  # type: ignore
-from bs4 import BeautifulSoup  # type: ignore
+import lxml.html  # type: ignore
 
 from homebot.models import HelpEntry, MessageIncoming, Context
 from homebot.processors.base import RegexProcessor
-from homebot.validator import attrs_assert_type
-
-
-@attr.s
-class LegoPricing:
-    """Lego pricing data container."""
-    set_name: str = attr.ib(validator=attrs_assert_type(str))
-    set_id: int = attr.ib(validator=attrs_assert_type(int))
-    set_image_url: str = attr.ib(validator=attrs_assert_type(str))
-    current: float = attr.ib(validator=attrs_assert_type(float))
-    recommended: float = attr.ib(validator=attrs_assert_type(float))
-    highest: float = attr.ib(validator=attrs_assert_type(float))
-    lowest: float = attr.ib(validator=attrs_assert_type(float))
+from homebot.processors.grammar import Arg, INT
+from homebot.services.base import AdaptiveLimiter, CircuitBreaker, Hedger
+from homebot.services.lego import LegoPricing, PriceHistory
 
 
 class Pricing(RegexProcessor):
-    """Processes a !traffic command and delegates the work to a traffic service."""
+    """Queries brickwatch.net for pricing information of lego sets. Fails fast while
+    brickwatch is down and queues requests when it is slow. Slow requests are hedged if a
+    `hedger` is passed.
+
+    Up to `max_sets` set ids per message are fetched concurrently (at most `max_concurrency`
+    at a time) and streamed as soon as they arrive. If a price `history` is passed every observation is
+    recorded and the pricing tells if it is within `near_low_tolerance` of the all-time
+    low."""
     DEFAULT_COMMAND = 'lego pricing'
-    MESSAGE_REGEX = r'^\s*{command}\s+(?P<set_id>\d+)\s*$'
+    GRAMMAR = (Arg('set_ids', INT, many=True, label='set id'),)
+    DEFAULT_MAX_CONCURRENCY = 4
+    DEFAULT_MAX_SETS = 20
+    DEFAULT_NEAR_LOW_TOLERANCE = 0.05
+    # Response validator -> request header to make the request conditional
+    CONDITIONAL_HEADERS = {'etag': 'If-None-Match', 'last-modified': 'If-Modified-Since'}
 
     CURRENT_PRICE_LABEL = 'Aktueller Preis'
     LEGO_RECOMMENDATION_LABEL = 'Lego Preisempfehlung'
@@ -38,65 +40,91 @@ class Pricing(RegexProcessor):
     USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 " \
                  "(KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36"
 
+    def __init__(
+            self, breaker: Optional[CircuitBreaker] = None,
+            limiter: Optional[AdaptiveLimiter] = None, hedger: Optional[Hedger] = None,
+            history: Optional[PriceHistory] = None,
+            max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_sets: int = DEFAULT_MAX_SETS,
+            near_low_tolerance: float = DEFAULT_NEAR_LOW_TOLERANCE, base_url: str = BASE_URL,
+            **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        self.base_url = str(base_url).rstrip('/')
+        self.breaker = breaker or CircuitBreaker.get('brickwatch')
+        self.limiter = limiter or AdaptiveLimiter.get('brickwatch')
+        self.hedger = hedger
+        self.history = history
+        self.max_concurrency = int(max_concurrency)
+        self.max_sets = int(max_sets)
+        self.near_low_tolerance = float(near_low_tolerance)
+
     async def help(self) -> Optional[HelpEntry]:
         return HelpEntry(
             command=str(self.command),
-            usage="{} <set id>".format(self.command),
-            description="Queries brickwatch.net for pricing information about the given set id"
+            usage=self.usage,
+            description="Queries brickwatch.net for pricing information about the given set id(s)"
         )
 
-    async def _fetch_set_ident(self, soup: BeautifulSoup, set_id: int) -> Tuple[str, int]:
-        name_tag = soup.find('h2', attrs={'itemprop': 'name'})
-        if not name_tag:
+    @classmethod
+    def _fetch_set_ident(cls, tree: Any, set_id: int) -> Tuple[str, int]:
+        set_name_id = tree.xpath('string((//h2[@itemprop="name"])[1]/@content)')
+        if not set_name_id:
             raise RuntimeError(
                 f"Name tag for lego set '{set_id}' was not found in the html content.")
-        set_name_id = name_tag['content']
-        match = re.match(self.NAME_ID_REGEX, set_name_id)
+        match = re.match(cls.NAME_ID_REGEX, set_name_id)
         if not match:
             raise RuntimeError(f"Could not extract name and set id from html content")
 
         return str(match.group('name')).strip(), int(str(match.group('id')).strip())
 
-    async def _fetch_prices(self, soup: BeautifulSoup) -> Tuple[float, float, float, float]:
+    @classmethod
+    def _fetch_prices(cls, tree: Any) -> Tuple[float, float, float, float]:
+        rows = tree.xpath(
+            '(//table[contains(concat(" ", normalize-space(@class), " "), " table-condensed ")])[1]//tr')
+        prices: Dict[str, str] = {}
+        for row in rows:
+            cells = row.xpath('./td')
+            if len(cells) >= 2:
+                prices.setdefault(cells[0].text_content().strip(), cells[1].text_content())
+
         def _fetch_price(label: str) -> float:
-            subset = df[df.label == label]
-            if len(subset) == 0:
+            if label not in prices:
                 raise IndexError(f"Could not fetch price with label '{label}'")
-            price_as_str = str(subset.iloc[0]['price'])  # First price
-            price_as_str = price_as_str.strip().strip('€').strip().replace(',', '.')
-            return float(price_as_str)
-
-        tables = soup.find('table', class_='table-condensed')
-        df = pd.read_html(str(tables))[0]
-        df.columns = ['label', 'price', 'info']
+            price_as_str = prices[label].strip().strip('€').strip()
+            return float(price_as_str.replace('.', '').replace(',', '.'))
 
         return (
-            _fetch_price(self.CURRENT_PRICE_LABEL),
-            _fetch_price(self.LEGO_RECOMMENDATION_LABEL),
-            _fetch_price(self.HIGHEST_EVER_LABEL),
-            _fetch_price(self.LOWEST_EVER_LABEL)
+            _fetch_price(cls.CURRENT_PRICE_LABEL),
+            _fetch_price(cls.LEGO_RECOMMENDATION_LABEL),
+            _fetch_price(cls.HIGHEST_EVER_LABEL),
+            _fetch_price(cls.LOWEST_EVER_LABEL)
         )
 
-    async def _fetch_image(self, soup: BeautifulSoup, set_id: int) -> str:
-        image_tag = soup.find('img', attrs={'id': 'setimage_xs'})
-        if not image_tag:
+    @classmethod
+    def _fetch_image(cls, tree: Any, set_id: int) -> str:
+        image_url = tree.xpath('string((//img[@id="setimage_xs"])[1]/@src)')
+        if not image_url:
             raise RuntimeError(
                 f"Image tag for lego set '{set_id}' was not found in the html content.")
-        return str(image_tag['src'])
+        return str(image_url)
 
-    async def __call__(self, ctx: Context, payload: MessageIncoming) -> LegoPricing:
-        match = await super().__call__(ctx, payload)
-        set_id = int(match.group('set_id').strip())
+    @classmethod
+    def extract(cls, content: Union[str, bytes], set_id: int) -> LegoPricing:
+        """Extracts the pricing information from a brickwatch set page. Only the set name,
+        the pricing table and the set image are looked at.
 
-        resp = await httpx.get(
-            url=f"{self.BASE_URL}/{str(set_id)}",
-            headers={'User-Agent': self.USER_AGENT}
-        )
-        soup = BeautifulSoup(resp.content, 'html.parser')
+        Args:
+            content: The html content of the brickwatch page.
+            set_id: The requested set id. Only used for error messages.
+
+        Returns:
+            The pricing information.
+        """
+        tree = lxml.html.fromstring(content)
 
-        set_name, p_set_id = await self._fetch_set_ident(soup, set_id)
-        current, recommended, highest, lowest = await self._fetch_prices(soup)
-        image_url = await self._fetch_image(soup, set_id)
+        set_name, p_set_id = cls._fetch_set_ident(tree, set_id)
+        current, recommended, highest, lowest = cls._fetch_prices(tree)
+        image_url = cls._fetch_image(tree, set_id)
 
         return LegoPricing(
             set_name=set_name,
@@ -107,3 +135,108 @@ class Pricing(RegexProcessor):
             highest=highest,
             lowest=lowest
         )
+
+    async def _fetch_page(self, set_id: int, headers: Optional[Dict[str, str]] = None) -> Any:
+        url = f"{self.base_url}/{str(set_id)}"
+
+        async def _get() -> Any:
+            async with self.breaker, self.limiter.permit():
+                resp = await httpx.get(url=url, headers={'User-Agent': self.USER_AGENT, **(headers or {})})
+                error = None if resp.status_code in (200, 304) else RuntimeError(
+                    f"Failed to fetch {url}\nHttp Code: {resp.status_code}"
+                )
+                if error and resp.status_code >= 500:
+                    raise error  # Server errors count as failures for the breaker
+            if error:
+                raise error
+            return resp
+
+        if self.hedger is None:
+            return await _get()
+        return await self.hedger(_get)
+
+    async def fetch(self, set_id: int) -> LegoPricing:
+        """Fetches the pricing information of the set and records it in the price history
+        (if any)."""
+        resp = await self._fetch_page(set_id)
+        return await self._evaluate(resp.content, set_id)
+
+    async def fetch_if_modified(
+            self, set_id: int, validators: Dict[str, str]
+    ) -> Optional[LegoPricing]:
+        """Like `fetch`, but only if the page changed since the response the `validators`
+        (ETag / Last-Modified) were taken from. Otherwise None is returned. The validators
+        are updated in place from the response - once the page was evaluated, so a page
+        that failed is fetched again."""
+        headers = {
+            condition: validators[validator]
+            for validator, condition in self.CONDITIONAL_HEADERS.items()
+            if validators.get(validator)
+        }
+        resp = await self._fetch_page(set_id, headers)
+        if resp.status_code == 304:
+            return None
+        pricing = await self._evaluate(resp.content, set_id)
+        for validator in self.CONDITIONAL_HEADERS:
+            if resp.headers.get(validator):
+                validators[validator] = str(resp.headers[validator])
+        return pricing
+
+    async def _evaluate(self, content: Union[str, bytes], set_id: int) -> LegoPricing:
+        pricing = await self.offload(self.extract, content, set_id)
+        if self.history is None:
+            return pricing
+
+        self.history.record(pricing)
+        low = self.history.all_time_low(pricing)
+        return attr.evolve(
+            pricing, all_time_low=low,
+            near_low=pricing.current <= low * (1 + self.near_low_tolerance)
+        )
+
+    async def _fetch_all(self, set_ids: List[int]) -> AsyncIterator[LegoPricing]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _fetch(set_id: int) -> Tuple[int, Any]:
+            async with semaphore:
+                try:
+                    return set_id, await self.fetch(set_id)
+                except Exception as exc:  # pylint: disable=broad-except
+                    return set_id, exc
+
+        tasks = [asyncio.ensure_future(_fetch(set_id)) for set_id in set_ids]
+        error: Optional[Exception] = None
+        fetched = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                set_id, res = await next_done
+                if isinstance(res, Exception):
+                    self.logger.warning("Fetching the pricing of set '%s' failed: %s", set_id, str(res))
+                    error = error or res
+                    continue
+                fetched += 1
+                yield res
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.history is not None:
+                self.history.flush()
+        if not fetched and error is not None:
+            raise error
+
+    async def __call__(
+            self, ctx: Context, payload: MessageIncoming
+    ) -> Union[LegoPricing, AsyncIterator[LegoPricing]]:
+        args = await super().__call__(ctx, payload)
+        set_ids = list(dict.fromkeys(args['set_ids']))
+        if len(set_ids) > self.max_sets:
+            raise RuntimeError(f"At most {self.max_sets} set ids per message, but got {len(set_ids)}")
+
+        if len(set_ids) > 1:
+            return self._fetch_all(set_ids)
+
+        try:
+            return await self.fetch(set_ids[0])
+        finally:
+            if self.history is not None:
+                self.history.flush()
@@ -1,35 +1,144 @@
 """Contains processors for retrieving traffic information."""
-from typing import Any, Optional
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+import attr
+import numpy as np  # type: ignore
 
 from homebot.models import HelpEntry, MessageIncoming, Context
 from homebot.processors.base import RegexProcessor
-from homebot.services.traffic import TrafficService, TrafficInfo
+from homebot.processors.grammar import Arg, CLOCK, OFFSET, Opt, PHRASE, Unless, Word
+from homebot.services.traffic import TrafficService, TrafficInfo, TrafficHistory
+from homebot.validator import attrs_assert_type
 
 
 class Traffic(RegexProcessor):
-    """Processes a !traffic command and delegates the work to a traffic service."""
+    """Processes a !traffic command and delegates the work to a traffic service. Multiple
+    comma separated destinations are pulled concurrently (at most `max_concurrency` at a
+    time) and merged into one traffic info."""
     DEFAULT_COMMAND = 'traffic'
-    MESSAGE_REGEX = r'^\s*{command}\s+(?P<source>[\w\d ]+)\s+to\s+' \
-                    r'(?P<target>[\w\d ]+)\s*(\+(?P<offset>\d+))?\w*$'
+    GRAMMAR = (
+        Unless('stats'),  # `traffic stats ...` is handled by `TrafficStats`
+        Arg('source', PHRASE, label='origin'), Word('to'),
+        Arg('targets', PHRASE, many=True, label='destination'), Opt(Arg('offset', OFFSET))
+    )
+    DEFAULT_MAX_CONCURRENCY = 3
 
-    def __init__(self, service: TrafficService, **kwargs: Any):
+    def __init__(
+            self, service: TrafficService, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+            **kwargs: Any
+    ):
         super().__init__(**kwargs)
         self._service = service
+        self.max_concurrency = int(max_concurrency)
 
     async def help(self) -> Optional[HelpEntry]:
         return HelpEntry(
             command=str(self.command),
-            usage="{} <origin> to <destination> [+offset]".format(self.command),
+            usage=self.usage,
             description="Queries the passed traffic service for connections between "
-                        "the origin and the destination. Optionally you can pass a "
+                        "the origin and the destination(s). Optionally you can pass a "
                         "offset for the time in minutes. If no offset is passed "
                         "it will be set to 0 minutes (which means now)."
         )
 
+    async def _pull_all(self, source: str, targets: List[str], offset: int) -> TrafficInfo:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _pull(target: str) -> TrafficInfo:
+            async with semaphore:
+                return await self._service.pull(source, target, offset=offset)
+
+        results = await asyncio.gather(*[_pull(target) for target in targets], return_exceptions=True)
+        infos = [res for res in results if isinstance(res, TrafficInfo)]
+        for target, res in zip(targets, results):
+            if isinstance(res, BaseException):
+                if not infos:
+                    raise res
+                self.logger.warning("Pulling the traffic to '%s' failed: %s", target, str(res))
+        return TrafficInfo.merge(infos)
+
     async def __call__(self, ctx: Context, payload: MessageIncoming) -> TrafficInfo:
-        match = await super().__call__(ctx, payload)
-        source = match.group('source').strip()
-        target = match.group('target').strip()
-        offset = int(match.group('offset') or 0)
+        args = await super().__call__(ctx, payload)
+        source, targets, offset = args['source'], args['targets'], args['offset'] or 0
+
+        if len(targets) == 1:
+            return await self._service.pull(source, targets[0], offset=offset)
+        return await self._pull_all(source, targets, offset)
+
+
+@attr.s
+class TrafficDelayStats:
+    """Delay statistics of the connections of a route."""
+    origin: str = attr.ib(validator=attrs_assert_type(str))
+    destination: str = attr.ib(validator=attrs_assert_type(str))
+    departure: Optional[str] = attr.ib(validator=attrs_assert_type(Optional[str]))
+    count: int = attr.ib(validator=attrs_assert_type(int))
+    canceled_rate: float = attr.ib(validator=attrs_assert_type(float))
+    delayed_rate: float = attr.ib(validator=attrs_assert_type(float))
+    departure_delay: Dict[int, float] = attr.ib(validator=attrs_assert_type(Dict[int, float]))
+    arrival_delay: Dict[int, float] = attr.ib(validator=attrs_assert_type(Dict[int, float]))
+
+    @classmethod
+    def from_columns(
+            cls, origin: str, destination: str, departure: Optional[str],
+            columns: Dict[str, np.ndarray], percentiles: Iterable[int]
+    ) -> 'TrafficDelayStats':
+        """Computes the statistics of the columns selected from the traffic history.
+        Delays of canceled connections are ignored."""
+        canceled = columns['canceled'].astype(bool)
+        if not len(canceled):  # pylint: disable=len-as-condition
+            raise RuntimeError(f"There is no recorded traffic from {origin} to {destination}")
+        percentiles = list(percentiles)
+        running = ~canceled
+
+        def _percentiles(delays: np.ndarray) -> Dict[int, float]:
+            if not len(delays):  # pylint: disable=len-as-condition
+                return {}
+            return dict(zip(percentiles, (float(v) for v in np.percentile(delays, percentiles))))
+
+        return cls(
+            origin=origin,
+            destination=destination,
+            departure=departure,
+            count=int(len(canceled)),
+            canceled_rate=float(np.mean(canceled)),
+            delayed_rate=float(np.mean((columns['delay_departure'] > 0) & running)),
+            departure_delay=_percentiles(columns['delay_departure'][running]),
+            arrival_delay=_percentiles(columns['delay_arrival'][running])
+        )
+
+
+class TrafficStats(RegexProcessor):
+    """Computes delay percentiles and cancellation rates of a route from the recorded
+    traffic history. Optionally only for a single planned departure."""
+    DEFAULT_COMMAND = 'traffic stats'
+    GRAMMAR = (
+        Arg('source', PHRASE, label='origin'), Word('to'), Arg('target', PHRASE, label='destination'),
+        Opt(Word('at'), Arg('departure', CLOCK))
+    )
+    DEFAULT_PERCENTILES = (50, 90, 95)
+
+    def __init__(
+            self, history: TrafficHistory, percentiles: Iterable[int] = DEFAULT_PERCENTILES,
+            **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        self.history = history
+        self.percentiles = [int(p) for p in percentiles]
+
+    async def help(self) -> Optional[HelpEntry]:
+        return HelpEntry(
+            command=str(self.command),
+            usage=self.usage,
+            description="Shows how late the connections between the origin and the "
+                        "destination usually are. Optionally only for the connection "
+                        "departing at the given time."
+        )
+
+    async def __call__(self, ctx: Context, payload: MessageIncoming) -> TrafficDelayStats:
+        args = await super().__call__(ctx, payload)
+        source, target, departure = args['source'], args['target'], args['departure']
 
-        return await self._service.pull(source, target, offset=offset)
+        columns = self.history.select(source, target, departure)
+        return TrafficDelayStats.from_columns(source, target, departure, columns, self.percentiles)
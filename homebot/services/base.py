@@ -1 +1,495 @@
 """Contains base services."""
+import asyncio
+import functools
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar, cast
+
+import attr
+
+from homebot.utils import AutoStrMixin, LogMixin
+from homebot.validator import attrs_assert_type
+
+T = TypeVar('T')
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream service that is known to be down."""
+
+
+@attr.s
+class CircuitInfo:
+    """Circuit breaker state data container."""
+    name: str = attr.ib(validator=attrs_assert_type(str))
+    state: str = attr.ib(validator=attrs_assert_type(str))
+    failure_rate: float = attr.ib(validator=attrs_assert_type(float))
+    calls: int = attr.ib(validator=attrs_assert_type(int))
+    retry_in: float = attr.ib(validator=attrs_assert_type(float))
+
+
+class CircuitBreaker(AutoStrMixin, LogMixin):
+    """Stops calling an upstream service that keeps failing.
+
+    The breaker is `closed` as long as less than `failure_threshold` of the last `window`
+    calls failed (but at least `min_calls` calls were made). Otherwise it opens and every
+    call fails fast with a `CircuitOpenError`. After `cooldown` seconds it is `half_open`
+    and lets a single trial call pass: A success closes the breaker again, a failure
+    re-opens it.
+
+    Breakers are shared per upstream service by using `CircuitBreaker.get(name)`.
+
+    Example:
+
+        >>> dut = CircuitBreaker('upstream', min_calls=2, cooldown=60)
+        >>> for _ in range(2):
+        ...     dut.record(success=False)
+        >>> dut.state
+        'open'
+        >>> dut.check()
+        Traceback (most recent call last):
+        ...
+        homebot.services.base.CircuitOpenError: upstream is unavailable. Retrying in 60 seconds.
+    """
+
+    __ignore_fields__ = ['_outcomes']
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    DEFAULT_FAILURE_THRESHOLD = 0.5
+    DEFAULT_WINDOW = 20
+    DEFAULT_MIN_CALLS = 5
+    DEFAULT_COOLDOWN = 30.0
+
+    _registry: Dict[str, 'CircuitBreaker'] = {}
+
+    def __init__(
+            self, name: str, failure_threshold: float = DEFAULT_FAILURE_THRESHOLD,
+            window: int = DEFAULT_WINDOW, min_calls: int = DEFAULT_MIN_CALLS,
+            cooldown: float = DEFAULT_COOLDOWN
+    ):
+        self.name = str(name)
+        self.failure_threshold = float(failure_threshold)
+        self.min_calls = int(min_calls)
+        self.cooldown = float(cooldown)
+        self._outcomes: Deque[bool] = deque(maxlen=int(window))
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @classmethod
+    def get(cls, name: str, **kwargs: Any) -> 'CircuitBreaker':
+        """Returns the breaker registered under the name. Creates it on first use."""
+        breaker = cls._registry.get(name)
+        if breaker is None:
+            breaker = cls._registry[name] = cls(name, **kwargs)
+        return breaker
+
+    @classmethod
+    def all(cls) -> List['CircuitBreaker']:
+        """Returns all registered breakers sorted by name."""
+        return [cls._registry[name] for name in sorted(cls._registry)]
+
+    @property
+    def state(self) -> str:
+        """Return the current state of the breaker."""
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    @property
+    def failure_rate(self) -> float:
+        """Return the failure rate of the recorded calls."""
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def info(self) -> CircuitInfo:
+        """Return the current state of the breaker for monitoring purposes."""
+        retry_in = 0.0
+        if self.state == self.OPEN and self._opened_at is not None:
+            retry_in = self.cooldown - (time.monotonic() - self._opened_at)
+        return CircuitInfo(
+            name=self.name,
+            state=self.state,
+            failure_rate=self.failure_rate,
+            calls=len(self._outcomes),
+            retry_in=retry_in
+        )
+
+    def check(self) -> None:
+        """Raises a `CircuitOpenError` if the call is not permitted."""
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return
+        raise CircuitOpenError(
+            f"{self.name} is unavailable. Retrying in {max(self.info().retry_in, 1):.0f} seconds."
+        )
+
+    def record(self, success: bool) -> None:
+        """Records the outcome of a call."""
+        if self._opened_at is not None:
+            if not self._trial_running:
+                return  # Call was started before the breaker opened
+            self._trial_running = False
+            if success:
+                self.logger.info("Circuit '%s' is closed again", self.name)
+                self._opened_at = None
+                self._outcomes.clear()
+            else:
+                self._opened_at = time.monotonic()
+            return
+
+        self._outcomes.append(bool(success))
+        if len(self._outcomes) >= self.min_calls and self.failure_rate >= self.failure_threshold:
+            self.logger.warning(
+                "Circuit '%s' is open: %.0f%% of the last %s calls failed",
+                self.name, self.failure_rate * 100, len(self._outcomes)
+            )
+            self._opened_at = time.monotonic()
+
+    async def __aenter__(self) -> 'CircuitBreaker':
+        self.check()
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        # Cancelled (before python 3.8 `CancelledError` is an `Exception`): No verdict
+        if exc_type is not None and (
+                issubclass(exc_type, asyncio.CancelledError) or not issubclass(exc_type, Exception)
+        ):
+            self._trial_running = False
+            return
+        self.record(success=exc_type is None)
+
+
+@attr.s
+class LimiterInfo:
+    """Concurrency limiter state data container."""
+    name: str = attr.ib(validator=attrs_assert_type(str))
+    limit: int = attr.ib(validator=attrs_assert_type(int))
+    in_flight: int = attr.ib(validator=attrs_assert_type(int))
+    queued: int = attr.ib(validator=attrs_assert_type(int))
+
+
+class AdaptiveLimiter(AutoStrMixin, LogMixin):
+    """Limits the number of concurrent calls to an upstream service. Calls over the limit
+    are queued.
+
+    The limit adapts itself (additive increase, multiplicative decrease): Every fast and
+    successful call raises the limit by `1 / limit`, so it grows by one per round trip.
+    A failed call or a call slower than `tolerance` times the minimum latency of the last
+    `window` calls reduces the limit by the factor `backoff` - at most once per round trip.
+
+    Limiters are shared per upstream service by using `AdaptiveLimiter.get(name)`. Guard
+    a call by `async with limiter.permit(): ...`.
+
+    Example:
+
+        >>> dut = AdaptiveLimiter('upstream', initial_limit=4)
+        >>> dut.record(latency=0.1, success=True)
+        >>> dut.info().limit
+        4
+        >>> dut.record(latency=0.1, success=False)
+        >>> dut.info().limit
+        2
+    """
+
+    __ignore_fields__ = ['_latencies', '_waiters']
+
+    DEFAULT_INITIAL_LIMIT = 4
+    DEFAULT_MIN_LIMIT = 1
+    DEFAULT_MAX_LIMIT = 64
+    DEFAULT_BACKOFF = 0.5
+    DEFAULT_TOLERANCE = 2.0
+    DEFAULT_WINDOW = 100
+
+    _registry: Dict[str, 'AdaptiveLimiter'] = {}
+
+    def __init__(
+            self, name: str, initial_limit: int = DEFAULT_INITIAL_LIMIT,
+            min_limit: int = DEFAULT_MIN_LIMIT, max_limit: int = DEFAULT_MAX_LIMIT,
+            backoff: float = DEFAULT_BACKOFF, tolerance: float = DEFAULT_TOLERANCE,
+            window: int = DEFAULT_WINDOW
+    ):
+        self.name = str(name)
+        self.min_limit = int(min_limit)
+        self.max_limit = int(max_limit)
+        self.backoff = float(backoff)
+        self.tolerance = float(tolerance)
+        self._limit = float(min(max(int(initial_limit), self.min_limit), self.max_limit))
+        self._latencies: Deque[float] = deque(maxlen=int(window))
+        self._in_flight = 0
+        self._waiters: Deque['asyncio.Future[None]'] = deque()
+        self._last_decrease = 0.0
+
+    @classmethod
+    def get(cls, name: str, **kwargs: Any) -> 'AdaptiveLimiter':
+        """Returns the limiter registered under the name. Creates it on first use."""
+        limiter = cls._registry.get(name)
+        if limiter is None:
+            limiter = cls._registry[name] = cls(name, **kwargs)
+        return limiter
+
+    @classmethod
+    def all(cls) -> List['AdaptiveLimiter']:
+        """Returns all registered limiters sorted by name."""
+        return [cls._registry[name] for name in sorted(cls._registry)]
+
+    @property
+    def limit(self) -> int:
+        """Return the current number of permitted concurrent calls."""
+        return int(self._limit)
+
+    def info(self) -> LimiterInfo:
+        """Return the current state of the limiter for monitoring purposes."""
+        return LimiterInfo(
+            name=self.name,
+            limit=self.limit,
+            in_flight=self._in_flight,
+            queued=sum(1 for waiter in self._waiters if not waiter.done())
+        )
+
+    def record(self, latency: float, success: bool, started: Optional[float] = None) -> None:
+        """Adapts the limit to the outcome of a call."""
+        self._latencies.append(float(latency))
+        congested = not success or latency > self.tolerance * min(self._latencies)
+        if not congested:
+            self._limit = min(self._limit + 1 / self._limit, float(self.max_limit))
+            return
+        if started is not None and started < self._last_decrease:
+            return  # Already reacted to the congestion this call was part of
+        self._limit = max(self._limit * self.backoff, float(self.min_limit))
+        self._last_decrease = time.monotonic()
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self) -> None:
+        """Waits until a call is permitted."""
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # Permitted, but nobody is going to use it
+            raise
+
+    def release(self) -> None:
+        """Hands the permit over to the next queued call."""
+        self._in_flight -= 1
+        self._wake()
+
+    def permit(self) -> '_Permit':
+        """Returns a context manager that waits for a permit and adapts the limit to the
+        outcome of the call."""
+        return _Permit(self)
+
+
+class _Permit:
+    """Single call guarded by an `AdaptiveLimiter`."""
+
+    def __init__(self, limiter: AdaptiveLimiter):
+        self._limiter = limiter
+        self._started = 0.0
+
+    async def __aenter__(self) -> '_Permit':
+        await self._limiter.acquire()
+        self._started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        # Cancelled (before python 3.8 `CancelledError` is an `Exception`): Nothing to learn
+        cancelled = exc_type is not None and (
+            issubclass(exc_type, asyncio.CancelledError) or not issubclass(exc_type, Exception)
+        )
+        if not cancelled:
+            self._limiter.record(
+                latency=time.monotonic() - self._started,
+                success=exc_type is None,
+                started=self._started
+            )
+        self._limiter.release()
+
+
+class Hedger(AutoStrMixin, LogMixin):
+    """Hedges idempotent reads: If the call did not answer after the observed `percentile`
+    latency of the last `window` calls, an identical second call is started. The first
+    successful response wins, the other call is cancelled.
+
+    The `budget` caps the extra load: Every call earns `budget` tokens (up to `burst`), a
+    hedged call costs one. Nothing is hedged until `min_samples` latencies were observed.
+
+    Example:
+
+        >>> dut = Hedger(min_samples=3)
+        >>> print(dut.delay)
+        None
+        >>> for latency in [0.1, 0.2, 0.3]:
+        ...     dut.record(latency)
+        >>> dut.delay
+        0.3
+    """
+
+    __ignore_fields__ = ['_latencies']
+
+    DEFAULT_PERCENTILE = 95.0
+    DEFAULT_BUDGET = 0.1
+    DEFAULT_BURST = 5.0
+    DEFAULT_MIN_SAMPLES = 20
+    DEFAULT_WINDOW = 200
+
+    def __init__(
+            self, percentile: float = DEFAULT_PERCENTILE, budget: float = DEFAULT_BUDGET,
+            burst: float = DEFAULT_BURST, min_samples: int = DEFAULT_MIN_SAMPLES,
+            window: int = DEFAULT_WINDOW
+    ):
+        self.percentile = float(percentile)
+        self.budget = float(budget)
+        self.burst = float(burst)
+        self.min_samples = int(min_samples)
+        self._latencies: Deque[float] = deque(maxlen=int(window))
+        self._tokens = 0.0
+        self.hedged = 0
+
+    @property
+    def delay(self) -> Optional[float]:
+        """Return the time to wait before hedging or None if not enough calls were observed
+        yet."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)]
+
+    def record(self, latency: float) -> None:
+        """Records the latency of a successful call."""
+        self._latencies.append(float(latency))
+
+    def _take_token(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self.hedged += 1
+        return True
+
+    async def __call__(self, call: Callable[[], Awaitable[T]]) -> T:
+        """Calls `call` and a hedged second time if the first call is slow."""
+        self._tokens = min(self._tokens + self.budget, self.burst)
+        started = time.monotonic()
+        delay = self.delay
+        pending = {asyncio.ensure_future(call())}
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and self._take_token():
+                self.logger.debug("No response after %.3f seconds. Hedging...", delay)
+                pending.add(asyncio.ensure_future(call()))
+
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.record(time.monotonic() - started)
+                        return cast(T, task.result())
+                    error = error or task.exception()
+            raise cast(BaseException, error)
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def _run_in_process(func: Callable[..., T], args: Tuple[Any, ...]) -> Tuple[bool, Any]:
+    """Runs `func(*args)` in a worker process and returns whether it succeeded along with
+    its result or the exception it raised."""
+    try:
+        return True, func(*args)
+    except Exception as exc:  # pylint: disable=broad-except
+        return False, exc
+
+
+class Offloader(AutoStrMixin, LogMixin):
+    """Runs cpu-bound functions off the event loop - either in a pool of `max_workers`
+    threads or processes (`mode`). The pool is created on first use.
+
+    A process pool needs the function, its arguments and its result to be picklable. The
+    pool serializes them in its own threads; if that fails the call is run in a thread
+    instead.
+
+    Example:
+
+        >>> dut = Offloader('process', max_workers=2)
+        >>> asyncio.run(dut.run(sum, [1, 2, 3]))
+        6
+        >>> asyncio.run(dut.run(lambda: 42))  # Lambdas are not picklable -> threaded
+        42
+        >>> dut.shutdown()
+    """
+
+    __ignore_fields__ = ['_executor', '_fallback']
+
+    MODES = ('thread', 'process')
+
+    def __init__(self, mode: str = 'thread', max_workers: Optional[int] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Argument 'mode' must be one of {self.MODES}, but is '{mode}'.")
+        self.mode = mode
+        self.max_workers = max_workers
+        self._executor: Optional[Executor] = None
+        self._fallback: Optional[Executor] = None
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            if self.mode == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='offload')
+        return self._executor
+
+    def _thread_pool(self) -> Executor:
+        if self.mode == 'thread':
+            return self._pool()
+        if self._fallback is None:
+            self._fallback = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='offload')
+        return self._fallback
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Runs `func(*args)` in the pool and returns its result."""
+        loop = asyncio.get_event_loop()
+        if self.mode == 'thread':
+            return await loop.run_in_executor(self._pool(), functools.partial(func, *args))
+
+        # Errors of `func` are returned, so everything raised here is a pool failure
+        try:
+            succeeded, result = await loop.run_in_executor(self._pool(), _run_in_process, func, args)
+        except (asyncio.CancelledError, BrokenProcessPool):  # pylint: disable=try-except-raise
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.debug("Cannot pickle the call to %s (%s). Running it in a thread...", func, exc)
+            return await loop.run_in_executor(self._thread_pool(), functools.partial(func, *args))
+        if not succeeded:
+            raise result
+        return cast(T, result)
+
+    def shutdown(self) -> None:
+        """Shuts the pools down. They are re-created on the next call."""
+        for pool in (self._executor, self._fallback):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        self._executor = self._fallback = None
@@ -1,15 +1,26 @@
 """Home assistant related services."""
 
+import asyncio
 import json
-from typing import Any
+import re
+import urllib.parse as urlparse
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Iterable, Set, Tuple
 
 import attr
+import numpy as np  # type: ignore
 from typeguard import typechecked
 
+from homebot.services.base import AdaptiveLimiter, CircuitBreaker
+from homebot.utils import AutoStrMixin, LogMixin
+
 
 @attr.s
 class HassApi:
-    """Utility class to communicate with home assistant via the rest-api."""
+    """Utility class to communicate with home assistant via the rest-api. All instances
+    talking to the same host share one circuit breaker and one adaptive concurrency limiter:
+    When home assistant is down calls fail fast instead of waiting for the timeout; when it
+    is slow calls are queued."""
 
     METHOD_GET = 'get'
     METHOD_POST = 'post'
@@ -20,6 +31,13 @@ class HassApi:
     base_url: str = attr.ib(converter=str)
     token: str = attr.ib(converter=str)
     timeout: float = attr.ib(converter=float, default=DEFAULT_TIMEOUT)
+    breaker: CircuitBreaker = attr.ib(init=False, repr=False)
+    limiter: AdaptiveLimiter = attr.ib(init=False, repr=False)
+
+    def __attrs_post_init__(self) -> None:
+        upstream = f"home assistant ({urlparse.urlparse(self.base_url).netloc})"
+        self.breaker = CircuitBreaker.get(upstream)
+        self.limiter = AdaptiveLimiter.get(upstream)
 
     @typechecked
     async def call(self, endpoint: str, method: str = METHOD_GET, data: Any = None) -> Any:
@@ -46,14 +64,377 @@ class HassApi:
         if data is not None:
             data = json.dumps(data)
 
-        if method == self.METHOD_GET:
-            response = await get(url, headers=headers, timeout=self.timeout)
-        else:
-            response = await post(url, headers=headers, timeout=self.timeout, data=data)
+        async with self.breaker, self.limiter.permit():
+            if method == self.METHOD_GET:
+                response = await get(url, headers=headers, timeout=self.timeout)
+            else:
+                response = await post(url, headers=headers, timeout=self.timeout, data=data)
+            error = None if response.status_code == 200 else RuntimeError(
+                "Failed to call endpoint {url}"
+                "\nHttp Code: {response.status_code}"
+                "\nMessage: {response.text}".format(**locals())
+            )
+            if error and response.status_code >= 500:
+                raise error  # Server errors count as failures for the breaker
 
-        if response.status_code != 200:
-            raise RuntimeError("Failed to call endpoint {url}"
-                               "\nHttp Code: {response.status_code}"
-                               "\nMessage: {response.text}".format(**locals()))
+        if error:
+            raise error
 
         return response.json()
+
+
+class HassStateMirror(AutoStrMixin, LogMixin):
+    """Mirrors the states of all home assistant entities in memory. All states are loaded
+    once via the websocket api and are kept current by subscribing to `state_changed`
+    events. Reconnects and resyncs on its own when the connection is lost."""
+
+    __ignore_fields__ = ['token', '_states', '_ready', '_task']
+
+    DEFAULT_RECONNECT_DELAY = 5.0
+    HEARTBEAT = 30.0
+
+    _ID_SUBSCRIBE = 1
+    _ID_GET_STATES = 2
+
+    def __init__(
+            self, base_url: str, token: str, reconnect_delay: float = DEFAULT_RECONNECT_DELAY
+    ):
+        self.base_url = str(base_url)
+        self.token = str(token)
+        self.reconnect_delay = float(reconnect_delay)
+        self.connected = False
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    @property
+    def websocket_url(self) -> str:
+        """Return the url of the websocket api derived from the base url."""
+        parsed = urlparse.urlparse(urlparse.urljoin(self.base_url, 'api/websocket'))
+        scheme = 'wss' if parsed.scheme in ('https', 'wss') else 'ws'
+        return urlparse.urlunparse(parsed._replace(scheme=scheme))
+
+    @property
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        """Return all mirrored states by entity id."""
+        return self._states
+
+    def state(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Return the mirrored state of the entity or None if the entity is unknown."""
+        return self._states.get(str(entity_id))
+
+    async def start(self) -> None:
+        """Starts mirroring in the background. Calling it multiple times is safe."""
+        if self._task is not None:
+            return
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Stops mirroring."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> None:
+        """Waits until the states are synced for the first time."""
+        if self._ready is None:
+            raise RuntimeError("The mirror is not started. Call `start()` first.")
+        await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+
+    def _sync(self, states: List[Dict[str, Any]]) -> None:
+        # State changes received while the full state was loaded might be more recent
+        synced = {str(item.get('entity_id')): item for item in states}
+        for entity_id, current in self._states.items():
+            fresh = synced.get(entity_id)
+            if fresh and str(current.get('last_updated', '')) > str(fresh.get('last_updated', '')):
+                synced[entity_id] = current
+        self._states = synced
+        self.logger.debug("Synced %s entity states", len(synced))
+        if self._ready:
+            self._ready.set()
+
+    def _on_state_changed(self, data: Dict[str, Any]) -> None:
+        entity_id = str(data.get('entity_id'))
+        new_state = data.get('new_state')
+        if new_state is None:
+            self._states.pop(entity_id, None)  # Entity was removed
+        else:
+            self._states[entity_id] = new_state
+
+    def _handle(self, message: Dict[str, Any]) -> None:
+        msg_type = message.get('type')
+        if msg_type == 'event':
+            event = message.get('event', {})
+            if event.get('event_type') == 'state_changed':
+                self._on_state_changed(event.get('data', {}))
+        elif msg_type == 'result':
+            if not message.get('success'):
+                raise RuntimeError(f"Home assistant request failed: {message.get('error')}")
+            if message.get('id') == self._ID_GET_STATES:
+                self._sync(message.get('result') or [])
+
+    async def _authenticate(self, websocket: Any) -> None:
+        message = await websocket.receive_json()
+        if message.get('type') != 'auth_required':
+            raise RuntimeError(f"Unexpected message from home assistant: {message}")
+        await websocket.send_json({'type': 'auth', 'access_token': self.token})
+        message = await websocket.receive_json()
+        if message.get('type') != 'auth_ok':
+            raise RuntimeError(f"Authentication failed: {message.get('message')}")
+
+    async def _connect_and_read(self) -> None:
+        import aiohttp
+
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self.websocket_url, heartbeat=self.HEARTBEAT) as websocket:
+                await self._authenticate(websocket)
+                # Subscribe first, so no change gets lost while loading the states
+                await websocket.send_json({
+                    'id': self._ID_SUBSCRIBE, 'type': 'subscribe_events',
+                    'event_type': 'state_changed'
+                })
+                await websocket.send_json({'id': self._ID_GET_STATES, 'type': 'get_states'})
+                self.connected = True
+                async for message in websocket:
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    self._handle(message.json())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._connect_and_read()
+                self.logger.warning("Connection to home assistant was closed")
+            except asyncio.CancelledError:  # pylint: disable=try-except-raise
+                raise
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Connection to home assistant failed")
+            finally:
+                self.connected = False
+            await asyncio.sleep(self.reconnect_delay)
+
+
+class AmbiguousEntityError(RuntimeError):
+    """Raised when a name matches multiple entities equally well."""
+
+    def __init__(self, query: str, candidates: List[str]):
+        super().__init__(f"'{query}' is ambiguous: {', '.join(candidates)}")
+        self.query = query
+        self.candidates = candidates
+
+
+class HassEntityIndex(AutoStrMixin):
+    """Trigram index over the entity ids, friendly names and areas of home assistant
+    entities to resolve names like 'kitchen light' to an entity id. Every word of the query
+    has to be found (allowing for typos) in an entity to match it at all. If the best
+    matches score about the same, the name is ambiguous and nothing is guessed.
+
+    Example:
+
+        >>> dut = HassEntityIndex()
+        >>> dut.sync([
+        ...     {'entity_id': 'light.kitchen_ceiling_2', 'attributes': {'friendly_name': 'Kitchen Light'}},
+        ...     {'entity_id': 'light.bath', 'attributes': {'friendly_name': 'Bathroom Light'}},
+        ...     {'entity_id': 'switch.kitchen_fan', 'attributes': {'friendly_name': 'Fan'}}
+        ... ])
+        >>> dut.best('kitchen light')
+        'light.kitchen_ceiling_2'
+        >>> dut.best('bathroom')
+        'light.bath'
+        >>> print(dut.best('garage door'))
+        None
+        >>> dut.best('kitchen')
+        Traceback (most recent call last):
+        ...
+        homebot.services.hass.AmbiguousEntityError: 'kitchen' is ambiguous: light.kitchen_ceiling_2, switch.kitchen_fan
+    """
+
+    __ignore_fields__ = ['_texts', '_grams', '_postings']
+
+    DEFAULT_MIN_SCORE = 0.5
+    # Share of the trigrams of a query word that an entity has to contain
+    WORD_MIN_SCORE = 0.5
+    # Matches scoring less than this below the best one are ambiguous
+    AMBIGUITY_MARGIN = 0.15
+
+    def __init__(self) -> None:
+        self._texts: Dict[str, str] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return ' '.join(re.sub(r'[\W_]+', ' ', str(text).lower()).split())
+
+    @classmethod
+    def _trigrams(cls, text: str) -> Set[str]:
+        grams: Set[str] = set()
+        for token in cls._normalize(text).split():
+            padded = f'  {token} '
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+        return grams
+
+    @classmethod
+    def _text(cls, state: Dict[str, Any]) -> str:
+        attributes = state.get('attributes') or {}
+        return cls._normalize(' '.join([
+            str(state.get('entity_id', '')).partition('.')[2],
+            str(attributes.get('friendly_name', '')),
+            str(attributes.get('area', '') or attributes.get('area_id', '') or '')
+        ]))
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def remove(self, entity_id: str) -> None:
+        """Removes the entity from the index."""
+        self._texts.pop(entity_id, None)
+        for gram in self._grams.pop(entity_id, set()):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(entity_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def update(self, states: Iterable[Dict[str, Any]]) -> None:
+        """Adds or updates the entities. Only entities whose names changed are re-indexed."""
+        for state in states:
+            entity_id = str(state.get('entity_id'))
+            text = self._text(state)
+            if self._texts.get(entity_id) == text:
+                continue
+            self.remove(entity_id)
+            grams = self._trigrams(text)
+            self._texts[entity_id] = text
+            self._grams[entity_id] = grams
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(entity_id)
+
+    def sync(self, states: Iterable[Dict[str, Any]]) -> None:
+        """Updates the index to contain exactly the passed entities."""
+        states = list(states)
+        current = {str(state.get('entity_id')) for state in states}
+        for entity_id in [eid for eid in self._texts if eid not in current]:
+            self.remove(entity_id)
+        self.update(states)
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """Returns the best matching entity ids along with their similarity score
+        (0 to 1), best first. Entities missing any word of the query are left out."""
+        query_grams = self._trigrams(query)
+        if not query_grams:
+            return []
+        hits: Dict[str, int] = {}
+        for gram in query_grams:
+            for entity_id in self._postings.get(gram, ()):
+                hits[entity_id] = hits.get(entity_id, 0) + 1
+
+        word_grams = [self._trigrams(word) for word in self._normalize(query).split()]
+
+        def _has_all_words(entity_id: str) -> bool:
+            grams = self._grams[entity_id]
+            return all(len(word & grams) >= self.WORD_MIN_SCORE * len(word) for word in word_grams)
+
+        # Matching query grams relative to the query with a small penalty for extra text
+        scored = [
+            (entity_id, common / (len(query_grams) + 0.1 * (len(self._grams[entity_id]) - common)))
+            for entity_id, common in hits.items() if _has_all_words(entity_id)
+        ]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    def best(self, query: str, min_score: float = DEFAULT_MIN_SCORE) -> Optional[str]:
+        """Returns the best matching entity id or None if nothing is similar enough.
+        Raises an `AmbiguousEntityError` if other entities match about as well."""
+        results = [(entity_id, score) for entity_id, score in self.search(query) if score >= min_score]
+        if not results:
+            return None
+        candidates = [
+            entity_id for entity_id, score in results if score > results[0][1] - self.AMBIGUITY_MARGIN
+        ]
+        if len(candidates) > 1:
+            raise AmbiguousEntityError(query, sorted(candidates))
+        return results[0][0]
+
+
+class HassHistory(AutoStrMixin, LogMixin):
+    """Fetches numeric sensor samples from the home assistant history api. Fetched windows
+    are cached per entity, so overlapping queries only fetch the missing ranges."""
+
+    __ignore_fields__ = ['_cache']
+
+    DEFAULT_RETENTION = 8 * 24 * 3600.0
+
+    def __init__(self, api: HassApi, retention: float = DEFAULT_RETENTION):
+        self.api = api
+        self.retention = float(retention)
+        # entity id -> (covered start, covered end, timestamps, values)
+        self._cache: Dict[str, Tuple[float, float, np.ndarray, np.ndarray]] = {}
+
+    @staticmethod
+    def _parse(resp: Any) -> Tuple[np.ndarray, np.ndarray]:
+        items = resp[0] if resp else []
+        timestamps = np.empty(len(items), dtype=np.float64)
+        values = np.empty(len(items), dtype=np.float64)
+        for i, item in enumerate(items):
+            timestamps[i] = datetime.fromisoformat(str(item.get('last_changed'))).timestamp()
+            try:
+                values[i] = float(item.get('state'))
+            except (TypeError, ValueError):  # unavailable, unknown, ...
+                values[i] = np.nan
+        valid = ~np.isnan(values)
+        return timestamps[valid], values[valid]
+
+    async def _fetch(self, entity_id: str, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        def _iso(timestamp: float) -> str:
+            return urlparse.quote(datetime.fromtimestamp(timestamp, timezone.utc).isoformat())
+
+        endpoint = (
+            f"history/period/{_iso(start)}"
+            f"?filter_entity_id={urlparse.quote(entity_id)}&end_time={_iso(end)}"
+        )
+        self.logger.debug("Fetching history of '%s' from %s to %s", entity_id, start, end)
+        return self._parse(await self.api.call(endpoint))
+
+    async def samples(
+            self, entity_id: str, start: datetime, end: datetime
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the timestamps (seconds since epoch) and the numeric values of the
+        entity between start and end sorted by time."""
+        t_start, t_end = start.timestamp(), end.timestamp()
+        cached = self._cache.get(entity_id)
+        if cached is None:
+            covered_start, covered_end = t_start, t_end
+            timestamps, values = await self._fetch(entity_id, t_start, t_end)
+        else:
+            covered_start, covered_end, timestamps, values = cached
+            parts = [(timestamps, values)]
+            if t_start < covered_start:
+                parts.append(await self._fetch(entity_id, t_start, covered_start))
+                covered_start = t_start
+            if t_end > covered_end:
+                parts.append(await self._fetch(entity_id, covered_end, t_end))
+                covered_end = t_end
+            timestamps = np.concatenate([part[0] for part in parts])
+            values = np.concatenate([part[1] for part in parts])
+            # Sort by time and drop the samples fetched twice at the window borders
+            timestamps, unique = np.unique(timestamps, return_index=True)
+            values = values[unique]
+
+        # Select the result before trimming the cache, periods may exceed the retention
+        mask = (timestamps >= t_start) & (timestamps <= t_end)
+        result = timestamps[mask], values[mask]
+
+        if covered_end - covered_start > self.retention:
+            covered_start = covered_end - self.retention
+            keep = timestamps >= covered_start
+            timestamps, values = timestamps[keep], values[keep]
+
+        self._cache[entity_id] = (covered_start, covered_end, timestamps, values)
+        return result
@@ -0,0 +1,129 @@
+"""Lego related services."""
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import attr
+
+from homebot.utils import AutoStrMixin, LogMixin
+from homebot.validator import attrs_assert_type
+
+
+@attr.s
+class LegoPricing:
+    """Lego pricing data container."""
+    set_name: str = attr.ib(validator=attrs_assert_type(str))
+    set_id: int = attr.ib(validator=attrs_assert_type(int))
+    set_image_url: str = attr.ib(validator=attrs_assert_type(str))
+    current: float = attr.ib(validator=attrs_assert_type(float))
+    recommended: float = attr.ib(validator=attrs_assert_type(float))
+    highest: float = attr.ib(validator=attrs_assert_type(float))
+    lowest: float = attr.ib(validator=attrs_assert_type(float))
+    # Lowest price ever seen (by brickwatch or the price history); None if unknown
+    all_time_low: Optional[float] = attr.ib(default=None, validator=attrs_assert_type(Optional[float]))
+    near_low: Optional[bool] = attr.ib(default=None, validator=attrs_assert_type(Optional[bool]))
+
+
+@attr.s
+class LegoPriceAlert:
+    """The current price of a watched lego set dropped to or below the threshold."""
+    pricing: LegoPricing = attr.ib(validator=attrs_assert_type(LegoPricing))
+    threshold: float = attr.ib(validator=attrs_assert_type(float))
+
+
+class PriceHistory(AutoStrMixin, LogMixin):
+    """Stores every observed lego price in a SQLite database. Observations are buffered
+    and written in one transaction once `batch_size` of them are pending or `flush` is
+    called. The lowest price of a set is looked up via an index on (set id, price).
+
+    Example:
+
+        >>> import tempfile
+        >>> dut = PriceHistory(os.path.join(tempfile.mkdtemp(), 'prices.db'), batch_size=2)
+        >>> pricing = LegoPricing('Corvette', 42093, '', 36.99, 39.99, 53.95, 23.99)
+        >>> dut.record(pricing, recorded=0)
+        >>> dut.pending
+        1
+        >>> dut.lows([42093])
+        {42093: 36.99}
+        >>> dut.record(attr.evolve(pricing, current=21.99), recorded=1)
+        >>> dut.pending
+        0
+        >>> dut.lows([42093, 1234])
+        {42093: 21.99}
+        >>> dut.all_time_low(attr.evolve(pricing, current=22.5))
+        21.99
+    """
+
+    __ignore_fields__ = ['_conn', '_pending']
+
+    DEFAULT_BATCH_SIZE = 50
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS prices ("
+        "set_id INTEGER NOT NULL, recorded REAL NOT NULL, current REAL NOT NULL, "
+        "recommended REAL NOT NULL, highest REAL NOT NULL, lowest REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS prices_set_id_current ON prices (set_id, current)",
+        "CREATE INDEX IF NOT EXISTS prices_set_id_recorded ON prices (set_id, recorded)"
+    ]
+
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.path = str(path)
+        self.batch_size = int(batch_size)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+        self._pending: List[Tuple[int, float, float, float, float, float]] = []
+
+    @property
+    def pending(self) -> int:
+        """Return the number of observations that are not written yet."""
+        return len(self._pending)
+
+    def record(self, pricing: LegoPricing, recorded: Optional[float] = None) -> None:
+        """Records the observed pricing. Written once the batch is full."""
+        self._pending.append((
+            pricing.set_id, time.time() if recorded is None else float(recorded), pricing.current,
+            pricing.recommended, pricing.highest, pricing.lowest
+        ))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes all pending observations in one transaction."""
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany("INSERT INTO prices VALUES (?, ?, ?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    def lows(self, set_ids: Iterable[int]) -> Dict[int, float]:
+        """Return the lowest recorded price of the given sets (including pending
+        observations). Sets without any observation are left out."""
+        set_ids = sorted({int(set_id) for set_id in set_ids})
+        if not set_ids:
+            return {}
+        cursor = self._conn.execute(
+            "SELECT set_id, MIN(current) FROM prices WHERE set_id IN ({}) GROUP BY set_id".format(
+                ", ".join("?" * len(set_ids))),
+            set_ids
+        )
+        lows = {int(set_id): float(low) for set_id, low in cursor}
+        for set_id, _, current, *_ in self._pending:
+            if set_id in set_ids:
+                lows[set_id] = min(lows.get(set_id, current), current)
+        return lows
+
+    def all_time_low(self, pricing: LegoPricing) -> float:
+        """Return the lowest price of the set ever seen: Either by brickwatch, the price
+        history or the pricing itself."""
+        return min([pricing.current, pricing.lowest, *self.lows([pricing.set_id]).values()])
+
+    def close(self) -> None:
+        """Writes pending observations and closes the database."""
+        self.flush()
+        self._conn.close()
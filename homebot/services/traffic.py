@@ -1,15 +1,27 @@
 """Traffic related services."""
 import asyncio
+import json
+import os
+import time
+import urllib.parse as urlparse
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Iterable, Any, Dict, cast, List
+from typing import (
+    Iterable, Any, Awaitable, Callable, Dict, cast, List, Optional, TypeVar, Tuple
+)
 
 import attr
+import numpy as np  # type: ignore
 from schiene import Schiene  # type: ignore
 from typeguard import typechecked
 
-from homebot.utils import AutoStrMixin
+from homebot.services.base import AdaptiveLimiter, CircuitBreaker, Hedger
+from homebot.utils import AutoStrMixin, LogMixin
 from homebot.validator import attrs_assert_type
 
+T = TypeVar('T')
+
 
 @attr.s
 class TrafficConnection:
@@ -26,6 +38,8 @@ class TrafficConnection:
     delayed: bool = attr.ib()
     delay_departure: int = attr.ib()
     delay_arrival: int = attr.ib()
+    # Only set when the connections of multiple destinations are merged
+    destination: Optional[str] = attr.ib(default=None)
 
 
 @attr.s
@@ -38,13 +52,81 @@ class TrafficInfo:
         validator=attrs_assert_type(Iterable[TrafficConnection])
     )
 
+    @classmethod
+    def merge(cls, infos: Iterable['TrafficInfo'], now: Optional[datetime] = None) -> 'TrafficInfo':
+        """Merges the infos of multiple destinations (of the same origin) into one info.
+        The connections are ordered by their departure (starting from now) and know their
+        destination.
+
+        Example:
+
+            >>> conn = lambda dep: TrafficConnection('', False, dep, [], 0, '', False, 0, 0)
+            >>> res = TrafficInfo.merge([
+            ...     TrafficInfo('Frankfurt', 'Mainz', [conn('23:55'), conn('00:10')]),
+            ...     TrafficInfo('Frankfurt', 'Darmstadt', [conn('23:58')])
+            ... ], now=datetime(2020, 1, 1, 23, 50))
+            >>> res.destination
+            'Mainz, Darmstadt'
+            >>> [(c.departure, c.destination) for c in res.connections]
+            [('23:55', 'Mainz'), ('23:58', 'Darmstadt'), ('00:10', 'Mainz')]
+        """
+        infos = list(infos)
+        now = now or datetime.now()
+        current = now.hour * 60 + now.minute
+
+        def _from_now(connection: TrafficConnection) -> int:
+            hours, _, minutes = str(connection.departure).partition(':')
+            try:
+                return (int(hours) * 60 + int(minutes) - current) % (24 * 60)
+            except ValueError:
+                return 24 * 60
+
+        connections = [
+            attr.evolve(connection, destination=info.destination)
+            for info in infos for connection in info.connections
+        ]
+        return cls(
+            origin=infos[0].origin if infos else '',
+            destination=', '.join(info.destination for info in infos),
+            connections=sorted(connections, key=_from_now)
+        )
+
 
 class TrafficService(AutoStrMixin):
-    """Base traffic service. Defines the interface to respect."""
+    """Base traffic service. Defines the interface to respect. Implementations pass their
+    upstream calls to `_call_upstream`: It guards them by the `breaker` and the `limiter`
+    (one per service class by default) and hedges them if a `hedger` is passed.
+
+    Services that only wrap another service (`UPSTREAM = False`) have neither."""
+
+    __ignore_fields__ = ['pull']  # The type checked bound method refers back to the instance
 
-    def __init__(self) -> None:
+    UPSTREAM = True  # Calls an upstream service itself
+
+    def __init__(
+            self, breaker: Optional[CircuitBreaker] = None,
+            limiter: Optional[AdaptiveLimiter] = None, hedger: Optional[Hedger] = None
+    ) -> None:
+        self.breaker: Optional[CircuitBreaker] = None
+        self.limiter: Optional[AdaptiveLimiter] = None
+        if self.UPSTREAM:
+            self.breaker = breaker or CircuitBreaker.get(type(self).__name__)
+            self.limiter = limiter or AdaptiveLimiter.get(type(self).__name__)
+        self.hedger = hedger
         self.pull = typechecked(always=True)(self.pull)  # type: ignore
 
+    async def _call_upstream(self, call: Callable[[], Awaitable[T]]) -> T:
+        if self.breaker is None or self.limiter is None:
+            raise RuntimeError(f"{type(self).__name__} does not call an upstream service")
+
+        async def _guarded() -> T:
+            async with self.breaker, self.limiter.permit():  # type: ignore
+                return await call()
+
+        if self.hedger is None:
+            return await _guarded()
+        return await self.hedger(_guarded)
+
     async def pull(  # pylint: disable=method-hidden
             self, origin: str, destination: str, only_direct: bool = False,
             offset: int = 0
@@ -55,7 +137,14 @@ class TrafficService(AutoStrMixin):
 
 class DeutscheBahn(TrafficService):
     """Pulls the next trains that start from the origin destined for the given
-    destination."""
+    destination. The blocking client runs in the default executor, so its calls are not
+    hedged: A losing call could not be cancelled and would load the upstream unnoticed by
+    the limiter. Use `DeutscheBahnAsync` to hedge."""
+
+    def __init__(self, **kwargs: Any) -> None:
+        if kwargs.get('hedger') is not None:
+            raise ValueError("Blocking calls cannot be hedged. Use 'DeutscheBahnAsync' instead.")
+        super().__init__(**kwargs)
 
     @classmethod
     async def _mk_conn(
@@ -94,10 +183,10 @@ class DeutscheBahn(TrafficService):
         only_direct = bool(only_direct)
 
         loop = asyncio.get_event_loop()
-        connections = await loop.run_in_executor(
+        connections = await self._call_upstream(lambda: loop.run_in_executor(
             None, self._connections,
             origin, destination, offset, only_direct
-        )
+        ))
         parsed_connections = [
             await self._mk_conn(conn)
             for conn in connections
@@ -107,3 +196,485 @@ class DeutscheBahn(TrafficService):
             destination=destination,
             connections=parsed_connections
         )
+
+
+def _delay_minutes(planned: str, actual: str) -> int:
+    """Returns the delay in minutes between two times formatted like 'HH:MM'.
+
+    Example:
+
+        >>> _delay_minutes('11:58', '12:03')
+        5
+        >>> _delay_minutes('23:58', '00:03')  # Next day
+        5
+    """
+    planned_time = datetime.strptime(planned.strip(), '%H:%M')
+    actual_time = datetime.strptime(actual.strip(), '%H:%M')
+    delay = (actual_time - planned_time).total_seconds() // 60
+    return int(delay if delay >= 0 else delay + 24 * 60)
+
+
+def _parse_overview(html: str) -> List[Dict[str, Any]]:
+    """Parses the connection overview page. Connections that are not on time carry the
+    path of their details page, which provides the actual times."""
+    from bs4 import BeautifulSoup  # type: ignore
+
+    soup = BeautifulSoup(html, 'html.parser')
+    connections = []
+    for row in soup.find_all('td', class_='overview timelink'):
+        columns = row.parent.find_all('td')
+        link = columns[0].a
+        connection: Dict[str, Any] = {
+            'departure': str(link.contents[0].string),
+            'arrival': str(link.contents[2].string),
+            'transfers': int(columns[2].contents[0]),
+            'time': str(columns[2].contents[2]),
+            'products': str(columns[3].contents[0]).split(', '),
+            'ontime': True,
+            'canceled': False
+        }
+        if (columns[1].find('img') or columns[1].find('span', class_='delay')
+                or columns[1].find('span', class_='delayOnTime')):
+            details = urlparse.urlsplit(
+                str(link.get('href')).replace('!details=opened!', '!details=opened!detailsVerbund=opened!')
+            )
+            connection['details'] = urlparse.urlunsplit(('', '', details.path, details.query, ''))
+        connections.append(connection)
+    return connections
+
+
+def _parse_details(html: str, departure: str, arrival: str) -> Dict[str, int]:
+    """Parses the delays from the details page of a connection."""
+    from bs4 import BeautifulSoup  # type: ignore
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    def _delay(css_class: Any, planned: str) -> int:
+        route = soup.find('div', class_=css_class)
+        actual = route.find('span', class_=['delay', 'delayOnTime']) if route else None
+        return _delay_minutes(planned, actual.text) if actual else 0
+
+    return {
+        'delay_departure': _delay('routeStart', departure),
+        'delay_arrival': _delay(['routeEnd', 'routeEndAdditional'], arrival)
+    }
+
+
+class DeutscheBahnAsync(TrafficService):
+    """Pulls the next trains from the same endpoints as `DeutscheBahn`, but without
+    blocking: Requests are sent by an async http client that keeps its connections alive
+    and the html is parsed by a small dedicated thread pool instead of the default
+    executor. The details pages of delayed connections are fetched concurrently."""
+
+    __ignore_fields__ = ['_client', '_parser']
+
+    BASE_URL = 'https://mobile.bahn.de'
+    QUERY_PATH = '/bin/mobil/query.exe/dox'
+    DEFAULT_TIMEOUT = 10.0
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_PARSER_THREADS = 2
+
+    def __init__(
+            self, base_url: str = BASE_URL, timeout: float = DEFAULT_TIMEOUT,
+            pool_size: int = DEFAULT_POOL_SIZE, parser_threads: int = DEFAULT_PARSER_THREADS,
+            **kwargs: Any
+    ) -> None:
+        super().__init__(**kwargs)
+        self.base_url = str(base_url)
+        self.timeout = float(timeout)
+        self.pool_size = int(pool_size)
+        self._client: Optional[Any] = None
+        self._parser = ThreadPoolExecutor(
+            max_workers=int(parser_threads), thread_name_prefix='deutsche-bahn-parser'
+        )
+
+    def _http(self) -> Any:
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.Client(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                pool_limits=httpx.PoolLimits(soft_limit=self.pool_size, hard_limit=self.pool_size)
+            )
+        return self._client
+
+    async def close(self) -> None:
+        """Closes the pooled connections."""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def _get(self, url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        async def _call() -> str:
+            response = await self._http().get(url, params=params)
+            if response.status_code != 200:
+                raise RuntimeError(f"Failed to query {url}\nHttp Code: {response.status_code}")
+            return cast(str, response.text)
+
+        return await self._call_upstream(_call)
+
+    async def _parse(self, parser: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_event_loop().run_in_executor(self._parser, parser, *args)
+
+    async def _with_delay(self, connection: Dict[str, Any]) -> Dict[str, Any]:
+        details = connection.pop('details', None)
+        if not details:
+            return connection
+        delay = await self._parse(
+            _parse_details, await self._get(details), connection['departure'], connection['arrival']
+        )
+        return {**connection, 'delay': delay, 'ontime': not any(delay.values())}
+
+    async def pull(  # pylint: disable=method-hidden
+            self, origin: str, destination: str, only_direct: bool = False,
+            offset: int = 0
+    ) -> TrafficInfo:
+        origin = str(origin)
+        destination = str(destination)
+        when = datetime.now() + timedelta(minutes=offset)
+
+        overview = await self._get(self.QUERY_PATH, params={
+            'S': origin,
+            'Z': destination,
+            'date': when.strftime("%d.%m.%y"),
+            'time': when.strftime("%H:%M"),
+            'start': 1,
+            'REQ0JourneyProduct_opt0': 1 if only_direct else 0
+        })
+        connections = await asyncio.gather(*[
+            self._with_delay(connection)
+            for connection in await self._parse(_parse_overview, overview)
+        ])
+        return TrafficInfo(
+            origin=origin,
+            destination=destination,
+            connections=[
+                await DeutscheBahn._mk_conn(conn)  # pylint: disable=protected-access
+                for conn in connections
+            ]
+        )
+
+
+# origin, destination, only direct connections
+Route = Tuple[str, str, bool]
+
+
+class CachedTrafficService(TrafficService, LogMixin):
+    """Caches the connections of another traffic service. Requests for the same route
+    within the same time bucket (`bucket_size` seconds, shifted by the offset) are served
+    from the cache for `ttl` seconds. The least recently used entries are evicted when the
+    cache holds more than `max_entries` entries. Concurrent requests for the same entry
+    share one pull.
+
+    Optionally the `top_n` most requested routes are refreshed at the start of each
+    bucket during the `peak_hours` (like `[('06:30', '09:00')]`), beginning `lead`
+    seconds early. The prefetcher is started by the first pull. Only the request counts of
+    the `max_entries` most requested routes are kept."""
+
+    __ignore_fields__ = ['_cache', '_inflight', '_requests', '_names', '_prefetcher']
+
+    UPSTREAM = False
+
+    DEFAULT_BUCKET_SIZE = 60.0
+    DEFAULT_TTL = 120.0
+    DEFAULT_MAX_ENTRIES = 256
+    DEFAULT_TOP_N = 5
+    DEFAULT_LEAD = 600.0
+
+    def __init__(
+            self, service: TrafficService, bucket_size: float = DEFAULT_BUCKET_SIZE,
+            ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES,
+            peak_hours: Iterable[Tuple[str, str]] = (), top_n: int = DEFAULT_TOP_N,
+            lead: float = DEFAULT_LEAD, **kwargs: Any
+    ) -> None:
+        super().__init__(**kwargs)
+        self.service = service
+        self.bucket_size = float(bucket_size)
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self.peak_hours = [
+            (datetime.strptime(start, '%H:%M').time(), datetime.strptime(end, '%H:%M').time())
+            for start, end in peak_hours
+        ]
+        self.top_n = int(top_n)
+        self.lead = float(lead)
+        self._cache: 'OrderedDict[Tuple[Route, int], Tuple[float, TrafficInfo]]' = OrderedDict()
+        self._inflight: Dict[Tuple[Route, int], 'asyncio.Future[TrafficInfo]'] = {}
+        self._requests: 'Counter[Route]' = Counter()
+        self._names: Dict[Route, Tuple[str, str]] = {}  # Route -> names as last requested
+        self._prefetcher: Optional['asyncio.Task[None]'] = None
+
+    def _bucket(self, offset: int) -> int:
+        return int((time.time() + offset * 60) // self.bucket_size)
+
+    def _lookup(self, key: Tuple[Route, int]) -> Optional[TrafficInfo]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, info = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return info
+
+    def _store(self, key: Tuple[Route, int], info: TrafficInfo) -> None:
+        self._cache[key] = (time.monotonic() + self.ttl, info)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, route: Route, offset: int, key: Tuple[Route, int]) -> TrafficInfo:
+        future = self._inflight.get(key)
+        if future is None:
+            origin, destination = self._names[route]
+            future = self._inflight[key] = asyncio.ensure_future(
+                self.service.pull(origin, destination, only_direct=route[2], offset=offset)
+            )
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        info = await asyncio.shield(future)
+        self._store(key, info)
+        return info
+
+    def _count(self, route: Route, origin: str, destination: str) -> None:
+        self._requests[route] += 1
+        self._names[route] = (origin, destination)
+        if len(self._requests) > 2 * self.max_entries:
+            # Forget the rarely requested routes (amortized: Only once in a while)
+            self._requests = Counter(dict(self._requests.most_common(self.max_entries)))
+            self._requests[route] = max(self._requests[route], 1)
+            self._names = {kept: self._names[kept] for kept in self._requests}
+
+    def popular_routes(self) -> List[Route]:
+        """Return the `top_n` most requested routes."""
+        return [route for route, _ in self._requests.most_common(self.top_n)]
+
+    async def prefetch(self) -> None:
+        """Refreshes the most requested routes for the current time bucket."""
+        routes = self.popular_routes()
+        results = await asyncio.gather(*[
+            self._fetch(route, 0, (route, self._bucket(0))) for route in routes
+        ], return_exceptions=True)
+        for route, res in zip(routes, results):
+            if isinstance(res, Exception):
+                self.logger.warning("Prefetching %s failed: %s", route, str(res))
+
+    def _is_peak(self, now: datetime) -> bool:
+        ahead = (now + timedelta(seconds=self.lead)).time()
+        current = now.time()
+        return any(
+            start <= ahead <= end or start <= current <= end
+            for start, end in self.peak_hours
+        )
+
+    async def _prefetch_loop(self) -> None:
+        while True:
+            # Sleep until the next bucket starts
+            await asyncio.sleep(self.bucket_size - time.time() % self.bucket_size)
+            if self._is_peak(datetime.now()):
+                await self.prefetch()
+
+    def _start_prefetcher(self) -> None:
+        if self.peak_hours and self._prefetcher is None:
+            self._prefetcher = asyncio.ensure_future(self._prefetch_loop())
+
+    async def stop(self) -> None:
+        """Stops the prefetcher."""
+        if self._prefetcher is not None:
+            self._prefetcher.cancel()
+            self._prefetcher = None
+
+    async def pull(  # pylint: disable=method-hidden
+            self, origin: str, destination: str, only_direct: bool = False,
+            offset: int = 0
+    ) -> TrafficInfo:
+        self._start_prefetcher()
+        origin, destination = str(origin).strip(), str(destination).strip()
+        route = (origin.lower(), destination.lower(), bool(only_direct))
+        self._count(route, origin, destination)
+        key = (route, self._bucket(offset))
+        info = self._lookup(key)
+        if info is None:
+            info = await self._fetch(route, offset, key)
+        # Report the names as requested
+        return attr.evolve(info, origin=origin, destination=destination)
+
+
+class TrafficHistory(AutoStrMixin, LogMixin):
+    """Append-only columnar store of pulled traffic connections. Every column is a file of
+    fixed-width values that is memory-mapped, so the history can grow without loading it.
+    Routes and products are stored as ids of a small vocabulary. The row count in the
+    meta file is updated after the rows are written: A crash never exposes partial rows.
+
+    Example:
+
+        >>> import tempfile
+        >>> dut = TrafficHistory(tempfile.mkdtemp())
+        >>> info = TrafficInfo('Frankfurt', 'Mainz', [
+        ...     TrafficConnection('11:43', False, '11:02', ['S 8'], 0, '0:41', True, 3, 2)
+        ... ])
+        >>> dut.append(info)
+        1
+        >>> rows = dut.select('frankfurt', 'mainz')
+        >>> int(rows['departure'][0]), int(rows['delay_departure'][0])
+        (662, 3)
+    """
+
+    __ignore_fields__ = ['_meta', '_columns', '_ids']
+
+    COLUMNS = {
+        'recorded': np.float64,  # Unix timestamp of the pull
+        'route': np.uint32,
+        'departure': np.int16,  # Planned departure in minutes of the day; -1 if unknown
+        'delay_departure': np.int16,
+        'delay_arrival': np.int16,
+        'canceled': np.bool_,
+        'products': np.uint32
+    }
+    INITIAL_CAPACITY = 1024
+    META_FILE = 'meta.json'
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+        self._meta: Dict[str, Any] = {'count': 0, 'capacity': 0, 'routes': [], 'products': []}
+        meta_path = os.path.join(self.path, self.META_FILE)
+        if os.path.isfile(meta_path):
+            with open(meta_path, 'r') as fp:
+                self._meta.update(json.load(fp))
+        self._ids: Dict[str, Dict[str, int]] = {
+            vocab: {value: i for i, value in enumerate(self._meta[vocab])}
+            for vocab in ('routes', 'products')
+        }
+        self._columns: Dict[str, Any] = {}
+        self._map()
+
+    def __len__(self) -> int:
+        return int(self._meta['count'])
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.bin')
+
+    def _map(self) -> None:
+        self._columns = {}
+        capacity = int(self._meta['capacity'])
+        if not capacity:
+            return
+        for name, dtype in self.COLUMNS.items():
+            self._columns[name] = np.memmap(
+                self._column_path(name), dtype=dtype, mode='r+', shape=(capacity,)
+            )
+
+    def _grow(self, needed: int) -> None:
+        capacity = max(int(self._meta['capacity']), self.INITIAL_CAPACITY)
+        while capacity < needed:
+            capacity *= 2
+        for column in self._columns.values():
+            column.flush()
+        self._columns = {}
+        for name, dtype in self.COLUMNS.items():
+            with open(self._column_path(name), 'ab') as fp:
+                fp.truncate(capacity * np.dtype(dtype).itemsize)
+        self._meta['capacity'] = capacity
+        self._save_meta()
+        self._map()
+
+    def _save_meta(self) -> None:
+        meta_path = os.path.join(self.path, self.META_FILE)
+        with open(f'{meta_path}.tmp', 'w') as fp:
+            json.dump(self._meta, fp)
+        os.replace(f'{meta_path}.tmp', meta_path)
+
+    def _id(self, vocab: str, value: str) -> int:
+        ids = self._ids[vocab]
+        if value not in ids:
+            ids[value] = len(self._meta[vocab])
+            self._meta[vocab].append(value)
+        return ids[value]
+
+    @staticmethod
+    def _route(origin: str, destination: str) -> str:
+        return f"{str(origin).strip().lower()}|{str(destination).strip().lower()}"
+
+    @staticmethod
+    def _minutes(clock: str) -> int:
+        hours, _, minutes = str(clock).strip().partition(':')
+        try:
+            return int(hours) * 60 + int(minutes)
+        except ValueError:
+            return -1
+
+    def append(self, info: TrafficInfo, recorded: Optional[float] = None) -> int:
+        """Appends the connections of the traffic info. Returns the number of rows."""
+        connections = list(info.connections)
+        if not connections:
+            return 0
+        start = len(self)
+        end = start + len(connections)
+        if end > int(self._meta['capacity']):
+            self._grow(end)
+
+        rows = {
+            'recorded': [time.time() if recorded is None else float(recorded)] * len(connections),
+            'route': [self._id('routes', self._route(info.origin, info.destination))] * len(connections),
+            'departure': [self._minutes(conn.departure) for conn in connections],
+            'delay_departure': [int(conn.delay_departure) for conn in connections],
+            'delay_arrival': [int(conn.delay_arrival) for conn in connections],
+            'canceled': [bool(conn.canceled) for conn in connections],
+            'products': [self._id('products', ', '.join(conn.products or [])) for conn in connections]
+        }
+        for name, values in rows.items():
+            column = self._columns[name]
+            column[start:end] = values
+            column.flush()
+        self._meta['count'] = end
+        self._save_meta()
+        return len(connections)
+
+    def select(
+            self, origin: str, destination: str, departure: Optional[str] = None
+    ) -> Dict[str, np.ndarray]:
+        """Returns the columns of the connections of the route (and optionally only of the
+        given planned departure). A connection is pulled many times before it departs: Only
+        the latest observation per day and departure is kept."""
+        route = self._ids['routes'].get(self._route(origin, destination))
+        count = len(self)
+        if route is None or not count:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+
+        mask = self._columns['route'][:count] == route
+        if departure is not None:
+            mask &= self._columns['departure'][:count] == self._minutes(departure)
+        indices = np.flatnonzero(mask)
+
+        recorded = self._columns['recorded'][indices]
+        days = (recorded // 86400).astype(np.int64)
+        keys = days * 1440 + self._columns['departure'][indices]
+        # np.unique returns the first occurrence: Search the reversed keys to get the latest
+        _, last = np.unique(keys[::-1], return_index=True)
+        indices = np.sort(indices[len(indices) - 1 - last])
+        return {name: np.asarray(column[indices]) for name, column in self._columns.items()}
+
+
+class RecordingTrafficService(TrafficService, LogMixin):
+    """Records every connection pulled from another traffic service in a
+    `TrafficHistory`."""
+
+    UPSTREAM = False
+
+    def __init__(self, service: TrafficService, history: TrafficHistory, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.service = service
+        self.history = history
+
+    async def pull(  # pylint: disable=method-hidden
+            self, origin: str, destination: str, only_direct: bool = False,
+            offset: int = 0
+    ) -> TrafficInfo:
+        info = await self.service.pull(origin, destination, only_direct=only_direct, offset=offset)
+        try:
+            self.history.append(info)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Recording the traffic history failed")
+        return info
@@ -1,10 +1,19 @@
 """Utility functions."""
 import inspect
 import logging
-from typing import Any, List, Optional, cast, Iterable, Set, Dict
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, cast, Iterable, Set, Dict
 
 from homebot.validator import is_iterable_but_no_str
 
+try:
+    from re import _parser as sre_parse, _constants as sre_constants  # type: ignore
+except ImportError:  # Python < 3.11
+    import sre_parse  # type: ignore
+    import sre_constants  # type: ignore
+
 
 def make_list(value: Any, null_empty: bool = True) -> Optional[List[Any]]:
     """
@@ -87,6 +96,106 @@ def interpolate_complex(cplx: Any, **context: Any) -> Any:
     return i(cplx)
 
 
+_CATEGORIES: Dict[Any, Callable[[str], bool]] = {
+    sre_constants.CATEGORY_DIGIT: str.isdigit,
+    sre_constants.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    sre_constants.CATEGORY_SPACE: str.isspace,
+    sre_constants.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre_constants.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+    sre_constants.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == '_'),
+}
+_REPEATS = {
+    getattr(sre_constants, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_constants, name)
+}
+_EXAMPLE_ALPHABET = 'ab1 ,.:+-_'
+
+
+def regex_examples(pattern: str, count: int = 20, seed: int = 0) -> List[str]:
+    """
+    Generates up to `count` distinct example strings for the regex `pattern`. Lookarounds
+    are ignored: An example does not necessarily match the pattern - check it if it
+    matters.
+
+    Example:
+
+        >>> import re
+        >>> examples = regex_examples(r'^switch (on|off) [0-9]+$', count=5)
+        >>> len(examples)
+        5
+        >>> all(re.match(r'^switch (on|off) [0-9]+$', example) for example in examples)
+        True
+        >>> sorted(regex_examples(r'a|b', count=5))
+        ['a', 'b']
+    """
+    rnd = random.Random(seed)
+
+    def _in_class(items: Any, char: str) -> bool:
+        code, hit, negate = ord(char), False, False
+        for op, arg in items:
+            if op == sre_constants.NEGATE:
+                negate = True
+            elif op == sre_constants.LITERAL:
+                hit = hit or code == arg
+            elif op == sre_constants.RANGE:
+                hit = hit or arg[0] <= code <= arg[1]
+            elif op == sre_constants.CATEGORY:
+                hit = hit or _CATEGORIES.get(arg, lambda c: False)(char)
+        return hit != negate
+
+    def _pick(items: Any) -> str:
+        candidates = set(_EXAMPLE_ALPHABET)
+        for op, arg in items:
+            if op == sre_constants.LITERAL:
+                candidates.add(chr(arg))
+            elif op == sre_constants.RANGE:
+                candidates.update(chr(code) for code in (arg[0], (arg[0] + arg[1]) // 2, arg[1]))
+        matching = sorted(char for char in candidates if _in_class(items, char))
+        return rnd.choice(matching) if matching else ''
+
+    def _expand(subpattern: Any, groups: Dict[int, str]) -> str:
+        out = []
+        for op, arg in subpattern:
+            if op == sre_constants.LITERAL:
+                out.append(chr(arg))
+            elif op == sre_constants.NOT_LITERAL:
+                out.append(_pick([(sre_constants.NEGATE, None), (op, arg)]))
+            elif op == sre_constants.ANY:
+                out.append(rnd.choice('a1'))
+            elif op == sre_constants.IN:
+                out.append(_pick(arg))
+            elif op == sre_constants.BRANCH:
+                out.append(_expand(rnd.choice(arg[1]), groups))
+            elif op == sre_constants.SUBPATTERN:
+                text = _expand(arg[-1], groups)
+                if arg[0] is not None:
+                    groups[arg[0]] = text
+                out.append(text)
+            elif op in _REPEATS:
+                lowest, highest, item = arg
+                times = rnd.randint(lowest, min(highest, lowest + 2))
+                out.extend(_expand(item, groups) for _ in range(times))
+            elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+                out.append(_expand(arg, groups))
+            elif op == sre_constants.GROUPREF:
+                out.append(groups.get(arg, ''))
+            elif op == sre_constants.GROUPREF_EXISTS:
+                branch = arg[1] if arg[0] in groups else arg[2]
+                out.append(_expand(branch, groups) if branch else '')
+            # Anchors and lookarounds do not add any characters
+        return ''.join(out)
+
+    parsed = sre_parse.parse(pattern)
+    examples: List[str] = []
+    for _ in range(count * 5):
+        example = _expand(parsed, {})
+        if example not in examples:
+            examples.append(example)
+            if len(examples) >= count:
+                break
+    return examples
+
+
 class classproperty(property):  # pylint: disable=invalid-name
     """
     Decorator classproperty:
@@ -196,6 +305,58 @@ class LogMixin:
         return logging.getLogger(component)
 
 
+class ExpiringSet:
+    """
+    A bounded set whose members expire after a fixed time window. The oldest members are
+    evicted first when the set exceeds its maximum size.
+
+    Example:
+        >>> dut = ExpiringSet(ttl=60, maxsize=2)
+        >>> dut.add('a')
+        True
+        >>> dut.add('a')  # Already seen
+        False
+        >>> 'a' in dut
+        True
+        >>> dut.add('b'), dut.add('c')
+        (True, True)
+        >>> 'a' in dut  # Evicted: maxsize exceeded
+        False
+        >>> len(dut)
+        2
+    """
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = float(ttl)
+        self.maxsize = int(maxsize)
+        self._items: 'OrderedDict[Any, float]' = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        # Every member has the same ttl, so insertion order equals expiry order
+        while self._items:
+            key, expires = next(iter(self._items.items()))
+            if expires > now and len(self._items) <= self.maxsize:
+                break
+            del self._items[key]
+
+    def add(self, key: Any) -> bool:
+        """Adds the key to the set. Returns True if the key was not already present."""
+        now = time.monotonic()
+        self._evict(now)
+        if key in self._items:
+            return False
+        self._items[key] = now + self.ttl
+        self._evict(now)
+        return True
+
+    def __contains__(self, key: Any) -> bool:
+        self._evict(time.monotonic())
+        return key in self._items
+
+    def __len__(self) -> int:
+        self._evict(time.monotonic())
+        return len(self._items)
+
+
 class Singleton(type):
     """
     Metaclass for singleton classes.
@@ -68,3 +68,31 @@ def doctest(ctx):
 def test(ctx):
     """Runs all tests against codebase."""
     pass
+
+
+@task
+def benchmark(ctx, number=50):
+    """Benchmarks the lego pricing extraction against the former BeautifulSoup / pandas based one."""
+    import io
+    import timeit
+    import sys
+    sys.path.append(os.path.dirname(SOURCE_PATH))
+    import pandas as pd
+    from bs4 import BeautifulSoup
+    from homebot.processors.lego import Pricing
+
+    with open(os.path.join(TEST_PATH, 'resources/sites/bwatch/corvette.html'), 'rb') as fp:
+        content = fp.read()
+
+    def _soup_and_pandas():
+        soup = BeautifulSoup(content, 'html.parser')
+        soup.find('h2', attrs={'itemprop': 'name'})
+        pd.read_html(io.StringIO(str(soup.find('table', class_='table-condensed'))))
+        soup.find('img', attrs={'id': 'setimage_xs'})
+
+    def _lxml():
+        Pricing.extract(content, 42093)
+
+    for name, func in [('beautifulsoup + pandas', _soup_and_pandas), ('lxml', _lxml)]:
+        elapsed = timeit.timeit(func, number=int(number)) / int(number)
+        print("{:<25} {:8.2f} ms".format(name, elapsed * 1000))
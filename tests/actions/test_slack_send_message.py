@@ -4,6 +4,7 @@ from unittest import mock
 import pytest
 
 from homebot.actions.slack import SendMessage
+from homebot.models import CompositePayload, SlackMessage
 
 
 @pytest.mark.asyncio
@@ -31,3 +32,55 @@ async def test_call_with_slack_message(ctx):
 def test_import():
     import homebot.actions as actions
     assert actions.slack.SendMessage is not None
+
+
+class FakeWebClient:
+    def __init__(self):
+        self.calls = []
+
+    async def chat_postMessage(self, **kwargs):
+        self.calls.append(('post', kwargs))
+        return {'ok': True, 'channel': 'C123', 'ts': '1.000100'}
+
+    async def chat_update(self, **kwargs):
+        self.calls.append(('update', kwargs))
+        return {'ok': True}
+
+
+@pytest.mark.asyncio
+async def test_placeholder_is_updated(ctx):
+    dut = SendMessage(token="itdoesntmatter")
+    dut._client = client = FakeWebClient()
+    await dut.placeholder(ctx, "Working on it...")
+    await dut(ctx.clone(), "FOO")
+    await dut(ctx, "BAR")
+    assert client.calls == [
+        ('post', {'channel': 'channel', 'text': 'Working on it...'}),
+        ('update', {'channel': 'C123', 'ts': '1.000100', 'text': 'FOO'}),
+        ('post', {'channel': 'channel', 'text': 'BAR'})
+    ]
+
+
+@pytest.mark.asyncio
+async def test_call_with_composite_payload(ctx):
+    dut = SendMessage(token="itdoesntmatter")
+    dut._client = client = FakeWebClient()
+    await dut(ctx, CompositePayload(["FOO", SlackMessage(text="BAR", blocks=[{'type': 'divider'}])]))
+    assert client.calls == [
+        ('post', {'channel': 'channel', 'text': 'FOO\nBAR', 'blocks': [{'type': 'divider'}], 'attachments': None})
+    ]
+
+
+@pytest.mark.asyncio
+async def test_provisional_is_updated(ctx):
+    dut = SendMessage(token="itdoesntmatter")
+    dut._client = client = FakeWebClient()
+    await dut.provisional(ctx, "FOO")
+    await dut.provisional(ctx, "BAR")
+    await dut.finish(ctx)
+    await dut(ctx, "BAZ")
+    assert client.calls == [
+        ('post', {'channel': 'channel', 'text': 'FOO'}),
+        ('update', {'channel': 'C123', 'ts': '1.000100', 'text': 'BAR'}),
+        ('post', {'channel': 'channel', 'text': 'BAZ'})
+    ]
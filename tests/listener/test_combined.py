@@ -0,0 +1,18 @@
+import pytest
+
+from homebot.listener import Combined
+from tests.conftest import PingListener
+
+
+@pytest.mark.asyncio
+async def test_start():
+    incomings = []
+
+    async def callback(incoming):
+        incomings.append(incoming)
+
+    dut = Combined([PingListener(intervals=2, interval_time=0.01), PingListener(intervals=3, interval_time=0.01)])
+    dut.callback = callback
+    assert all(listener.callback is callback for listener in dut.listeners)
+    await dut.start()
+    assert len(incomings) == 5
@@ -0,0 +1,127 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from homebot.listener.lego import Watchlist
+from homebot.models import AlertIncoming
+from homebot.processors.lego import Pricing
+from homebot.services.base import AdaptiveLimiter, CircuitBreaker
+
+PAGE = os.path.join(os.path.dirname(__file__), '../resources/sites/bwatch/corvette.html')
+
+
+@asynccontextmanager
+async def brickwatch(etag='"v1"'):
+    """Local stand-in for brickwatch.net that supports conditional requests."""
+    requests = []
+
+    async def set_page(request):
+        requests.append((asyncio.get_event_loop().time(), request.match_info['set_id'], dict(request.headers)))
+        if request.match_info['set_id'] != '42093':
+            raise web.HTTPNotFound()
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        with open(PAGE, 'r') as fp:
+            return web.Response(text=fp.read(), content_type='text/html', headers={'ETag': etag})
+
+    app = web.Application()
+    app.router.add_get('/{set_id}', set_page)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        yield str(server.make_url('/')), requests
+    finally:
+        await server.close()
+
+
+def pricing(base_url):
+    return Pricing(
+        base_url=base_url, breaker=CircuitBreaker('watchlist test'),
+        limiter=AdaptiveLimiter('watchlist test')
+    )
+
+
+@pytest.mark.asyncio
+async def test_poll_alerts_once():
+    incomings = []
+
+    async def callback(incoming):
+        incomings.append(incoming)
+
+    async with brickwatch() as (base_url, requests):
+        dut = Watchlist(pricing(base_url), {42093: 40.0}, channel='lego', politeness_delay=0)
+        dut.callback = callback
+        alerts = await dut.poll()
+        assert len(alerts) == 1
+        assert alerts[0].pricing.current == 36.99
+        assert alerts[0].threshold == 40.0
+
+        # Unchanged page: Not transferred again and no second alert
+        assert await dut.poll() == []
+        assert requests[1][2]['If-None-Match'] == '"v1"'
+        await asyncio.sleep(0)
+
+    assert len(incomings) == 1
+    assert isinstance(incomings[0], AlertIncoming)
+    assert incomings[0].kind == Watchlist.KIND
+    assert incomings[0].origin == 'lego'
+    assert incomings[0].payload == alerts[0]
+
+
+@pytest.mark.asyncio
+async def test_poll_below_threshold_is_quiet():
+    async with brickwatch() as (base_url, _):
+        dut = Watchlist(pricing(base_url), {42093: 30.0}, channel='lego', politeness_delay=0)
+        assert await dut.poll() == []
+
+
+@pytest.mark.asyncio
+async def test_poll_is_polite():
+    async with brickwatch() as (base_url, requests):
+        dut = Watchlist(
+            pricing(base_url), {42093: 40.0, 1: 40.0, 2: 40.0}, channel='lego',
+            max_concurrency=3, politeness_delay=0.05
+        )
+        alerts = await dut.poll()  # Missing sets are logged and skipped
+
+    assert len(alerts) == 1
+    starts = sorted(start for start, _, _ in requests)
+    assert len(starts) == 3
+    assert all(later - earlier >= 0.045 for earlier, later in zip(starts, starts[1:]))
+
+
+@pytest.mark.asyncio
+async def test_poll_retries_failed_pages():
+    async with brickwatch() as (base_url, requests):
+        dut = Watchlist(pricing(base_url), {42093: 40.0}, channel='lego', politeness_delay=0)
+        extract = dut.pricing.extract
+
+        def broken(content, set_id):
+            raise RuntimeError("Extraction failed")
+
+        dut.pricing.extract = broken
+        assert await dut.poll() == []
+        dut.pricing.extract = extract
+        assert len(await dut.poll()) == 1  # Not skipped as unchanged
+        assert 'If-None-Match' not in requests[1][2]
+
+
+@pytest.mark.asyncio
+async def test_start_survives_failed_polls():
+    polls = []
+
+    async def poll():
+        polls.append(1)
+        raise RuntimeError("database is locked")
+
+    dut = Watchlist(pricing('http://localhost'), {42093: 40.0}, channel='lego', interval=0.01)
+    dut.poll = poll
+    task = asyncio.ensure_future(dut.start())
+    await asyncio.sleep(0.05)
+    assert not task.done()
+    task.cancel()
+    assert len(polls) > 1
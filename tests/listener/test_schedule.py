@@ -0,0 +1,99 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from homebot.listener.schedule import Cron, Schedule, ScheduleRule
+
+NOW = 1_000_000.0
+
+
+def test_cron():
+    # Day of month or day of week (friday) if both are restricted
+    dut = Cron('0 12 13 * 5')
+    assert dut.next(datetime(2020, 1, 1)) == datetime(2020, 1, 3, 12, 0)
+    assert dut.next(datetime(2020, 1, 10, 12, 0)) == datetime(2020, 1, 13, 12, 0)
+    assert Cron('0 0 29 2 *').next(datetime(2020, 3, 1)) == datetime(2024, 2, 29)
+    assert Cron('15-45/15 8 * * 7').next(datetime(2020, 1, 5, 8, 15)) == datetime(2020, 1, 5, 8, 30)
+
+    for expression in ['* * * *', '60 * * * *', '* * * 0 *', '5-1 * * * *', 'a * * * *']:
+        with pytest.raises(ValueError):
+            Cron(expression)
+
+
+def test_rule_validation():
+    with pytest.raises(ValueError, match="either"):
+        ScheduleRule('r', 'ping', 'channel')
+    with pytest.raises(ValueError, match="either"):
+        ScheduleRule('r', 'ping', 'channel', every=10, cron='* * * * *')
+    with pytest.raises(ValueError, match="missed"):
+        ScheduleRule('r', 'ping', 'channel', every=10, missed='sometimes')
+
+
+def collecting(dut):
+    incomings = []
+
+    async def callback(incoming):
+        incomings.append(incoming)
+
+    dut.callback = callback
+    return incomings
+
+
+@pytest.mark.asyncio
+async def test_run_pending():
+    dut = Schedule([])
+    incomings = collecting(dut)
+    for i in range(1000):
+        dut.add(ScheduleRule(f'rule {i}', f'ping {i}', 'channel', every=10 + i), now=NOW)
+    assert dut.next_run == (NOW + 10, 'rule 0')
+
+    assert await dut.run_pending(now=NOW + 11.5) == 2
+    await asyncio.sleep(0)
+    assert [incoming.text for incoming in incomings] == ['ping 0', 'ping 1']
+    assert incomings[0].origin == 'channel'
+    assert dut.next_run == (NOW + 12, 'rule 2')
+
+    dut.remove('rule 2')
+    dut.add(ScheduleRule('rule 3', 'pong', 'channel', every=100), now=NOW)
+    assert dut.next_run == (NOW + 14, 'rule 4')
+
+
+@pytest.mark.parametrize('policy, expected', [('skip', 0), ('once', 1), ('all', 10)])
+@pytest.mark.asyncio
+async def test_missed_runs(tmp_path, policy, expected):
+    state_file = str(tmp_path / 'schedule.json')
+    with open(state_file, 'w') as fp:
+        json.dump({'report': NOW}, fp)
+
+    dut = Schedule([ScheduleRule('report', 'traffic', 'channel', every=60, missed=policy)], state_file=state_file)
+    # Down for 10 runs
+    assert await dut.run_pending(now=NOW + 10 * 60 + 30) == expected
+    assert dut.next_run == (NOW + 11 * 60, 'report')
+    with open(state_file, 'r') as fp:
+        assert json.load(fp) == {'report': NOW + 10 * 60}
+
+
+@pytest.mark.asyncio
+async def test_start():
+    dut = Schedule([ScheduleRule('fast', 'ping', 'channel', every=0.02)])
+    incomings = collecting(dut)
+    task = asyncio.ensure_future(dut.start())
+    await asyncio.sleep(0.03)
+    dut.add(ScheduleRule('added', 'pong', 'channel', every=0.01))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    texts = [incoming.text for incoming in incomings]
+    assert texts.count('ping') >= 2
+    assert 'pong' in texts
+
+
+@pytest.mark.asyncio
+async def test_unsaveable_state_keeps_running(tmp_path):
+    state_file = str(tmp_path / 'missing' / 'schedule.json')  # Directory does not exist
+    dut = Schedule([ScheduleRule('report', 'traffic', 'channel', every=60)], state_file=state_file)
+    collecting(dut)
+    dut.add(ScheduleRule('report', 'traffic', 'channel', every=60), now=NOW)
+    assert await dut.run_pending(now=NOW + 60) == 1
+    assert dut.next_run == (NOW + 120, 'report')
@@ -1,8 +1,11 @@
 import asyncio
+from contextlib import asynccontextmanager
 from unittest import mock
 from unittest.mock import MagicMock
 
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
 from homebot.listener.slack import DirectMention
 
@@ -34,7 +37,7 @@ async def test_start():
         await dut.start()
 
         rtm_mock.return_value.start.assert_called_once()
-        rtm_mock.return_value.on.assert_called_once()
+        assert rtm_mock.return_value.on.call_count == 2  # message and open
 
 
 @pytest.mark.asyncio
@@ -55,3 +58,137 @@ async def test_on_message_with_no_mention():
     await dut._on_message({'text': 'ping', 'channel': 'chnl', 'user': 'somebody'})
     await asyncio.sleep(0.05)
     assert not cb.called
+
+
+class CallbackCounter:
+    def __init__(self):
+        self.messages = []
+
+    async def __call__(self, message):
+        self.messages.append(message)
+
+
+@pytest.mark.asyncio
+async def test_on_message_deduplicates():
+    dut = DirectMention('token', 'bot_id')
+    cb = CallbackCounter()
+    dut.callback = cb
+    data = {'text': '<@bot_id> ping', 'channel': 'chnl', 'user': 'somebody', 'ts': '1.0'}
+    await dut._on_message(dict(data))
+    await dut._on_message(dict(data))
+    await dut._on_message({**data, 'client_msg_id': 'abc', 'ts': '2.0'})
+    await dut._on_message({**data, 'client_msg_id': 'abc', 'ts': '2.0'})
+    await asyncio.sleep(0.05)
+    assert len(cb.messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_on_message_filters_subtypes_and_bots():
+    dut = DirectMention('token', 'bot_id')
+    cb = CallbackCounter()
+    dut.callback = cb
+    data = {'text': '<@bot_id> ping', 'channel': 'chnl', 'user': 'somebody'}
+    await dut._on_message({**data, 'subtype': 'message_changed'})
+    await dut._on_message({**data, 'bot_id': 'B123'})
+    await dut._on_message({**data, 'user': 'bot_id'})
+    await asyncio.sleep(0.05)
+    assert not cb.messages
+
+
+@pytest.mark.asyncio
+async def test_start_reconnects_on_error():
+    with mock.patch('homebot.listener.slack.slack.RTMClient') as rtm_mock:
+        rtm_mock.return_value = MagicMock()
+        rtm_mock.return_value.start.side_effect = [
+            RuntimeError("Connection lost"),
+            asyncio.sleep(0)
+        ]
+
+        dut = DirectMention('token', 'bot_id', reconnect_base=0.01)
+        await dut.start()
+
+        assert rtm_mock.return_value.start.call_count == 2
+
+
+@asynccontextmanager
+async def slack_api():
+    """Local stand-in for the slack web api that serves a paged channel history."""
+    pages = {
+        None: {
+            'ok': True, 'has_more': True, 'response_metadata': {'next_cursor': 'page2'},
+            'messages': [
+                {'text': '<@bot_id> third', 'user': 'somebody', 'ts': '103.000000'},
+                {'text': 'no mention', 'user': 'somebody', 'ts': '102.000000'},
+            ]
+        },
+        'page2': {
+            'ok': True, 'has_more': False,
+            'messages': [{'text': '<@bot_id> first', 'user': 'somebody', 'ts': '101.000000'}]
+        }
+    }
+    requests = []
+
+    async def history(request):
+        params = dict(request.query)
+        if not params:
+            params = dict(await request.post())
+        requests.append(params)
+        return web.json_response(pages[params.get('cursor')])
+
+    app = web.Application()
+    app.router.add_route('*', '/api/conversations.history', history)
+    server = TestServer(app)
+    await server.start_server()
+    yield str(server.make_url('/api/')), requests
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_catch_up(tmp_path):
+    state_file = str(tmp_path / 'state.json')
+    with open(state_file, 'w') as fp:
+        fp.write('{"chnl": "100.000000"}')
+
+    async with slack_api() as (base_url, requests):
+        dut = DirectMention('token', 'bot_id', state_file=state_file, base_url=base_url)
+        cb = CallbackCounter()
+        dut.callback = cb
+        await dut._catch_up()
+        await asyncio.sleep(0.05)
+
+    assert [req.get('oldest') for req in requests] == ['100.000000', '100.000000']
+    assert [msg.text for msg in cb.messages] == ['first', 'third']
+    assert all(msg.origin == 'chnl' for msg in cb.messages)
+    with open(state_file) as fp:
+        assert fp.read() == '{"chnl": "103.000000"}'
+
+
+@pytest.mark.asyncio
+async def test_unsaveable_state_keeps_processing(tmp_path):
+    state_file = str(tmp_path / 'missing' / 'state.json')  # Directory does not exist
+    dut = DirectMention('token', 'bot_id', state_file=state_file)
+    cb = CallbackCounter()
+    dut.callback = cb
+    data = {'text': '<@bot_id> ping', 'channel': 'chnl', 'user': 'somebody'}
+    await dut._on_message({**data, 'ts': '1.0'})
+    await dut._on_message({**data, 'ts': '2.0'})
+    await asyncio.sleep(0.05)
+    assert len(cb.messages) == 2
+    assert dut._state.channels == {'chnl': '2.0'}
+
+
+@pytest.mark.asyncio
+async def test_on_open_keeps_catch_up_task(tmp_path):
+    dut = DirectMention('token', 'bot_id', state_file=str(tmp_path / 'state.json'))
+    started = asyncio.Event()
+
+    async def catch_up():
+        started.set()
+        await asyncio.sleep(0.01)
+
+    dut._catch_up = catch_up
+    await dut._on_open()
+    assert len(dut._catch_up_tasks) == 1
+    await started.wait()
+    await asyncio.sleep(0.05)
+    assert not dut._catch_up_tasks
@@ -1,8 +1,15 @@
+import asyncio
+import threading
+
+import attr
 import pytest
 
 from homebot import Orchestrator, Flow
+from homebot.formatter import Formatter
+from homebot.models import MessageIncoming, CompositePayload
 from homebot.processors import Error, UnknownCommand
-from tests.conftest import PingListener, PingProcessor, DoubleFormatter, MemoryAction, ErrorFormatter
+from homebot.services.base import CircuitOpenError, Offloader
+from tests.conftest import DummyListener, PingListener, PingProcessor, DoubleFormatter, MemoryAction, ErrorFormatter
 
 
 @pytest.mark.asyncio
@@ -51,3 +58,308 @@ async def test_unknown_command_handling():
     await dut.run()
     assert len(action.memory) == 5
     assert all([err.command == 'ping' for err in action.memory])
+
+
+class SlowPingProcessor(PingProcessor):
+    async def __call__(self, ctx, payload):
+        await asyncio.sleep(0.05)
+        return "pong"
+
+
+class PlaceholderAction(MemoryAction):
+    async def placeholder(self, ctx, text):
+        self.memory.append(text)
+
+
+@pytest.mark.asyncio
+async def test_placeholder():
+    action = PlaceholderAction()
+    dut = Orchestrator(
+        listener=PingListener(intervals=1),
+        flows=[
+            Flow(processor=SlowPingProcessor(), formatters=[], actions=[action], placeholder_after=0.01)
+        ]
+    )
+    await dut.run()
+    await asyncio.sleep(0.1)
+    assert action.memory == ["Working on it...", "pong"]
+
+    action.memory.clear()
+    dut.flows[0].placeholder_after = 1.0
+    await dut.run()
+    await asyncio.sleep(0.1)
+    assert action.memory == ["pong"]
+
+
+class StreamingPingProcessor(PingProcessor):
+    async def __call__(self, ctx, payload):
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield f"pong{i}"
+
+
+@pytest.mark.asyncio
+async def test_streaming():
+    action = MemoryAction()
+    dut = Orchestrator(
+        listener=PingListener(intervals=1),
+        flows=[
+            Flow(processor=StreamingPingProcessor(), formatters=[DoubleFormatter()], actions=[action])
+        ]
+    )
+    await dut.run()
+    await asyncio.sleep(0.1)
+    assert action.memory == ["pong0pong0", "pong1pong1", "pong2pong2"]
+
+    action.memory.clear()
+    dut.flows[0].batch = True
+    dut.flows[0].formatters = []
+    await dut.run()
+    await asyncio.sleep(0.1)
+    assert action.memory == [["pong0", "pong1", "pong2"]]
+
+
+class ProvisionalAction(MemoryAction):
+    async def provisional(self, ctx, payload):
+        self.memory.append(("provisional", payload))
+
+    async def finish(self, ctx):
+        self.memory.append("finish")
+
+
+@pytest.mark.asyncio
+async def test_update_in_place():
+    action = ProvisionalAction()
+    dut = Orchestrator(
+        listener=PingListener(intervals=1),
+        flows=[
+            Flow(processor=StreamingPingProcessor(), formatters=[], actions=[action], update_in_place=True)
+        ]
+    )
+    await dut.run()
+    await asyncio.sleep(0.1)
+    assert action.memory == [
+        ("provisional", "pong0"), ("provisional", "pong1"), ("provisional", "pong2"), "finish"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_split_commands():
+    class MultiCommandListener(PingListener):
+        async def start(self) -> None:
+            msg = MessageIncoming(text="ping; ping\nfoo", origin_user="user", origin="channel")
+            await self._fire_callback(msg)
+
+    action = MemoryAction()
+    dut = Orchestrator(
+        listener=MultiCommandListener(),
+        flows=[
+            Flow(processor=SlowPingProcessor(), formatters=[DoubleFormatter()], actions=[action]),
+            Flow(processor=UnknownCommand(), formatters=[], actions=[action])
+        ],
+        split_commands=True
+    )
+    await dut.run()
+    await asyncio.sleep(0.2)
+    assert len(action.memory) == 1
+    composite = action.memory[0]
+    assert isinstance(composite, CompositePayload)
+    assert composite.payloads[:2] == ["pongpong", "pongpong"]
+    assert composite.payloads[2].command == "foo"
+
+
+@pytest.mark.asyncio
+async def test_split_commands_update_in_place():
+    class MultiCommandListener(PingListener):
+        async def start(self) -> None:
+            await self._fire_callback(MessageIncoming(text="ping; ping", origin_user="user", origin="channel"))
+
+    action = ProvisionalAction()
+    dut = Orchestrator(
+        listener=MultiCommandListener(),
+        flows=[
+            Flow(processor=StreamingPingProcessor(), formatters=[], actions=[action], update_in_place=True)
+        ],
+        split_commands=True
+    )
+    await dut.run()
+    await asyncio.sleep(0.1)
+    assert len(action.memory) == 1
+    assert action.memory[0].payloads == ["pong2", "pong2"]  # Only the final payload per command
+
+
+class UnavailablePingProcessor(PingProcessor):
+    async def __call__(self, ctx, payload):
+        raise CircuitOpenError("upstream is unavailable")
+
+
+@pytest.mark.asyncio
+async def test_circuit_open_fails_fast():
+    action = MemoryAction()
+    dut = Orchestrator(
+        listener=PingListener(intervals=1),
+        flows=[
+            Flow(processor=UnavailablePingProcessor(), formatters=[], actions=[action]),
+            Flow(processor=Error(), formatters=[], actions=[action])
+        ]
+    )
+    await dut.run()
+    assert len(action.memory) == 1
+    assert action.memory[0].error_message == "upstream is unavailable"
+    assert action.memory[0].trace == "No trace"
+
+
+
+class ThreadNameFormatter(Formatter):
+    CPU_BOUND = True
+
+    def format(self, ctx, payload):
+        return f"{payload} from {threading.current_thread().name}"
+
+
+@pytest.mark.asyncio
+async def test_cpu_bound_formatter_is_offloaded():
+    action = MemoryAction()
+    dut = Orchestrator(
+        listener=PingListener(intervals=1),
+        flows=[
+            Flow(processor=PingProcessor(), formatters=[ThreadNameFormatter()], actions=[action])
+        ],
+        offloader=Offloader('thread', max_workers=1)
+    )
+    await dut.run()
+    assert action.memory == ["pong from offload_0"]
+
+
+class ProbeRecorder:
+    def __init__(self):
+        self.probes = []
+
+
+class CommandProcessor(PingProcessor):
+    def __init__(self, command, recorder):
+        super().__init__()
+        self.command = command
+        self.recorder = recorder
+
+    async def can_process(self, incoming):
+        self.recorder.probes.append(self.command)
+        return getattr(incoming, 'text', None) == self.command
+
+    async def __call__(self, ctx, payload):
+        return self.command
+
+
+@pytest.mark.asyncio
+async def test_adaptive_order(message):
+    recorder, action = ProbeRecorder(), MemoryAction()
+    flows = [
+        Flow(processor=CommandProcessor(command, recorder), formatters=[], actions=[action], priority=priority)
+        for command, priority in [('help', 0), ('traffic', 0), ('lego', 0), ('urgent', 1)]
+    ]
+    dut = Orchestrator(DummyListener(), flows, adaptive_order=True)
+    assert [flow.processor.command for flow in dut.probe_order] == ['urgent', 'help', 'traffic', 'lego']
+
+    for text in ['lego', 'lego', 'traffic']:
+        await dut._handle_incoming(attr.evolve(message, text=text))
+    assert action.memory == ['lego', 'lego', 'traffic']
+    # Higher priority first, then by match count
+    assert [flow.processor.command for flow in dut.probe_order] == ['urgent', 'lego', 'traffic', 'help']
+    recorder.probes.clear()
+    await dut._handle_incoming(attr.evolve(message, text='lego'))
+    assert recorder.probes == ['urgent', 'lego', 'traffic', 'help']  # Still all flows are probed
+    assert [(info.command, info.matches) for info in dut.flow_infos()] == [
+        ('urgent', 0), ('lego', 3), ('traffic', 1), ('help', 0)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_static_order(message):
+    recorder = ProbeRecorder()
+    flows = [
+        Flow(processor=CommandProcessor(command, recorder), formatters=[], actions=[MemoryAction()])
+        for command in ['help', 'lego']
+    ]
+    dut = Orchestrator(DummyListener(), flows)
+    await dut._handle_incoming(attr.evolve(message, text='lego'))
+    assert [flow.processor.command for flow in dut.probe_order] == ['help', 'lego']
+    assert [info.matches for info in dut.flow_infos()] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_first_match_routing(message):
+    recorder = ProbeRecorder()
+    actions = {name: MemoryAction() for name in ['ping 1', 'ping 2', 'audit', 'other']}
+    flows = [
+        Flow(processor=CommandProcessor('ping', recorder), formatters=[], actions=[actions['ping 1']]),
+        Flow(processor=CommandProcessor('ping', recorder), formatters=[], actions=[actions['ping 2']]),
+        Flow(processor=CommandProcessor('other', recorder), formatters=[], actions=[actions['other']]),
+        Flow(processor=PingProcessor(), formatters=[], actions=[actions['audit']], broadcast=True)
+    ]
+    dut = Orchestrator(DummyListener(), flows, routing='first')
+    await dut._handle_incoming(message)
+    assert actions['ping 1'].memory == ['ping']
+    assert actions['ping 2'].memory == []
+    assert actions['audit'].memory == ['pong']  # Broadcast flows are always processed
+    assert recorder.probes == ['ping']  # No more probing after the match
+
+    with pytest.raises(ValueError):
+        Orchestrator(DummyListener(), flows, routing='some')
+
+
+def test_overlapping_flows():
+    from homebot.processors import Help, RegexProcessor, Version
+
+    class Verbose(RegexProcessor):
+        DEFAULT_COMMAND = 'version'
+        MESSAGE_REGEX = r'^\s*{command}(\s+verbose)?\s*$'
+
+    flows = [
+        Flow(processor=processor, formatters=[], actions=[])
+        for processor in [Version(), Help(), Verbose(), PingProcessor()]
+    ]
+    dut = Orchestrator(DummyListener(), flows)
+    overlaps = dut.overlapping_flows()
+    assert len(overlaps) == 1
+    first, second, example = overlaps[0]
+    assert (first.processor, second.processor) == (flows[0].processor, flows[2].processor)
+    assert example.strip() == 'version'
+
+
+def test_processors_share_command_trie():
+    from homebot.processors import Help, Version
+
+    version, help_ = Version(), Help()
+    assert version.commands is not help_.commands
+    Orchestrator(DummyListener(), [
+        Flow(processor=processor, formatters=[], actions=[]) for processor in [version, help_]
+    ])
+    assert version.commands is help_.commands
+    assert version.grammar in version.commands and help_.grammar in version.commands
+    assert version.parse('version') == {}
+    assert help_.parse('version') is None
+
+
+@pytest.mark.asyncio
+async def test_adaptive_first_routing_keeps_overlapping_flows_in_order(message):
+    from homebot.processors import Help, RegexProcessor, Version
+
+    class Verbose(RegexProcessor):
+        DEFAULT_COMMAND = 'version'
+        MESSAGE_REGEX = r'^\s*{command}(\s+verbose)?\s*$'
+
+    actions = {name: MemoryAction() for name in ['version', 'help', 'verbose']}
+    flows = [
+        Flow(processor=Version(), formatters=[], actions=[actions['version']]),
+        Flow(processor=Help(), formatters=[], actions=[actions['help']]),
+        Flow(processor=Verbose(), formatters=[], actions=[actions['verbose']])
+    ]
+    dut = Orchestrator(DummyListener(), flows, adaptive_order=True, routing='first')
+    for text in ['version verbose'] * 3 + ['help'] * 2:
+        await dut._handle_incoming(attr.evolve(message, text=text))
+    # Verbose matched more often, but it overlaps with (and stays behind) Version
+    assert [type(flow.processor).__name__ for flow in dut.probe_order] == ['Help', 'Version', 'Verbose']
+
+    await dut._handle_incoming(attr.evolve(message, text='version'))
+    assert len(actions['version'].memory) == 1
+    assert len(actions['verbose'].memory) == 3
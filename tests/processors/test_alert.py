@@ -0,0 +1,21 @@
+import pytest
+
+from homebot.models import AlertIncoming, Incoming
+from homebot.processors import Alert
+
+
+@pytest.mark.asyncio
+async def test_can_process(message):
+    dut = Alert('lego price')
+    assert not await dut.can_process(Incoming())
+    assert not await dut.can_process(message)
+    assert not await dut.can_process(AlertIncoming(text='', origin='c', origin_user='', kind='other'))
+    assert await dut.can_process(AlertIncoming(text='', origin='c', origin_user='', kind='lego price'))
+
+
+@pytest.mark.asyncio
+async def test_call(ctx):
+    dut = Alert('lego price')
+    res = await dut(ctx, AlertIncoming(text='', origin='c', origin_user='', kind='lego price', payload=42))
+    assert res == 42
+    assert await dut.help() is None
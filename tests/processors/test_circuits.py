@@ -0,0 +1,32 @@
+import pytest
+
+from homebot.models import Incoming, HelpEntry
+from homebot.processors import Circuits
+from homebot.services.base import CircuitBreaker
+
+
+@pytest.mark.asyncio
+async def test_can_process(message):
+    dut = Circuits()
+    assert not await dut.can_process(Incoming())
+    assert not await dut.can_process(message)
+    message.text = "  circuits   "
+    assert await dut.can_process(message)
+
+
+@pytest.mark.asyncio
+async def test_call(ctx, message):
+    CircuitBreaker.get('monitored').record(success=False)
+    dut = Circuits()
+    message.text = 'circuits'
+    res = {info.name: info for info in await dut(ctx, message)}
+    assert res['monitored'].calls == 1
+    assert res['monitored'].state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_help():
+    dut = Circuits()
+    help = await dut.help()
+    assert isinstance(help, HelpEntry)
+    assert help.command == dut.command
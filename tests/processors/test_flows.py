@@ -0,0 +1,39 @@
+import pytest
+
+from homebot import Flow, Orchestrator
+from homebot.models import Incoming, HelpEntry
+from homebot.processors import Flows, Version
+from tests.conftest import DummyListener
+
+
+@pytest.mark.asyncio
+async def test_can_process(message):
+    dut = Flows()
+    assert not await dut.can_process(Incoming())
+    assert not await dut.can_process(message)
+    message.text = "  flows   "
+    assert await dut.can_process(message)
+
+
+@pytest.mark.asyncio
+async def test_call(ctx, message):
+    dut = Flows()
+    message.text = 'flows'
+    assert await dut(ctx, message) == []
+
+    Orchestrator(DummyListener(), [
+        Flow(processor=Version(), formatters=[], actions=[]),
+        Flow(processor=dut, formatters=[], actions=[], priority=1)
+    ])
+    res = await dut(ctx, message)
+    assert [(info.processor, info.command, info.priority) for info in res] == [
+        ('Flows', 'flows', 1), ('Version', 'version', 0)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_help():
+    dut = Flows()
+    help = await dut.help()
+    assert isinstance(help, HelpEntry)
+    assert help.command == dut.command
@@ -0,0 +1,113 @@
+import pytest
+
+from homebot.processors.grammar import (
+    Arg, ArgType, CLOCK, CommandTrie, DURATION, Grammar, INT, OFFSET, Opt, PHRASE, TEXT, Unless, Word, choice,
+    tokenize
+)
+
+
+def test_tokenize():
+    tokens = tokenize('  lego pricing 1,2  +5')
+    assert [token.text for token in tokens] == ['lego', 'pricing', '1', ',', '2', '+5']
+    assert (tokens[0].start, tokens[0].end) == (2, 6)
+
+
+def test_usage():
+    dut = Grammar('traffic', [
+        Unless('stats'), Arg('source', PHRASE, label='origin'), Word('to'),
+        Arg('targets', PHRASE, many=True, label='destination'), Opt(Arg('offset', OFFSET))
+    ])
+    assert dut.usage == 'traffic <origin> to <destination>[, <destination> ...] [+offset]'
+    assert Grammar('switch', [Arg('mode', choice('on', 'off')), Arg('entities', TEXT, label='entity')]).usage == \
+        'switch on|off <entity> [<entity> ...]'
+    assert Grammar('help').usage == 'help'
+
+
+def test_parse():
+    dut = Grammar('traffic', [
+        Unless('stats'), Arg('source', PHRASE), Word('to'), Arg('targets', PHRASE, many=True),
+        Opt(Arg('offset', OFFSET))
+    ])
+    assert dut.parse('traffic Frankfurt  Hbf to Mainz, Wiesbaden,Darmstadt+5min') == {
+        'source': 'Frankfurt  Hbf', 'targets': ['Mainz', 'Wiesbaden', 'Darmstadt'], 'offset': 5
+    }
+    assert dut.parse('TRAFFIC a to b') == {'source': 'a', 'targets': ['b'], 'offset': None}
+    assert dut.parse('traffic stats a to b') is None
+    assert dut.parse('traffic a to b,') is None
+    assert dut.parse('traffic a b') is None
+    assert dut.parse('traffics a to b') is None
+
+
+def test_parse_types():
+    dut = Grammar('history', [
+        Arg('ids', INT, many=True), Opt(Arg('period', DURATION)), Opt(Word('at'), Arg('at', CLOCK))
+    ])
+    assert dut.parse('history 1, 2 3 2H at 7:42') == {'ids': [1, 2, 3], 'period': '2h', 'at': '7:42'}
+    assert dut.parse('history 1 by') is None
+    assert dut.parse('history 1 at') is None
+    assert Grammar('switch', [Arg('mode', choice('on', 'off'))]).parse('switch ON') == {'mode': 'on'}
+
+
+def test_parse_text():
+    dut = Grammar('switch', [Arg('mode', choice('on', 'off')), Arg('entities', TEXT)])
+    assert dut.parse('switch on light.a_*,  kitchen light ') == {
+        'mode': 'on', 'entities': 'light.a_*,  kitchen light'
+    }
+    assert dut.parse('switch on') is None
+
+
+def test_regex():
+    dut = Grammar('lego pricing', [Arg('set_ids', INT, many=True)])
+    assert dut.regex.match('  Lego   pricing 1, 2 3 ')
+    assert not dut.regex.match('lego pricing')
+
+
+def test_trie_routes_longest_command():
+    stats = Grammar('traffic stats', [Arg('source', PHRASE), Word('to'), Arg('target', PHRASE)])
+    traffic = Grammar('traffic', [Arg('source', PHRASE), Word('to'), Arg('target', PHRASE)])
+    other = Grammar('traffic', [Arg('source', PHRASE)])
+    dut = CommandTrie([traffic, stats, other])
+    assert dut.route('traffic stats a to b') == {stats: {'source': 'a', 'target': 'b'}}
+    assert dut.route('traffic a to b') == {
+        traffic: {'source': 'a', 'target': 'b'}, other: {'source': 'a to b'}
+    }
+    # Falls back to the shorter command if the longer one does not accept the message
+    assert dut.route('traffic stats') == {other: {'source': 'stats'}}
+    assert dut.route('weather') == {}
+    assert stats in dut
+    assert Grammar('traffic stats') not in dut
+
+
+def test_trie_caches_routes():
+    dut = CommandTrie([Grammar('version')])
+    first = dut.route('version')
+    assert dut.route('version') is first
+    dut.add(Grammar('version', [Opt(Word('verbose'))]))
+    assert dut.route('version') is not first
+    assert len(dut.route('version')) == 2
+
+    for i in range(CommandTrie.CACHE_SIZE + 1):
+        dut.route(f'version {i}')
+    assert 'version' not in dut._cache
+
+
+def test_grammar_needs_command():
+    with pytest.raises(ValueError):
+        Grammar('  ')
+
+
+def test_parse_long_lists():
+    set_ids = list(range(1, 5001))
+    dut = Grammar('lego pricing', [Arg('set_ids', INT, many=True)])
+    text = 'lego pricing ' + ', '.join(str(set_id) for set_id in set_ids)
+    assert dut.parse(text) == {'set_ids': set_ids}
+    assert CommandTrie([dut]).route(text + ' x') == {}
+
+
+def test_route_failing_parser_is_no_match():
+    def _fail(token):
+        raise ValueError(token)
+
+    dut = CommandTrie([Grammar('fail', [Arg('value', ArgType(r'\w+', convert=_fail))])])
+    assert dut.route('fail now') == {}
+    assert 'fail now' in dut._cache  # Fails only once
@@ -0,0 +1,72 @@
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+import pytest
+
+from homebot.models import Incoming, ErrorIncoming, UnknownCommandIncoming, HelpEntry
+from homebot.processors.hass import History, HassHistoryStats
+
+
+class HistoryStub:
+    def __init__(self):
+        self.calls = []
+
+    async def samples(self, entity_id, start, end):
+        self.calls.append((entity_id, start, end))
+        timestamps = start.timestamp() + np.arange(0, 7200, 60, dtype=np.float64)
+        return timestamps, np.arange(len(timestamps), dtype=np.float64)
+
+
+@pytest.yield_fixture(scope='function')
+def dut():
+    dut = History(base_url='http://unknown:8123', token='mytoken')
+    dut.history = HistoryStub()
+    return dut
+
+
+@pytest.mark.asyncio
+async def test_can_process(message, dut):
+    assert not await dut.can_process(Incoming())
+    assert not await dut.can_process(message)
+    assert not await dut.can_process(UnknownCommandIncoming(command="foo"))
+    assert not await dut.can_process(ErrorIncoming(error_message="blub", trace="bla"))
+
+    for text in ["history sensor.temp", "  history sensor.temp  7d ", "history sensor.temp 12h by 1h"]:
+        message.text = text
+        assert await dut.can_process(message)
+
+
+@pytest.mark.asyncio
+async def test_call(ctx, message, dut):
+    message.text = 'history sensor.temp 2h by 1h'
+    res = await dut(ctx, message)
+
+    entity_id, start, end = dut.history.calls[0]
+    assert entity_id == 'sensor.temp'
+    assert end - start == timedelta(hours=2)
+    assert isinstance(res, HassHistoryStats)
+    assert res.count == 120
+    assert (res.minimum, res.maximum, res.mean) == (0.0, 119.0, 59.5)
+    assert res.percentiles[50] == 59.5
+    assert [(b.count, b.minimum, b.maximum, b.mean) for b in res.buckets] == [
+        (60, 0.0, 59.0, 29.5), (60, 60.0, 119.0, 89.5)
+    ]
+    assert res.buckets[1].start == start + timedelta(hours=1)
+
+
+def test_from_samples_without_values():
+    now = datetime.now(timezone.utc)
+    with pytest.raises(RuntimeError, match="no numeric samples"):
+        HassHistoryStats.from_samples('sensor.temp', now, now, np.array([]), np.array([]), [50])
+
+
+@pytest.mark.asyncio
+async def test_help(dut):
+    help = await dut.help()
+    assert isinstance(help, HelpEntry)
+    assert help.command == dut.command
+
+
+def test_import():
+    import homebot.processors as proc
+    assert proc.hass.History is not None
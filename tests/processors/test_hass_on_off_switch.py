@@ -76,3 +76,118 @@ async def test_help(dut):
 def test_import():
     import homebot.processors as proc
     assert proc.hass.OnOffSwitch is not None
+
+
+class FakeApi:
+    def __init__(self):
+        self.calls = []
+
+    async def call(self, endpoint, method='get', data=None):
+        self.calls.append((endpoint, method, data))
+        if endpoint == 'states':
+            return [
+                {'entity_id': eid, 'state': 'off', 'attributes': {'friendly_name': name}}
+                for eid, name in [
+                    ('light.kitchen_1', 'Kitchen Ceiling'), ('light.kitchen_2', 'Kitchen Counter'),
+                    ('light.bath', 'Bathroom Mirror'), ('switch.fan', 'Fan')
+                ]
+            ]
+        eids = data['entity_id'] if isinstance(data['entity_id'], list) else [data['entity_id']]
+        return [{'entity_id': eid, 'state': 'on', 'attributes': {}} for eid in eids]
+
+
+@pytest.mark.asyncio
+async def test_call_multiple_entities_and_globs(ctx, message, dut):
+    dut.api = FakeApi()
+    message.text = 'switch on light.kitchen_*, switch.fan light.kitchen_1'
+    assert await dut.can_process(message)
+    res = await dut(ctx, message)
+
+    assert dut.api.calls[-1] == (
+        'services/homeassistant/turn_on', 'post',
+        {'entity_id': ['light.kitchen_1', 'light.kitchen_2', 'switch.fan']}
+    )
+    assert [change.entity_id for change in res] == ['light.kitchen_1', 'light.kitchen_2', 'switch.fan']
+
+    message.text = 'switch on light.garage_*'
+    with pytest.raises(RuntimeError, match="No entity matches"):
+        await dut(ctx, message)
+    # Entity list is cached
+    assert len([call for call in dut.api.calls if call[0] == 'states']) == 1
+
+
+@pytest.mark.asyncio
+async def test_call_debounced(ctx, message, dut):
+    dut.api = FakeApi()
+    dut.debounce = 0.05
+    msg1, msg2 = message.clone(), message.clone()
+    msg1.text = 'switch off light.bath'
+    msg2.text = 'switch off switch.fan'
+    res1, res2 = await asyncio.gather(dut(ctx, msg1), dut(ctx, msg2))
+
+    assert dut.api.calls == [(
+        'services/homeassistant/turn_off', 'post', {'entity_id': ['light.bath', 'switch.fan']}
+    )]
+    assert [change.entity_id for change in res1] == ['light.bath']
+    assert [change.entity_id for change in res2] == ['switch.fan']
+
+
+@pytest.mark.asyncio
+async def test_call_with_friendly_names(ctx, message, dut):
+    dut.api = FakeApi()
+    message.text = 'switch off kitchen counter, bathroom mirror light.kitchen_1'
+    assert await dut.can_process(message)
+    res = await dut(ctx, message)
+
+    assert dut.api.calls[-1] == (
+        'services/homeassistant/turn_off', 'post',
+        {'entity_id': ['light.kitchen_2', 'light.bath', 'light.kitchen_1']}
+    )
+    assert len(res) == 3
+
+    message.text = 'switch off garage door'
+    with pytest.raises(RuntimeError, match="No entity matches 'garage door'"):
+        await dut(ctx, message)
+
+    # Ambiguous names switch nothing
+    calls = len(dut.api.calls)
+    message.text = 'switch off kitchen'
+    with pytest.raises(RuntimeError, match="'kitchen' is ambiguous: light.kitchen_1, light.kitchen_2"):
+        await dut(ctx, message)
+    assert len(dut.api.calls) == calls
+
+
+@pytest.mark.asyncio
+async def test_call_optimistic(ctx, message, dut):
+    dut.api = FakeApi()
+    dut.optimistic = True
+    message.text = 'switch on kitchen counter'
+    stream = await dut(ctx, message)
+
+    expected = await stream.__anext__()
+    assert expected == [HassStateChange(friendly_name='Kitchen Counter', entity_id='light.kitchen_2', state='on')]
+    assert dut.api.calls[-1][0] == 'states'  # Not switched yet
+    confirmed = await stream.__anext__()
+    assert confirmed == [HassStateChange(friendly_name='', entity_id='light.kitchen_2', state='on')]
+    assert dut.api.calls[-1][0] == 'services/homeassistant/turn_on'
+
+
+@pytest.mark.asyncio
+async def test_call_optimistic_unconfirmed(ctx, message, dut):
+    class SlowApi(FakeApi):
+        async def call(self, endpoint, method='get', data=None):
+            await asyncio.sleep(0.1)
+            return await super().call(endpoint, method, data)
+
+    dut.api = SlowApi()
+    dut.optimistic = True
+    dut.optimistic_timeout = 0.01
+    message.text = 'switch off switch.fan'
+    res = [changes async for changes in await dut(ctx, message)]
+    assert [[change.state for change in changes] for changes in res] == [['off'], ['off (unconfirmed)']]
+    await asyncio.sleep(0.2)
+    assert dut.api.calls[-1][0] == 'services/homeassistant/turn_off'  # Not cancelled by the timeout
+
+
+def test_optimistic_timeout_below_api_timeout():
+    assert OnOffSwitch(base_url='http://unknown:8123', token='mytoken').optimistic_timeout < 5.0
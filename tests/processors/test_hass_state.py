@@ -0,0 +1,65 @@
+import pytest
+
+from homebot.models import Incoming, ErrorIncoming, UnknownCommandIncoming, HelpEntry
+from homebot.processors.hass import State, HassStateChange
+
+
+class MirrorStub:
+    def __init__(self, states):
+        self.states = states
+        self.started = False
+
+    async def start(self):
+        self.started = True
+
+    async def wait_ready(self, timeout=None):
+        pass
+
+    def state(self, entity_id):
+        return self.states.get(entity_id)
+
+
+@pytest.yield_fixture(scope='function')
+def dut():
+    dut = State(base_url='http://unknown:8123', token='mytoken')
+    dut.mirror = MirrorStub({
+        'light.kitchen': {
+            'entity_id': 'light.kitchen', 'state': 'on', 'attributes': {'friendly_name': 'Kitchen'}
+        }
+    })
+    return dut
+
+
+@pytest.mark.asyncio
+async def test_can_process(message, dut):
+    assert not await dut.can_process(Incoming())
+    assert not await dut.can_process(message)
+    assert not await dut.can_process(UnknownCommandIncoming(command="foo"))
+    assert not await dut.can_process(ErrorIncoming(error_message="blub", trace="bla"))
+
+    message.text = "  state   light.kitchen   "
+    assert await dut.can_process(message)
+
+
+@pytest.mark.asyncio
+async def test_call(ctx, message, dut):
+    message.text = 'state light.kitchen'
+    res = await dut(ctx, message)
+    assert dut.mirror.started
+    assert res == HassStateChange(friendly_name='Kitchen', entity_id='light.kitchen', state='on')
+
+    message.text = 'state light.unknown'
+    with pytest.raises(RuntimeError, match="unknown"):
+        await dut(ctx, message)
+
+
+@pytest.mark.asyncio
+async def test_help(dut):
+    help = await dut.help()
+    assert isinstance(help, HelpEntry)
+    assert help.command == dut.command
+
+
+def test_import():
+    import homebot.processors as proc
+    assert proc.hass.State is not None
@@ -7,6 +7,8 @@ import pytest
 
 from homebot.models import Incoming, ErrorIncoming, UnknownCommandIncoming, HelpEntry
 from homebot.processors.lego import Pricing, LegoPricing
+from homebot.services.base import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from homebot.services.lego import PriceHistory
 
 
 @pytest.yield_fixture(scope='function')
@@ -53,3 +55,120 @@ async def test_help():
 def test_import():
     import homebot.processors as proc
     assert proc.lego.Pricing is not None
+
+
+def test_extract(response):
+    res = Pricing.extract(response.content, 42093)
+    assert res == LegoPricing(
+        set_name='LEGO Chevrolet Corvette ZR1',
+        set_id=42093,
+        set_image_url='https://cdn.kiobi.com/images/brickwatch/sets/42093.jpg',
+        current=36.99,
+        recommended=39.99,
+        highest=53.95,
+        lowest=23.99
+    )
+    assert Pricing.extract(response.content.encode('utf-8'), 42093) == res
+
+
+def test_extract_missing_prices():
+    with pytest.raises(IndexError, match="Aktueller Preis"):
+        Pricing.extract(
+            '<h2 itemprop="name" content="LEGO Foo (1234)"></h2>'
+            '<table class="table table-condensed"><tr><td>Unknown</td><td>1,00 &euro;</td></tr></table>',
+            1234
+        )
+
+
+@pytest.mark.asyncio
+async def test_call_multiple_sets(ctx, message, response, tmp_path):
+    in_flight, max_in_flight = 0, 0
+
+    async def fetch_page(set_id):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01 * (set_id % 10))
+        in_flight -= 1
+        if set_id == 666:
+            raise RuntimeError("Not found")
+        return response
+
+    history = PriceHistory(str(tmp_path / 'prices.db'), batch_size=100)
+    dut = Pricing(history=history, max_concurrency=2)
+    dut._fetch_page = fetch_page
+    message.text = 'lego pricing 42093, 3 666 42093 1'
+    assert await dut.can_process(message)
+
+    res = [pricing async for pricing in await dut(ctx, message)]
+    assert len(res) == 3
+    assert max_in_flight == 2
+    assert all(pricing.all_time_low == 23.99 for pricing in res)
+    assert not any(pricing.near_low for pricing in res)
+    # All observations were written in one batch when the stream was done
+    assert history.pending == 0
+    assert history.lows([42093]) == {42093: 36.99}
+
+
+@pytest.mark.asyncio
+async def test_call_multiple_sets_all_failed(ctx, message):
+    async def fetch_page(set_id):
+        raise RuntimeError(f"Set {set_id} not found")
+
+    dut = Pricing()
+    dut._fetch_page = fetch_page
+    message.text = 'lego pricing 1 2'
+    with pytest.raises(RuntimeError, match="not found"):
+        [pricing async for pricing in await dut(ctx, message)]
+
+
+@pytest.mark.asyncio
+async def test_call_too_many_sets(ctx, message):
+    fetched = []
+
+    async def fetch_page(set_id):
+        fetched.append(set_id)
+        raise RuntimeError(f"Set {set_id} not found")
+
+    dut = Pricing(max_sets=3)
+    dut._fetch_page = fetch_page
+    message.text = 'lego pricing 1, 2, 3, 4'
+    with pytest.raises(RuntimeError, match="At most 3 set ids per message, but got 4"):
+        await dut(ctx, message)
+    assert not fetched
+
+    # Duplicates do not count
+    message.text = 'lego pricing 1, 2, 3, 3'
+    with pytest.raises(RuntimeError, match="not found"):
+        [pricing async for pricing in await dut(ctx, message)]
+    assert sorted(fetched) == [1, 2, 3]
+
+@pytest.mark.asyncio
+async def test_server_errors_open_the_circuit():
+    response = namedtuple('Response', ['status_code', 'content', 'headers'])
+    breaker = CircuitBreaker('brickwatch test', min_calls=2)
+    dut = Pricing(breaker=breaker, limiter=AdaptiveLimiter('brickwatch test'))
+    with mock.patch('homebot.processors.lego.httpx.get') as mock_get:
+        mock_get.return_value = response(503, 'Service Unavailable', {})
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="Http Code: 503"):
+                await dut.fetch(42093)
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await dut.fetch(42093)
+        assert mock_get.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_client_errors_keep_the_circuit_closed():
+    response = namedtuple('Response', ['status_code', 'content', 'headers'])
+    breaker = CircuitBreaker('brickwatch client test', min_calls=2)
+    dut = Pricing(breaker=breaker, limiter=AdaptiveLimiter('brickwatch client test'))
+    with mock.patch('homebot.processors.lego.httpx.get') as mock_get:
+        mock_get.return_value = response(404, 'Not Found', {})
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="Http Code: 404"):
+                await dut.fetch(1)
+        mock_get.return_value = response(304, '', {})
+        assert await dut.fetch_if_modified(42093, {'etag': '"v1"'}) is None
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,32 @@
+import pytest
+
+from homebot.models import Incoming, HelpEntry
+from homebot.processors import Limits
+from homebot.services.base import AdaptiveLimiter
+
+
+@pytest.mark.asyncio
+async def test_can_process(message):
+    dut = Limits()
+    assert not await dut.can_process(Incoming())
+    assert not await dut.can_process(message)
+    message.text = "  limits   "
+    assert await dut.can_process(message)
+
+
+@pytest.mark.asyncio
+async def test_call(ctx, message):
+    AdaptiveLimiter.get('monitored', initial_limit=3)
+    dut = Limits()
+    message.text = 'limits'
+    res = {info.name: info for info in await dut(ctx, message)}
+    assert res['monitored'].limit == 3
+    assert res['monitored'].queued == 0
+
+
+@pytest.mark.asyncio
+async def test_help():
+    dut = Limits()
+    help = await dut.help()
+    assert isinstance(help, HelpEntry)
+    assert help.command == dut.command
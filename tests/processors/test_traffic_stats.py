@@ -0,0 +1,57 @@
+import pytest
+
+from homebot.models import Incoming, HelpEntry
+from homebot.processors.traffic import Traffic, TrafficStats, TrafficDelayStats
+from homebot.services.traffic import TrafficHistory, TrafficInfo, TrafficConnection, DeutscheBahn
+
+DAY = 86400.0
+
+
+@pytest.yield_fixture(scope='function')
+def history(tmp_path):
+    history = TrafficHistory(str(tmp_path))
+    for day, (delay, canceled) in enumerate([(0, False), (4, False), (10, False), (0, True)]):
+        history.append(TrafficInfo('Frankfurt', 'Mainz', [
+            TrafficConnection('08:12', canceled, '07:42', ['RE 4'], 0, '0:30', delay > 0, delay, delay + 1),
+            TrafficConnection('08:27', False, '07:57', ['S 8'], 0, '0:30', False, 0, 0)
+        ]), recorded=day * DAY)
+    return history
+
+
+@pytest.mark.asyncio
+async def test_can_process(message, history):
+    dut = TrafficStats(history)
+    assert not await dut.can_process(Incoming())
+    message.text = "traffic stats Frankfurt to Mainz"
+    assert await dut.can_process(message)
+    message.text = "traffic stats Frankfurt Hbf to Mainz at 7:42"
+    assert await dut.can_process(message)
+    # Not a traffic query
+    assert not await Traffic(service=DeutscheBahn()).can_process(message)
+
+
+@pytest.mark.asyncio
+async def test_call(ctx, message, history):
+    dut = TrafficStats(history, percentiles=[50])
+    message.text = "traffic stats frankfurt to mainz at 7:42"
+    res = await dut(ctx, message)
+    assert res == TrafficDelayStats(
+        origin='frankfurt', destination='mainz', departure='7:42', count=4, canceled_rate=0.25,
+        delayed_rate=0.5, departure_delay={50: 4.0}, arrival_delay={50: 5.0}
+    )
+
+    message.text = "traffic stats Frankfurt to Mainz"
+    res = await dut(ctx, message)
+    assert res.count == 8
+
+    message.text = "traffic stats Mainz to Frankfurt"
+    with pytest.raises(RuntimeError, match="no recorded traffic"):
+        await dut(ctx, message)
+
+
+@pytest.mark.asyncio
+async def test_help(history):
+    dut = TrafficStats(history)
+    help = await dut.help()
+    assert isinstance(help, HelpEntry)
+    assert help.command == dut.command
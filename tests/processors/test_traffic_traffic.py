@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 from homebot.models import Incoming, ErrorIncoming, UnknownCommandIncoming, HelpEntry
@@ -47,3 +49,37 @@ async def test_help():
 def test_import():
     import homebot.processors as proc
     assert proc.traffic.Traffic is not None
+
+
+@pytest.mark.asyncio
+async def test_call_multiple_destinations(ctx, message):
+    class SlowService(TrafficService):
+        def __init__(self):
+            super().__init__()
+            self.running = self.max_running = 0
+
+        async def pull(self, origin: str, destination: str, only_direct: bool = False, offset: int = 0) -> TrafficInfo:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await asyncio.sleep(0.01)
+            self.running -= 1
+            if destination == 'Nowhere':
+                raise RuntimeError("Unknown station")
+            return TrafficInfo(origin, destination, [
+                TrafficConnection('12:00', False, '11:00', ['ICE'], 0, '1:00', False, 0, 0)
+            ])
+
+    service = SlowService()
+    dut = Traffic(service=service, max_concurrency=2)
+    message.text = "traffic Frankfurt to Mainz, Wiesbaden,Darmstadt, Nowhere +5"
+    assert await dut.can_process(message)
+    res = await dut(ctx, message)
+
+    assert service.max_running == 2
+    assert res.origin == 'Frankfurt'
+    assert res.destination == 'Mainz, Wiesbaden, Darmstadt'
+    assert [conn.destination for conn in res.connections] == ['Mainz', 'Wiesbaden', 'Darmstadt']
+
+    message.text = "traffic Frankfurt to Nowhere, Nowhere"
+    with pytest.raises(RuntimeError, match="Unknown station"):
+        await dut(ctx, message)
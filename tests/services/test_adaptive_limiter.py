@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from homebot.services.base import AdaptiveLimiter
+
+
+async def call(dut, duration=0.0, fail=False):
+    async with dut.permit():
+        await asyncio.sleep(duration)
+        if fail:
+            raise RuntimeError("upstream failed")
+
+
+@pytest.mark.asyncio
+async def test_queues_over_limit():
+    dut = AdaptiveLimiter('test', initial_limit=2, max_limit=2)
+    tasks = [asyncio.ensure_future(call(dut, 0.05)) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    info = dut.info()
+    assert (info.limit, info.in_flight, info.queued) == (2, 2, 3)
+
+    await asyncio.gather(*tasks)
+    info = dut.info()
+    assert (info.in_flight, info.queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_increase_and_decrease():
+    dut = AdaptiveLimiter('test', initial_limit=2)
+    for _ in range(10):
+        await call(dut)
+    assert dut.limit > 2
+
+    limit = dut.limit
+    with pytest.raises(RuntimeError):
+        await call(dut, fail=True)
+    assert dut.limit == limit // 2
+
+
+@pytest.mark.asyncio
+async def test_decrease_once_per_round_trip():
+    dut = AdaptiveLimiter('test', initial_limit=8, max_limit=8)
+    results = await asyncio.gather(*[call(dut, 0.01, fail=True) for _ in range(8)], return_exceptions=True)
+    assert all(isinstance(res, RuntimeError) for res in results)
+    assert dut.limit == 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter():
+    dut = AdaptiveLimiter('test', initial_limit=1, max_limit=1)
+    running = asyncio.ensure_future(call(dut, 0.02))
+    waiting = asyncio.ensure_future(call(dut))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    await running
+    assert dut.info().in_flight == 0
+    await asyncio.wait_for(call(dut), timeout=1)  # Permit was not leaked
+
+
+class LegacyCancelledError(asyncio.CancelledError, Exception):
+    """`CancelledError` as of python 3.7: An `Exception`."""
+
+
+@pytest.mark.asyncio
+async def test_cancelled_holder_is_no_failure():
+    dut = AdaptiveLimiter('test', initial_limit=4, max_limit=4)
+    holder = asyncio.ensure_future(call(dut, 1))
+    await asyncio.sleep(0)
+    holder.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await holder
+    assert (dut.limit, dut.info().in_flight) == (4, 0)
+
+    with pytest.raises(LegacyCancelledError):
+        async with dut.permit():
+            raise LegacyCancelledError()
+    assert (dut.limit, dut.info().in_flight) == (4, 0)
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from homebot.services.base import CircuitBreaker, CircuitOpenError
+
+
+async def fail():
+    raise RuntimeError("upstream failed")
+
+
+async def call(dut, coro):
+    async with dut:
+        return await coro
+
+
+@pytest.mark.asyncio
+async def test_opens_on_failure_rate():
+    dut = CircuitBreaker('test', failure_threshold=0.5, window=4, min_calls=4, cooldown=60)
+    for _ in range(3):
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            await call(dut, fail())
+    assert dut.state == CircuitBreaker.CLOSED  # Not enough calls yet
+
+    await call(dut, asyncio.sleep(0))
+    assert dut.state == CircuitBreaker.OPEN
+    assert dut.info().failure_rate == 0.75
+
+    coro = asyncio.sleep(0)
+    with pytest.raises(CircuitOpenError, match="test is unavailable"):
+        await call(dut, coro)
+    coro.close()
+
+
+@pytest.mark.asyncio
+async def test_half_open():
+    dut = CircuitBreaker('test', min_calls=1, cooldown=0.05)
+    with pytest.raises(RuntimeError):
+        await call(dut, fail())
+    assert dut.state == CircuitBreaker.OPEN
+
+    await asyncio.sleep(0.05)
+    assert dut.state == CircuitBreaker.HALF_OPEN
+    # Only a single trial call is permitted
+    trial = asyncio.ensure_future(call(dut, asyncio.sleep(0.01)))
+    await asyncio.sleep(0)
+    with pytest.raises(CircuitOpenError):
+        dut.check()
+    await trial
+    assert dut.state == CircuitBreaker.CLOSED
+
+    # Failing trial re-opens the circuit
+    with pytest.raises(RuntimeError):
+        await call(dut, fail())
+    await asyncio.sleep(0.05)
+    with pytest.raises(RuntimeError):
+        await call(dut, fail())
+    assert dut.state == CircuitBreaker.OPEN
+
+
+def test_registry():
+    dut = CircuitBreaker.get('shared')
+    assert CircuitBreaker.get('shared') is dut
+    assert dut in CircuitBreaker.all()
+
+
+class LegacyCancelledError(asyncio.CancelledError, Exception):
+    """`CancelledError` as of python 3.7: An `Exception`."""
+
+
+async def cancelled():
+    raise LegacyCancelledError()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_calls_have_no_verdict():
+    dut = CircuitBreaker('test', min_calls=1, cooldown=0.05)
+    for _ in range(3):
+        with pytest.raises(asyncio.CancelledError):
+            await call(dut, cancelled())
+    assert dut.state == CircuitBreaker.CLOSED
+    assert dut.info().calls == 0
+
+    with pytest.raises(RuntimeError):
+        await call(dut, fail())
+    await asyncio.sleep(0.05)
+    # A cancelled trial frees the trial slot
+    with pytest.raises(asyncio.CancelledError):
+        await call(dut, cancelled())
+    await call(dut, asyncio.sleep(0))
+    assert dut.state == CircuitBreaker.CLOSED
@@ -0,0 +1,71 @@
+import pytest
+
+from homebot.services.hass import AmbiguousEntityError, HassEntityIndex
+
+
+def _state(entity_id, friendly_name, **attributes):
+    return {'entity_id': entity_id, 'attributes': {'friendly_name': friendly_name, **attributes}}
+
+
+def test_search():
+    dut = HassEntityIndex()
+    dut.sync([
+        _state('light.kitchen_ceiling_2', 'Kitchen Ceiling'),
+        _state('light.kitchen_counter', 'Kitchen Counter'),
+        _state('light.mirror', 'Mirror', area='Bathroom'),
+    ])
+    assert len(dut) == 3
+    assert dut.best('kitchen ceiling') == 'light.kitchen_ceiling_2'
+    assert dut.best('kitchn countr') == 'light.kitchen_counter'  # Typos
+    assert dut.best('bathroom') == 'light.mirror'  # Area
+    assert [eid for eid, _ in dut.search('kitchen')] == ['light.kitchen_counter', 'light.kitchen_ceiling_2']
+    assert dut.search('') == []
+
+
+def test_incremental_sync():
+    dut = HassEntityIndex()
+    dut.sync([_state('light.a', 'Living Room'), _state('light.b', 'Bedroom')])
+    assert dut.best('living room') == 'light.a'
+
+    dut.sync([_state('light.a', 'Office'), _state('light.c', 'Garage')])
+    assert len(dut) == 2
+    assert dut.best('living room') is None
+    assert dut.best('bedroom') is None
+    assert dut.best('office') == 'light.a'
+    assert dut.best('garage') == 'light.c'
+
+    dut.remove('light.c')
+    assert dut.best('garage') is None
+
+
+def _house():
+    dut = HassEntityIndex()
+    dut.sync([
+        _state('light.kitchen_1', 'Kitchen Ceiling'),
+        _state('light.kitchen_2', 'Kitchen Counter'),
+        _state('light.bath', 'Bathroom Light'),
+        _state('light.living_room', 'Living Room Lamp'),
+        _state('lock.front_door', 'Front Door'),
+        _state('switch.heater', 'Heater'),
+        _state('cover.garage', 'Garage', area='Garage'),
+    ])
+    return dut
+
+
+def test_unrelated_names_match_nothing():
+    dut = _house()
+    assert dut.best('back door') is None
+    assert dut.best('garage door') is None
+    assert dut.best('living room light') is None
+    assert dut.best('bedroom') is None
+    assert dut.best('front door') == 'lock.front_door'
+    assert dut.best('living room') == 'light.living_room'
+
+
+def test_ambiguous_names():
+    dut = _house()
+    with pytest.raises(AmbiguousEntityError) as exc:
+        dut.best('kitchen')
+    assert exc.value.candidates == ['light.kitchen_1', 'light.kitchen_2']
+    assert str(exc.value) == "'kitchen' is ambiguous: light.kitchen_1, light.kitchen_2"
+    assert dut.best('kitchen counter') == 'light.kitchen_2'
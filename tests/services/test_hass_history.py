@@ -0,0 +1,78 @@
+import urllib.parse as urlparse
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from homebot.services.hass import HassHistory
+
+BASE = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeApi:
+    """Serves one sample per minute. Every fifth sample is unavailable."""
+    def __init__(self):
+        self.periods = []
+
+    async def call(self, endpoint, method='get', data=None):
+        url = urlparse.urlparse(endpoint)
+        start = datetime.fromisoformat(urlparse.unquote(url.path.rsplit('/', 1)[1]))
+        end = datetime.fromisoformat(urlparse.parse_qs(url.query)['end_time'][0])
+        self.periods.append((start, end))
+        samples = []
+        current = start
+        while current <= end:
+            minute = int((current - BASE).total_seconds() // 60)
+            samples.append({
+                'entity_id': 'sensor.temp',
+                'state': 'unavailable' if minute % 5 == 4 else str(float(minute)),
+                'last_changed': current.isoformat()
+            })
+            current += timedelta(minutes=1)
+        return [samples]
+
+
+@pytest.mark.asyncio
+async def test_samples():
+    api = FakeApi()
+    dut = HassHistory(api)
+    timestamps, values = await dut.samples('sensor.temp', BASE, BASE + timedelta(minutes=9))
+    assert list(values) == [0, 1, 2, 3, 5, 6, 7, 8]
+    assert timestamps[0] == BASE.timestamp()
+    assert api.periods == [(BASE, BASE + timedelta(minutes=9))]
+
+
+@pytest.mark.asyncio
+async def test_samples_only_fetches_missing_ranges():
+    api = FakeApi()
+    dut = HassHistory(api)
+    await dut.samples('sensor.temp', BASE + timedelta(minutes=5), BASE + timedelta(minutes=10))
+    timestamps, values = await dut.samples('sensor.temp', BASE, BASE + timedelta(minutes=12))
+
+    assert api.periods == [
+        (BASE + timedelta(minutes=5), BASE + timedelta(minutes=10)),
+        (BASE, BASE + timedelta(minutes=5)),
+        (BASE + timedelta(minutes=10), BASE + timedelta(minutes=12)),
+    ]
+    assert list(values) == [0, 1, 2, 3, 5, 6, 7, 8, 10, 11, 12]
+    assert all(timestamps[1:] > timestamps[:-1])
+
+    # Fully cached
+    await dut.samples('sensor.temp', BASE + timedelta(minutes=1), BASE + timedelta(minutes=11))
+    assert len(api.periods) == 3
+
+
+@pytest.mark.asyncio
+async def test_samples_longer_than_retention():
+    api = FakeApi()
+    dut = HassHistory(api, retention=600)
+    timestamps, values = await dut.samples('sensor.temp', BASE, BASE + timedelta(minutes=29))
+    assert len(values) == 24  # 30 minutes without every fifth
+    assert timestamps[0] == BASE.timestamp()
+
+    # Only the retention is kept in the cache, the rest is fetched again
+    covered_start, covered_end, cached, _ = dut._cache['sensor.temp']
+    assert covered_end - covered_start == 600
+    assert cached[0] == (BASE + timedelta(minutes=20)).timestamp()  # Minute 19 is unavailable
+    _, values = await dut.samples('sensor.temp', BASE, BASE + timedelta(minutes=29))
+    assert len(values) == 24
+    assert len(api.periods) == 2
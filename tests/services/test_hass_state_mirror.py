@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web, WSMsgType
+from aiohttp.test_utils import TestServer
+
+from homebot.services.hass import HassStateMirror
+
+STATES = [
+    {'entity_id': 'light.kitchen', 'state': 'off', 'attributes': {'friendly_name': 'Kitchen'},
+     'last_updated': '2020-01-01T00:00:00+00:00'},
+    {'entity_id': 'switch.fan', 'state': 'on', 'attributes': {'friendly_name': 'Fan'},
+     'last_updated': '2020-01-01T00:00:00+00:00'},
+]
+
+
+@asynccontextmanager
+async def hass_websocket():
+    """Local fake of the home assistant websocket api."""
+    connections = []
+
+    async def websocket(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connections.append(ws)
+        await ws.send_json({'type': 'auth_required'})
+        auth = await ws.receive_json()
+        if auth.get('access_token') != 'token':
+            await ws.send_json({'type': 'auth_invalid', 'message': 'Invalid password'})
+            await ws.close()
+            return ws
+        await ws.send_json({'type': 'auth_ok'})
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+            cmd = msg.json()
+            if cmd['type'] == 'subscribe_events':
+                await ws.send_json({'id': cmd['id'], 'type': 'result', 'success': True, 'result': None})
+            elif cmd['type'] == 'get_states':
+                await ws.send_json({'id': cmd['id'], 'type': 'result', 'success': True, 'result': STATES})
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/api/websocket', websocket)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        yield str(server.make_url('/')), connections
+    finally:
+        await server.close()
+
+
+def test_websocket_url():
+    assert HassStateMirror('http://hass:8123', 'token').websocket_url == 'ws://hass:8123/api/websocket'
+    assert HassStateMirror('https://hass/', 'token').websocket_url == 'wss://hass/api/websocket'
+
+
+@pytest.mark.asyncio
+async def test_mirror():
+    async with hass_websocket() as (base_url, connections):
+        dut = HassStateMirror(base_url, 'token', reconnect_delay=0.01)
+        await dut.start()
+        await dut.wait_ready(timeout=2)
+        assert dut.connected
+        assert dut.state('light.kitchen')['state'] == 'off'
+        assert set(dut.states) == {'light.kitchen', 'switch.fan'}
+
+        await connections[0].send_json({
+            'id': 1, 'type': 'event', 'event': {
+                'event_type': 'state_changed',
+                'data': {
+                    'entity_id': 'light.kitchen',
+                    'new_state': {**STATES[0], 'state': 'on', 'last_updated': '2020-01-01T00:01:00+00:00'}
+                }
+            }
+        })
+        await connections[0].send_json({
+            'id': 1, 'type': 'event', 'event': {
+                'event_type': 'state_changed',
+                'data': {'entity_id': 'switch.fan', 'new_state': None}
+            }
+        })
+        await asyncio.sleep(0.05)
+        assert dut.state('light.kitchen')['state'] == 'on'
+        assert dut.state('switch.fan') is None
+
+        # Reconnect and resync
+        await connections[0].close()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if len(connections) == 2 and dut.state('switch.fan') is not None:
+                break
+        assert len(connections) == 2
+        assert dut.state('switch.fan')['state'] == 'on'
+        # The change is more recent than the loaded state
+        assert dut.state('light.kitchen')['state'] == 'on'
+
+        await dut.stop()
+
+
+@pytest.mark.asyncio
+async def test_mirror_invalid_auth():
+    async with hass_websocket() as (base_url, _):
+        dut = HassStateMirror(base_url, 'wrong', reconnect_delay=0.01)
+        await dut.start()
+        with pytest.raises(asyncio.TimeoutError):
+            await dut.wait_ready(timeout=0.1)
+        assert not dut.connected
+        await dut.stop()
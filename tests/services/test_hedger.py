@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from homebot.services.base import Hedger
+
+
+class Upstream:
+    def __init__(self, latencies):
+        self.latencies = list(latencies)
+        self.started = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        latency = self.latencies[self.started]
+        self.started += 1
+        try:
+            await asyncio.sleep(latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return latency
+
+
+def warmed_up(latency=0.01, **kwargs):
+    dut = Hedger(min_samples=5, budget=1.0, burst=1.0, **kwargs)
+    for _ in range(50):
+        dut.record(latency)
+    return dut
+
+
+@pytest.mark.asyncio
+async def test_no_hedging_without_samples():
+    dut = Hedger(min_samples=5, budget=1.0)
+    upstream = Upstream([0.05, 0.0])
+    assert await dut(upstream) == 0.05
+    assert upstream.started == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_wins():
+    dut = warmed_up()
+    upstream = Upstream([1.0, 0.0])
+    assert await dut(upstream) == 0.0
+    assert upstream.started == 2
+    await asyncio.sleep(0)
+    assert upstream.cancelled == 1
+    assert dut.hedged == 1
+
+
+@pytest.mark.asyncio
+async def test_fast_call_is_not_hedged():
+    dut = warmed_up(latency=0.1)
+    upstream = Upstream([0.0, 0.0])
+    assert await dut(upstream) == 0.0
+    assert upstream.started == 1
+
+
+@pytest.mark.asyncio
+async def test_budget():
+    dut = warmed_up()
+    dut.budget = 0.5
+    results = [await dut(Upstream([0.03, 0.0])) for _ in range(4)]
+    assert dut.hedged == 2
+    assert sorted(results) == [0.0, 0.0, 0.03, 0.03]
+
+
+@pytest.mark.asyncio
+async def test_failing_call_falls_back_to_hedged_call():
+    dut = warmed_up()
+
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(0.03)
+            raise RuntimeError("upstream failed")
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    assert await dut(flaky) == "ok"
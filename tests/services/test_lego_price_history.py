@@ -0,0 +1,38 @@
+import attr
+
+from homebot.services.lego import LegoPricing, PriceHistory
+
+PRICING = LegoPricing('LEGO Chevrolet Corvette ZR1', 42093, '', 36.99, 39.99, 53.95, 23.99)
+
+
+def test_batched_writes(tmp_path):
+    path = str(tmp_path / 'prices.db')
+    dut = PriceHistory(path, batch_size=3)
+    for i, current in enumerate([36.99, 30.0]):
+        dut.record(attr.evolve(PRICING, current=current), recorded=i)
+    assert dut.pending == 2
+    assert PriceHistory(path).lows([42093]) == {}  # Nothing written yet
+
+    dut.record(attr.evolve(PRICING, set_id=10001, current=9.99), recorded=2)
+    assert dut.pending == 0
+    assert PriceHistory(path).lows([42093, 10001, 5]) == {42093: 30.0, 10001: 9.99}
+
+
+def test_all_time_low(tmp_path):
+    dut = PriceHistory(str(tmp_path / 'prices.db'))
+    assert dut.all_time_low(PRICING) == 23.99  # By brickwatch
+    dut.record(attr.evolve(PRICING, current=19.99))
+    dut.close()
+
+    dut = PriceHistory(str(tmp_path / 'prices.db'))
+    assert dut.all_time_low(PRICING) == 19.99  # By history
+    assert dut.all_time_low(attr.evolve(PRICING, current=15.0)) == 15.0
+
+
+def test_query_uses_index(tmp_path):
+    dut = PriceHistory(str(tmp_path / 'prices.db'))
+    plan = dut._conn.execute(
+        "EXPLAIN QUERY PLAN SELECT set_id, MIN(current) FROM prices WHERE set_id IN (?) GROUP BY set_id",
+        [42093]
+    ).fetchall()
+    assert any('prices_set_id_current' in str(row) for row in plan)
@@ -0,0 +1,98 @@
+import os
+import threading
+
+import pytest
+
+from homebot.formatter.slack import Template
+from homebot.models import SlackMessageTemplate, Context, Incoming
+from homebot.services.base import Offloader
+
+
+def render(template, payload):
+    return template.format(Context(Incoming()), payload)
+
+
+class Page:
+    pickled = 0
+
+    def __init__(self, text):
+        self.text = text
+
+    def __getstate__(self):
+        Page.pickled += 1
+        return self.__dict__
+
+
+def length(page):
+    return len(page.text)
+
+
+def new_lock():
+    return threading.Lock()
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+@pytest.mark.asyncio
+async def test_process_pool():
+    dut = Offloader('process', max_workers=1)
+    try:
+        assert await dut.run(os.getpid) != os.getpid()
+        # Lambdas cannot be pickled: They are run in a thread instead
+        assert await dut.run(lambda: threading.current_thread().name) == 'offload_0'
+    finally:
+        dut.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_mako_template_in_process(tmp_path):
+    tpl_file = tmp_path / 'tpl.mako'
+    tpl_file.write_text('<% import os %>{"text": "${payload} from ${os.getpid()}"}')
+    tpl = Template(SlackMessageTemplate.from_file(tpl_file))
+    dut = Offloader('process', max_workers=1)
+    try:
+        res = await dut.run(render, tpl, 'pong')
+    finally:
+        dut.shutdown()
+    assert res.text.startswith('pong from ')
+    assert res.text != f'pong from {os.getpid()}'
+
+
+@pytest.mark.asyncio
+async def test_process_pool_pickles_once():
+    dut = Offloader('process', max_workers=1)
+    try:
+        Page.pickled = 0
+        assert await dut.run(length, Page('x' * 1000)) == 1000
+        assert Page.pickled == 1
+    finally:
+        dut.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_pool_falls_back_on_unpicklable_results():
+    dut = Offloader('process', max_workers=1)
+    try:
+        lock = await dut.run(new_lock)
+        assert isinstance(lock, type(threading.Lock()))
+        assert dut._fallback is not None
+    finally:
+        dut.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_pool_raises_errors_of_the_function():
+    dut = Offloader('process', max_workers=1)
+    try:
+        with pytest.raises(ValueError, match="broken"):
+            await dut.run(fail, 'broken')
+        assert dut._fallback is None  # Not run again in a thread
+    finally:
+        dut.shutdown()
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError, match="mode"):
+        Offloader('fiber')
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from homebot.services.traffic import CachedTrafficService, TrafficService, TrafficInfo
+
+
+class CountingService(TrafficService):
+    def __init__(self):
+        super().__init__()
+        self.pulls = []
+
+    async def pull(self, origin: str, destination: str, only_direct: bool = False, offset: int = 0) -> TrafficInfo:
+        self.pulls.append((origin, destination, only_direct, offset))
+        await asyncio.sleep(0.01)
+        return TrafficInfo(origin=origin, destination=destination, connections=[])
+
+
+@pytest.mark.asyncio
+async def test_pull_is_cached():
+    service = CountingService()
+    dut = CachedTrafficService(service)
+    res = await dut.pull('Frankfurt', 'Mainz')
+    assert res == TrafficInfo(origin='Frankfurt', destination='Mainz', connections=[])
+    res = await dut.pull('frankfurt ', 'MAINZ')
+    assert res.origin == 'frankfurt'
+    assert len(service.pulls) == 1
+
+    await dut.pull('Frankfurt', 'Mainz', only_direct=True)
+    await dut.pull('Frankfurt', 'Mainz', offset=30)
+    assert len(service.pulls) == 3
+
+
+@pytest.mark.asyncio
+async def test_concurrent_pulls_are_shared():
+    service = CountingService()
+    dut = CachedTrafficService(service)
+    await asyncio.gather(*[dut.pull('Frankfurt', 'Mainz') for _ in range(5)])
+    assert len(service.pulls) == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_lru():
+    service = CountingService()
+    dut = CachedTrafficService(service, ttl=0.0)
+    await dut.pull('Frankfurt', 'Mainz')
+    await dut.pull('Frankfurt', 'Mainz')
+    assert len(service.pulls) == 2
+
+    service.pulls.clear()
+    dut = CachedTrafficService(service, max_entries=2)
+    for destination in ['Mainz', 'Wiesbaden', 'Mainz', 'Darmstadt', 'Mainz', 'Wiesbaden']:
+        await dut.pull('Frankfurt', destination)
+    assert [pull[1] for pull in service.pulls] == ['Mainz', 'Wiesbaden', 'Darmstadt', 'Wiesbaden']
+
+
+@pytest.mark.asyncio
+async def test_prefetch_popular_routes():
+    service = CountingService()
+    dut = CachedTrafficService(service, top_n=1, ttl=0.0)
+    for destination in ['Mainz', 'Wiesbaden', 'Mainz']:
+        await dut.pull('Frankfurt', destination)
+    assert dut.popular_routes() == [('frankfurt', 'mainz', False)]
+
+    service.pulls.clear()
+    await dut.prefetch()
+    assert service.pulls == [('Frankfurt', 'Mainz', False, 0)]
+
+
+def test_is_peak():
+    dut = CachedTrafficService(CountingService(), peak_hours=[('07:00', '09:00')], lead=600)
+    assert dut._is_peak(datetime(2020, 1, 1, 6, 55))
+    assert dut._is_peak(datetime(2020, 1, 1, 8, 30))
+    assert not dut._is_peak(datetime(2020, 1, 1, 6, 45))
+    assert not dut._is_peak(datetime(2020, 1, 1, 9, 5))
+
+
+def test_wrapper_has_no_breaker_or_limiter():
+    from homebot.services.base import AdaptiveLimiter, CircuitBreaker
+
+    dut = CachedTrafficService(CountingService())
+    assert (dut.breaker, dut.limiter) == (None, None)
+    assert 'CachedTrafficService' not in [breaker.name for breaker in CircuitBreaker.all()]
+    assert 'CachedTrafficService' not in [limiter.name for limiter in AdaptiveLimiter.all()]
+
+
+@pytest.mark.asyncio
+async def test_request_counts_are_bounded():
+    dut = CachedTrafficService(CountingService(), max_entries=2)
+    for _ in range(3):
+        await dut.pull('Frankfurt', 'Mainz')
+    for i in range(10):
+        await dut.pull('Frankfurt', f'Nowhere {i}')
+    assert len(dut._requests) <= 4
+    assert set(dut._names) == set(dut._requests)
+    assert dut.popular_routes()[0] == ('frankfurt', 'mainz', False)
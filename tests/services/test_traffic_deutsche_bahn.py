@@ -42,3 +42,10 @@ async def test_pull():
                 )
             ]
         )
+
+
+def test_blocking_calls_are_not_hedged():
+    from homebot.services.base import Hedger
+
+    with pytest.raises(ValueError, match="DeutscheBahnAsync"):
+        DeutscheBahn(hedger=Hedger())
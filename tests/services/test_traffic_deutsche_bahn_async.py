@@ -0,0 +1,79 @@
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from homebot.services.traffic import DeutscheBahnAsync, TrafficConnection
+
+RESOURCES = os.path.join(os.path.dirname(__file__), '../resources/sites/bahn')
+
+
+def recorded(name):
+    with open(os.path.join(RESOURCES, name), 'r') as fp:
+        return fp.read()
+
+
+@asynccontextmanager
+async def bahn_api():
+    """Local stand-in for mobile.bahn.de that serves recorded responses."""
+    requests = []
+
+    async def query(request):
+        requests.append(dict(request.query))
+        page = 'details.html' if 'HWAI' in request.query else 'overview.html'
+        return web.Response(text=recorded(page), content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get(DeutscheBahnAsync.QUERY_PATH, query)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        yield str(server.make_url('/')), requests
+    finally:
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_pull():
+    async with bahn_api() as (base_url, requests):
+        dut = DeutscheBahnAsync(base_url=base_url)
+        try:
+            res = await dut.pull(origin='Frankfurt', destination='Mainz', only_direct=True)
+        finally:
+            await dut.close()
+
+    assert requests[0]['S'] == 'Frankfurt'
+    assert requests[0]['Z'] == 'Mainz'
+    assert requests[0]['REQ0JourneyProduct_opt0'] == '1'
+    # Only the delayed connection needs its details
+    assert len(requests) == 2
+    assert requests[1]['HWAI'] == 'CONNECTION$C0-1!details=opened!detailsVerbund=opened!'
+
+    assert res.origin == 'Frankfurt'
+    assert res.destination == 'Mainz'
+    assert res.connections == [
+        TrafficConnection(
+            arrival='11:43', canceled=False, departure='11:02', products=['S 8'], transfers=0,
+            travel_time='0:41', delayed=False, delay_departure=0, delay_arrival=0
+        ),
+        TrafficConnection(
+            arrival='11:47', canceled=False, departure='11:17', products=['RE 4', 'S 8'], transfers=1,
+            travel_time='0:30', delayed=True, delay_departure=5, delay_arrival=3
+        )
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pull_fails_on_http_error():
+    app = web.Application()
+    server = TestServer(app)
+    await server.start_server()
+    dut = DeutscheBahnAsync(base_url=str(server.make_url('/')))
+    try:
+        with pytest.raises(RuntimeError, match="Http Code: 404"):
+            await dut.pull(origin='Frankfurt', destination='Mainz')
+    finally:
+        await dut.close()
+        await server.close()
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from homebot.services.traffic import (
+    TrafficHistory, TrafficInfo, TrafficConnection, RecordingTrafficService, TrafficService
+)
+
+DAY = 86400.0
+
+
+def connection(departure, delay=0, canceled=False):
+    return TrafficConnection('12:00', canceled, departure, ['RE 4'], 0, '0:30', delay > 0, delay, delay)
+
+
+def test_append_and_reopen(tmp_path):
+    TrafficHistory.INITIAL_CAPACITY, capacity = 2, TrafficHistory.INITIAL_CAPACITY
+    try:
+        dut = TrafficHistory(str(tmp_path))
+        dut.append(TrafficInfo('Frankfurt', 'Mainz', [connection('07:42', 3), connection('07:57')]), recorded=DAY)
+        dut.append(TrafficInfo('Frankfurt', 'Wiesbaden', [connection('07:45', canceled=True)]), recorded=DAY)
+        assert len(dut) == 3
+    finally:
+        TrafficHistory.INITIAL_CAPACITY = capacity
+
+    dut = TrafficHistory(str(tmp_path))
+    assert len(dut) == 3
+    rows = dut.select('FRANKFURT', 'mainz')
+    assert rows['departure'].tolist() == [462, 477]
+    assert rows['delay_departure'].tolist() == [3, 0]
+    assert dut.select('Frankfurt', 'Wiesbaden')['canceled'].tolist() == [True]
+    assert len(dut.select('Mainz', 'Frankfurt')['route']) == 0
+
+
+def test_select_keeps_latest_observation(tmp_path):
+    dut = TrafficHistory(str(tmp_path))
+    for recorded, delay in [(DAY, 0), (DAY + 60, 5), (2 * DAY, 1)]:
+        dut.append(TrafficInfo('Frankfurt', 'Mainz', [connection('07:42', delay)]), recorded=recorded)
+    rows = dut.select('Frankfurt', 'Mainz', departure='7:42')
+    assert rows['delay_departure'].tolist() == [5, 1]
+    assert np.all(rows['recorded'] == [DAY + 60, 2 * DAY])
+
+
+class StaticService(TrafficService):
+    async def pull(self, origin: str, destination: str, only_direct: bool = False, offset: int = 0) -> TrafficInfo:
+        return TrafficInfo(origin, destination, [connection('07:42', 2)])
+
+
+@pytest.mark.asyncio
+async def test_recording_service(tmp_path):
+    dut = RecordingTrafficService(StaticService(), TrafficHistory(str(tmp_path)))
+    res = await dut.pull('Frankfurt', 'Mainz')
+    assert len(list(res.connections)) == 1
+    assert len(dut.history) == 1
+
+
+def test_recording_service_has_no_breaker_or_limiter(tmp_path):
+    dut = RecordingTrafficService(StaticService(), TrafficHistory(str(tmp_path)))
+    assert (dut.breaker, dut.limiter) == (None, None)